@@ -0,0 +1,202 @@
+"""
+Xử lý hàng loạt nhiều video không cần giao diện (headless).
+
+Mỗi tiến trình worker giữ một VehicleCounter riêng (model chỉ tải một lần
+cho mỗi tiến trình), các video được chia đều cho các worker và kết quả đếm
+của từng video được ghi ra JSON/CSV.
+"""
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from detection_cache import cache_path_for
+from pipeline import PreprocessPipeline
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+# Trạng thái riêng của từng tiến trình worker
+_worker_counter = None
+_worker_counter_kwargs = None
+
+
+def collect_videos(inputs):
+    """
+    Gom danh sách file video từ các thư mục, file hoặc mẫu glob.
+
+    Returns:
+        list: Đường dẫn video đã sắp xếp, không trùng lặp
+    """
+    videos = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                path = os.path.join(item, name)
+                if os.path.isfile(path) and name.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.append(path)
+        elif os.path.isfile(item):
+            videos.append(item)
+        else:
+            videos.extend(path for path in sorted(glob.glob(item, recursive=True))
+                          if path.lower().endswith(VIDEO_EXTENSIONS))
+    # Bỏ trùng nhưng giữ thứ tự
+    return list(dict.fromkeys(os.path.abspath(path) for path in videos))
+
+
+def process_video_file(counter, video_path, progress_callback=None, cache_dir=None,
+                       decode_size=None, video_dir=None, output_options=None):
+    """
+    Chạy đếm trên toàn bộ một video bằng counter đã khởi tạo sẵn.
+
+    Args:
+        counter: VehicleCounter (sẽ được reset bộ đếm và tracker trước khi chạy)
+        video_path: Đường dẫn video
+        progress_callback: Hàm nhận (frame_count, total_frames), gọi mỗi 30 frame
+        cache_dir: Thư mục lưu cache detection (<tên video>.detections) để đếm lại
+            bằng VehicleCounter.replay(); None = không ghi
+        decode_size: Giải mã với cạnh dài tối đa này (None = độ phân giải gốc, xem
+            video_input.py)
+        video_dir: Thư mục ghi video có overlay (<tên video>_processed.mp4); None = không ghi
+        output_options: OutputOptions của video đầu ra (xem video_output.py)
+
+    Returns:
+        dict: Tóm tắt kết quả đếm của video
+    """
+    counter.reset_counts()
+    counter.reset_tracker()
+    counter.timers.reset()
+
+    # Decode chạy ở luồng riêng, chồng lên thời gian inference
+    cache_path = cache_path_for(video_path, cache_dir) if cache_dir else None
+    output_path = (os.path.join(video_dir, os.path.splitext(os.path.basename(video_path))[0]
+                                + '_processed.mp4') if video_dir else None)
+    pipeline = PreprocessPipeline(counter, video_path, output_path=output_path,
+                                  cache_path=cache_path, decode_size=decode_size,
+                                  output_options=output_options)
+    start_time = time.time()
+    frame_count = pipeline.run(
+        progress_callback=(lambda n, stats: progress_callback(n, stats['total_frames']))
+        if progress_callback else None)
+    elapsed = time.time() - start_time
+
+    return {
+        'video': video_path,
+        'frames': frame_count,
+        'processing_time': round(elapsed, 3),
+        'processing_fps': round(frame_count / elapsed, 2) if elapsed > 0 else 0.0,
+        'count_up': counter.count_up,
+        'count_down': counter.count_down,
+        'total': counter.count_up + counter.count_down,
+        'classes': counter.get_class_counts(),
+        # Số đếm theo từng đường/vùng bổ sung (None nếu không có layout)
+        'layout': counter.get_layout_counts(),
+        'cache': cache_path,
+        'output_video': output_path,
+        # Tỷ lệ lần gọi detector được motion gate bỏ qua (None nếu không bật)
+        'detector_skip_ratio': (counter.gate_stats() or {}).get('skip_ratio'),
+        # Độ trễ từng bước (chỉ khi counter bật timings)
+        'stage_timings': counter.timers.snapshot()['stages'] if counter.timers.enabled else None,
+        'error': None,
+    }
+
+
+def _init_worker(counter_kwargs, threads_per_worker):
+    """Khởi tạo tiến trình worker: giới hạn số luồng để các worker không tranh CPU"""
+    global _worker_counter_kwargs
+    _worker_counter_kwargs = counter_kwargs
+    cv2.setNumThreads(threads_per_worker)
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+
+
+def _get_worker_counter():
+    """Tải model một lần cho mỗi worker, dùng lại cho mọi video của worker đó"""
+    global _worker_counter
+    if _worker_counter is None:
+        from vehicle_counter import VehicleCounter
+        _worker_counter = VehicleCounter(**_worker_counter_kwargs)
+    return _worker_counter
+
+
+def _process_in_worker(video_path, cache_dir=None, decode_size=None, video_dir=None,
+                       output_options=None):
+    """Hàm chạy trong worker - lỗi của một video không làm hỏng cả batch"""
+    try:
+        return process_video_file(_get_worker_counter(), video_path, cache_dir=cache_dir,
+                                  decode_size=decode_size, video_dir=video_dir,
+                                  output_options=output_options)
+    except Exception as e:
+        return {'video': video_path, 'frames': 0, 'error': str(e)}
+
+
+def run_batch(videos, counter_kwargs, workers=None, on_result=None, cache_dir=None,
+              decode_size=None, video_dir=None, output_options=None):
+    """
+    Chia các video cho một process pool, mỗi worker một VehicleCounter.
+
+    Args:
+        videos: Danh sách đường dẫn video
+        counter_kwargs: Tham số khởi tạo VehicleCounter
+        workers: Số tiến trình (mặc định: một nửa số core)
+        on_result: Hàm được gọi với mỗi summary ngay khi video xử lý xong
+        cache_dir: Thư mục lưu cache detection của từng video (None = không ghi)
+        decode_size: Giải mã với cạnh dài tối đa này (None = độ phân giải gốc)
+        video_dir, output_options: Ghi video có overlay, xem process_video_file
+
+    Returns:
+        list: Các summary theo đúng thứ tự của videos
+    """
+    cpu_count = os.cpu_count() or 1
+    if workers is None:
+        workers = max(1, cpu_count // 2)
+    workers = max(1, min(workers, len(videos) or 1))
+    threads_per_worker = max(1, cpu_count // workers)
+
+    # 'spawn' an toàn với CUDA và với các luồng của OpenCV/PyTorch
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(counter_kwargs, threads_per_worker)) as pool:
+        futures = {pool.submit(_process_in_worker, path, cache_dir, decode_size, video_dir,
+                               output_options): path
+                   for path in videos}
+        for future in as_completed(futures):
+            summary = future.result()
+            results[futures[future]] = summary
+            if on_result:
+                on_result(summary)
+    return [results[path] for path in videos]
+
+
+def write_summaries_json(summaries, path):
+    """Ghi toàn bộ summary ra một file JSON"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, ensure_ascii=False, indent=2)
+
+
+def write_summaries_csv(summaries, path, class_names=('Car', 'Motorbike', 'Bus', 'Truck')):
+    """Ghi summary ra CSV, mỗi video một dòng, mỗi loại xe có cột up/down/total"""
+    fieldnames = ['video', 'frames', 'processing_time', 'processing_fps',
+                  'count_up', 'count_down', 'total', 'detector_skip_ratio']
+    for name in class_names:
+        fieldnames += [f'{name}_up', f'{name}_down', f'{name}_total']
+    fieldnames.append('error')
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        for summary in summaries:
+            row = dict(summary)
+            for name, counts in summary.get('classes', {}).items():
+                for key in ('up', 'down', 'total'):
+                    row[f'{name}_{key}'] = counts[key]
+            writer.writerow(row)
@@ -0,0 +1,416 @@
+"""
+Micro-benchmark cho các đường xử lý nóng, không cần model thật hay video.
+
+Dữ liệu đầu vào là cảnh giả lập (SyntheticScene): N xe chạy dọc qua đường
+đếm theo kiểu chuyển động và tỷ lệ loại xe tùy chọn, mỗi frame sinh ra một
+kết quả có cùng dạng với results của Ultralytics (boxes.xyxy/id/cls/conf với
+.cpu().numpy()). Frame ảnh là nhiễu cố định. Bài đo end-to-end dùng
+StubDetector thay YOLO nên chạy được trên máy chỉ có CPU, không mạng.
+
+Mỗi bài đo báo ops/giây (lấy lần nhanh nhất trong vài lượt) và bộ nhớ cấp
+phát đỉnh mỗi lần gọi (tracemalloc, đo ở lượt riêng). So với baseline đã lưu
+(logs/benchmark_baseline.json), bài nào chậm hơn tolerance lần thì báo lỗi:
+
+    python -m vehicle_counter bench --save-baseline   # lưu baseline trên máy này
+    python -m vehicle_counter bench                   # so sánh, mã thoát 1 nếu chậm đi
+"""
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from counting_zones import CountingLayout, CountingLine, CountingZone
+from vehicle_counter import VehicleCounter, as_detections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE_PATH = os.path.join('logs', 'benchmark_baseline.json')
+MOTIONS = ('linear', 'jitter', 'stop_and_go')
+DEFAULT_CLASS_MIX = {2: 0.6, 3: 0.25, 5: 0.05, 7: 0.1}
+# Kích thước box (rộng, cao) theo loại xe, pixel ở frame 1280x720
+_BOX_SIZES = {2: (90, 70), 3: (35, 55), 5: (160, 120), 7: (140, 110)}
+
+
+class _Array:
+    """Giả lập tensor: .cpu().numpy() trả về mảng NumPy"""
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._data
+
+
+class _Boxes:
+    __slots__ = ('xyxy', 'id', 'cls', 'conf')
+
+    def __init__(self, xyxy, ids, classes, confidences):
+        self.xyxy = _Array(xyxy)
+        self.id = _Array(ids)
+        self.cls = _Array(classes)
+        self.conf = _Array(confidences)
+
+
+class _Result:
+    __slots__ = ('boxes',)
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class SyntheticScene:
+    def __init__(self, tracks=50, frame_size=(720, 1280), motion='linear', class_mix=None,
+                 fps=30.0, seed=0):
+        """
+        Args:
+            tracks: Số xe có mặt trong khung hình ở mỗi frame
+            frame_size: (cao, rộng) của frame
+            motion: 'linear' (tốc độ đều), 'jitter' (gần như đứng yên, rung nhẹ),
+                'stop_and_go' (tốc độ dao động, có lúc dừng hẳn)
+            class_mix: dict class -> tỷ lệ (mặc định DEFAULT_CLASS_MIX)
+        """
+        if motion not in MOTIONS:
+            raise ValueError(f"Kiểu chuyển động không hỗ trợ: {motion} (chọn {MOTIONS})")
+        self.tracks = tracks
+        self.height, self.width = frame_size
+        self.motion = motion
+        self.fps = fps
+        mix = class_mix or DEFAULT_CLASS_MIX
+        self._classes = np.array(list(mix), dtype=np.int64)
+        self._weights = np.array(list(mix.values()), dtype=np.float64)
+        self._weights /= self._weights.sum()
+        self._sizes = np.array([_BOX_SIZES.get(int(cls), (60, 60)) for cls in self._classes],
+                               dtype=np.float64)
+        self._rng = np.random.default_rng(seed)
+        self._next_id = 1
+        self.frame_index = 0
+        self.ids = np.zeros(tracks, dtype=np.int64)
+        self.cls = np.zeros(tracks, dtype=np.int64)
+        self.kind = np.zeros(tracks, dtype=np.int64)  # Chỉ số loại xe trong class_mix
+        self.x = np.zeros(tracks)
+        self.y = np.zeros(tracks)
+        self.speed = np.zeros(tracks)
+        self.phase = np.zeros(tracks)
+        self._spawn(np.arange(tracks), anywhere=True)
+
+    def _spawn(self, index, anywhere=False):
+        """Tạo xe mới (ID mới) ở mép trên/dưới, hoặc bất kỳ đâu lúc bắt đầu"""
+        count = len(index)
+        if count == 0:
+            return
+        rng = self._rng
+        self.ids[index] = np.arange(self._next_id, self._next_id + count)
+        self._next_id += count
+        self.kind[index] = rng.choice(len(self._classes), size=count, p=self._weights)
+        self.cls[index] = self._classes[self.kind[index]]
+        self.x[index] = rng.uniform(0.05, 0.95, count) * self.width
+        # Nửa đi xuống, nửa đi lên; tốc độ ~ 1/4 chiều cao mỗi giây
+        down = rng.random(count) < 0.5
+        speed = rng.uniform(0.15, 0.35, count) * self.height / self.fps
+        self.speed[index] = np.where(down, speed, -speed)
+        self.phase[index] = rng.uniform(0, 2 * np.pi, count)
+        if anywhere:
+            self.y[index] = rng.uniform(0, self.height, count)
+        else:
+            self.y[index] = np.where(down, 0.0, float(self.height))
+
+    def step(self):
+        """Tiến một frame và trả về kết quả dạng Ultralytics"""
+        if self.motion == 'linear':
+            self.y += self.speed
+        elif self.motion == 'jitter':
+            self.y += self._rng.normal(0, 1.5, self.tracks)
+        else:
+            factor = np.maximum(0.0, np.sin(self.frame_index / self.fps + self.phase)) * 2
+            self.y += self.speed * factor
+        self.frame_index += 1
+        self._spawn(np.flatnonzero((self.y < 0) | (self.y > self.height)))
+
+        size = self._sizes[self.kind]
+        half_w, half_h = size[:, 0] / 2.0, size[:, 1] / 2.0
+        xyxy = np.column_stack([self.x - half_w, self.y - half_h,
+                                self.x + half_w, self.y + half_h]).astype(np.float32)
+        confidences = self._rng.uniform(0.4, 0.95, self.tracks).astype(np.float32)
+        return [_Result(_Boxes(xyxy, self.ids.astype(np.float32),
+                               self.cls.astype(np.float32), confidences))]
+
+    def results(self, count):
+        """Kết quả của count frame liên tiếp (tạo trước, không tính vào thời gian đo)"""
+        return [self.step() for _ in range(count)]
+
+    def timestamp(self, index):
+        return index / self.fps
+
+    def frame(self, seed=0):
+        """Frame BGR nhiễu cố định"""
+        rng = np.random.default_rng(seed)
+        return rng.integers(0, 255, (self.height, self.width, 3), dtype=np.uint8)
+
+
+class StubDetector:
+    """
+    Thay model YOLO trong VehicleCounter: track() trả kết quả của SyntheticScene
+    (tọa độ theo ảnh inference như model thật), không tốn thời gian inference.
+    """
+
+    def __init__(self, scene):
+        self.scene = scene
+
+    def track(self, frame, **kwargs):
+        results = self.scene.step()
+        # Box của cảnh theo frame gốc; model thật trả box theo ảnh đã resize
+        scale_x = frame.shape[1] / self.scene.width
+        scale_y = frame.shape[0] / self.scene.height
+        xyxy = results[0].boxes.xyxy.numpy()
+        xyxy[:, [0, 2]] *= scale_x
+        xyxy[:, [1, 3]] *= scale_y
+        return results
+
+    def predict(self, frames, **kwargs):
+        raise NotImplementedError("StubDetector chỉ hỗ trợ track() (batch_size=1)")
+
+
+def _demo_layout():
+    """Hai đường chéo và một vùng, tọa độ tỷ lệ"""
+    return CountingLayout(
+        lines=[CountingLine('A', (0.05, 0.45), (0.95, 0.55)),
+               CountingLine('B', (0.5, 0.1), (0.5, 0.9))],
+        zones=[CountingZone('Z', [(0.3, 0.3), (0.7, 0.3), (0.7, 0.8), (0.3, 0.8)])])
+
+
+def _stub_counter(scene, **kwargs):
+    # Không nạp model: gắn detector giả sau khi tạo (tracker của model, batch_size=1)
+    counter = VehicleCounter(model_path=None, **kwargs)
+    counter.model = StubDetector(scene)
+    return counter
+
+
+def _display(frame, max_width=960, max_height=540):
+    """Đường hiển thị của GUI: BGR -> RGB, thu nhỏ vừa khung, chuyển sang ảnh PIL"""
+    from PIL import Image
+
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    height, width = frame_rgb.shape[:2]
+    ratio = min(max_width / width, max_height / height, 1.0)
+    display = cv2.resize(frame_rgb, (int(width * ratio), int(height * ratio)))
+    return Image.fromarray(display)
+
+
+class Benchmark:
+    def __init__(self, name, setup, iterations):
+        """
+        Args:
+            setup: Hàm trả về (op, state) - op(state, i) là một lần gọi được đo;
+                gọi lại cho mỗi lượt để trạng thái (counter, tracker) bắt đầu lại
+            iterations: Số lần gọi mỗi lượt
+        """
+        self.name = name
+        self.setup = setup
+        self.iterations = iterations
+
+    def _round(self):
+        op, state = self.setup()
+        start = time.perf_counter()
+        for i in range(self.iterations):
+            op(state, i)
+        return time.perf_counter() - start
+
+    def _allocations(self, samples):
+        """Bộ nhớ cấp phát đỉnh trung bình mỗi lần gọi (byte)"""
+        op, state = self.setup()
+        # Vài lần gọi đầu để cache/bảng track đạt trạng thái ổn định
+        warm = min(self.iterations // 2, 20)
+        for i in range(warm):
+            op(state, i)
+        peaks = []
+        tracemalloc.start()
+        try:
+            for i in range(warm, min(warm + samples, self.iterations)):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                op(state, i)
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+        return int(np.median(peaks)) if peaks else 0
+
+    def run(self, rounds=3, alloc_samples=20):
+        best = min(self._round() for _ in range(rounds))
+        return {
+            'ops_per_sec': round(self.iterations / best, 1),
+            'us_per_op': round(best / self.iterations * 1e6, 2),
+            'alloc_peak_kb': round(self._allocations(alloc_samples) / 1024, 1),
+        }
+
+
+def build_benchmarks(tracks=(50, 500), motion='linear', class_mix=None, quick=False):
+    """
+    Danh sách bài đo mặc định.
+
+    Args:
+        tracks: Các số xe mỗi frame cần đo update_counts/draw_results
+        motion, class_mix: Xem SyntheticScene
+        quick: Ít lần gọi hơn (kiểm tra nhanh, số đo nhiễu hơn)
+    """
+    scale = 0.2 if quick else 1.0
+
+    def iterations(count):
+        return max(10, int(count * scale))
+
+    def scene(count):
+        return SyntheticScene(tracks=count, motion=motion, class_mix=class_mix)
+
+    benchmarks = []
+    for count in tracks:
+        frames = iterations(2000 if count <= 100 else 500)
+
+        def update_counts(count=count, frames=frames, layout=False):
+            def setup():
+                source = scene(count)
+                counter = VehicleCounter(model_path=None,
+                                         layout=_demo_layout() if layout else None)
+                return (lambda state, i: counter.update_counts(
+                    state[i], source.height, timestamp=source.timestamp(i),
+                    frame_width=source.width)), source.results(frames)
+            return setup
+
+        benchmarks.append(Benchmark(f'update_counts[{count}]', update_counts(), frames))
+        benchmarks.append(Benchmark(f'update_counts_layout[{count}]',
+                                    update_counts(layout=True), frames))
+
+        def predicted(count=count, frames=frames):
+            # Frame không chạy detector (inference_stride): dự đoán vị trí rồi đếm
+            def setup():
+                source = scene(count)
+                counter = VehicleCounter(model_path=None, inference_stride=2)
+                results = source.results(frames)
+
+                def op(state, i):
+                    detections = as_detections(state[i]) if i % 2 == 0 else None
+                    counter.step(source.height, source.timestamp(i), detections,
+                                 frame_width=source.width)
+                return op, results
+            return setup
+
+        benchmarks.append(Benchmark(f'step_stride2[{count}]', predicted(), frames))
+
+        def draw(count=count, frames=iterations(300)):
+            def setup():
+                source = scene(count)
+                counter = VehicleCounter(model_path=None)
+                results = source.results(frames)
+                for i, result in enumerate(results):
+                    counter.update_counts(result, source.height, timestamp=source.timestamp(i))
+                base = source.frame()
+                canvas = base.copy()
+
+                def op(state, i):
+                    canvas[:] = base
+                    counter.draw_results(canvas, state[i])
+                return op, results
+            return setup
+
+        benchmarks.append(Benchmark(f'draw_results[{count}]', draw(), iterations(300)))
+
+    def display():
+        def setup():
+            frame = SyntheticScene(tracks=1).frame()
+            return (lambda state, i: _display(state)), frame
+        return setup
+
+    benchmarks.append(Benchmark('display_path[1280x720]', display(), iterations(300)))
+
+    def end_to_end():
+        # Một frame đầy đủ: resize inference + detector giả + đếm + vẽ
+        def setup():
+            source = scene(tracks[0])
+            counter = _stub_counter(source, inference_size=640)
+            base = source.frame()
+            canvas = base.copy()
+
+            def op(state, i):
+                canvas[:] = base
+                counter.process_frame(canvas, draw=True, timestamp=source.timestamp(i))
+            return op, None
+        return setup
+
+    benchmarks.append(Benchmark(f'end_to_end_stub[{tracks[0]}]', end_to_end(),
+                                iterations(300)))
+    return benchmarks
+
+
+def run_benchmarks(benchmarks, only=None, rounds=3, on_result=None):
+    """
+    Chạy các bài đo (only: chỉ các bài có tên chứa một trong các chuỗi này).
+
+    Returns:
+        dict: tên -> {'ops_per_sec', 'us_per_op', 'alloc_peak_kb'}
+    """
+    results = {}
+    for benchmark in benchmarks:
+        if only and not any(part in benchmark.name for part in only):
+            continue
+        try:
+            result = benchmark.run(rounds=rounds)
+        except ImportError as e:
+            # Ví dụ display_path khi chưa cài Pillow
+            logger.warning("Bỏ qua %s: %s", benchmark.name, e)
+            continue
+        results[benchmark.name] = result
+        if on_result:
+            on_result(benchmark.name, result)
+    return results
+
+
+def load_baseline(path=DEFAULT_BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=DEFAULT_BASELINE_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results},
+                  f, ensure_ascii=False, indent=2)
+
+
+def check_regression(results, baseline, tolerance=1.3, alloc_tolerance=1.5, min_alloc_kb=64):
+    """
+    So sánh với baseline.
+
+    Args:
+        tolerance: Chậm hơn tolerance lần thời gian mỗi lần gọi của baseline là chậm đi
+        alloc_tolerance, min_alloc_kb: Bộ nhớ cấp phát vượt alloc_tolerance lần và
+            tăng hơn min_alloc_kb là tăng bất thường
+
+    Returns:
+        list: (tên, chỉ số, giá trị hiện tại, baseline)
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        if result['us_per_op'] > tolerance * previous['us_per_op']:
+            regressions.append((name, 'us_per_op', result['us_per_op'], previous['us_per_op']))
+        alloc, previous_alloc = result['alloc_peak_kb'], previous['alloc_peak_kb']
+        if alloc > alloc_tolerance * previous_alloc and alloc - previous_alloc > min_alloc_kb:
+            regressions.append((name, 'alloc_peak_kb', alloc, previous_alloc))
+    return regressions
+
+
+if __name__ == '__main__':
+    # python benchmark.py [tham số của lệnh bench]
+    import sys
+    from cli import main
+    main(['bench'] + sys.argv[1:])
@@ -0,0 +1,336 @@
+"""
+Xử lý trước MỘT video dài bằng nhiều tiến trình.
+
+Video được chia thành N đoạn thời gian liên tiếp [start, end), mỗi đoạn chạy
+PreprocessPipeline trong một tiến trình riêng (mỗi tiến trình một model, như
+batch_processing). Mỗi đoạn (trừ đoạn đầu) bắt đầu đọc sớm hơn overlap giây
+để tracker "khởi động": khi tới frame start các track đã có ID, hướng và cờ
+đã đếm. Xe vượt đường đếm trước start thuộc về đoạn trước, từ start trở đi
+thuộc về đoạn sau.
+
+Khi ghép kết quả, ID của đoạn sau được nối với ID của đoạn trước bằng cách so
+vị trí các track trên những frame chồng lấn (cả hai đoạn cùng xử lý); xe đã
+được đoạn trước đếm thì lần đếm lại ở đoạn sau bị bỏ, giống cờ crossed khi
+chạy tuần tự. Cache detection của các đoạn (bỏ phần khởi động) được ghép
+thành một cache duy nhất với ID đã nối, dùng được cho recount/phát lại.
+"""
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from batch_processing import _get_worker_counter, _init_worker
+from detection_cache import DetectionCache, write_cache
+from pipeline import PreprocessPipeline
+from stage_timing import StageTimers
+
+# Thời gian chồng lấn mặc định giữa hai đoạn (giây), nên lớn hơn track_ttl
+DEFAULT_OVERLAP = 4.0
+# Khoảng cách tối đa (pixel) giữa tâm hai track để coi là cùng một xe
+MATCH_DISTANCE = 20.0
+# Số frame chồng lấn tối thiểu hai track phải trùng vị trí để được nối
+MIN_MATCH_FRAMES = 3
+# ID không nối được ở đoạn k được cộng k * ID_STRIDE để không trùng giữa các đoạn
+ID_STRIDE = 1 << 32
+
+
+def plan_segments(total_frames, segments, overlap_frames):
+    """
+    Chia [0, total_frames) thành các đoạn gần bằng nhau; mỗi đoạn dài ít nhất
+    gấp đôi phần chồng lấn (video ngắn thì ít đoạn hơn).
+
+    Returns:
+        list: (warmup_start, start, end) của từng đoạn; đoạn đầu không có khởi động
+    """
+    longest = total_frames // max(2 * overlap_frames, 1)
+    segments = max(1, min(segments, longest))
+    bounds = np.linspace(0, total_frames, segments + 1).astype(np.int64)
+    return [(int(max(0, start - overlap_frames)), int(start), int(end))
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _process_segment(index, video_path, warmup_start, start, end, overlap_frames,
+                     cache_path=None, progress_queue=None, decode_size=None):
+    """
+    Chạy trong worker: xử lý frame [warmup_start, end) của video.
+
+    Returns:
+        dict: Sự kiện vượt đường đếm, vị trí track ở hai đầu đoạn (để nối ID) và
+            đường dẫn cache của đoạn
+    """
+    counter = _get_worker_counter()
+    counter.reset_counts()
+    # Giữ đúng nhịp inference_stride và số frame toàn cục như khi chạy tuần tự
+    counter.reset_tracker(start_frame=warmup_start)
+    counter.timers.reset()
+    events = []
+    positions = []
+    tail_start = end - overlap_frames
+
+    def on_frame(frame_index, detections):
+        # Vị trí track ở phần khởi động (nối với đoạn trước) và phần cuối (nối với đoạn sau)
+        if frame_index < start or frame_index >= tail_start:
+            xyxy = detections.xyxy
+            positions.append((frame_index, detections.ids.copy(),
+                              (xyxy[:, 0] + xyxy[:, 2]) / 2.0,
+                              (xyxy[:, 1] + xyxy[:, 3]) / 2.0))
+
+    def on_progress(frames, stats):
+        progress_queue.put((index, frames))
+
+    listener = events.append
+    counter.crossing_listeners.append(listener)
+    started = time.time()
+    try:
+        pipeline = PreprocessPipeline(counter, video_path, cache_path=cache_path,
+                                      start_frame=warmup_start, end_frame=end,
+                                      decode_size=decode_size)
+        frames = pipeline.run(progress_callback=on_progress if progress_queue else None,
+                              progress_interval=300, on_frame=on_frame)
+    finally:
+        counter.crossing_listeners.remove(listener)
+    return {
+        'index': index,
+        'warmup_start': warmup_start,
+        'start': start,
+        'end': end,
+        'frames': frames,
+        'processing_time': time.time() - started,
+        'events': events,
+        'positions': positions,
+        'cache': cache_path,
+        'class_names': [counter.class_names[cls] for cls in counter.vehicle_classes],
+        'detector_skip_ratio': (counter.gate_stats() or {}).get('skip_ratio'),
+        'timers': counter.timers if counter.timers.enabled else None,
+    }
+
+
+def match_tracks(previous, current, max_distance=MATCH_DISTANCE, min_frames=MIN_MATCH_FRAMES):
+    """
+    Nối ID của đoạn sau với ID của đoạn trước qua các frame cả hai cùng xử lý.
+
+    Args:
+        previous, current: list (frame, ids, center_x, center_y) của hai đoạn
+
+    Returns:
+        dict: ID đoạn sau -> ID đoạn trước
+    """
+    previous_by_frame = {item[0]: item for item in previous}
+    # (ID sau, ID trước) -> [tổng khoảng cách, số frame trùng vị trí]
+    pairs = {}
+    for frame, ids, center_x, center_y in current:
+        other = previous_by_frame.get(frame)
+        if other is None or len(ids) == 0 or len(other[1]) == 0:
+            continue
+        _, previous_ids, previous_x, previous_y = other
+        distance = np.hypot(center_x[:, None] - previous_x[None, :],
+                            center_y[:, None] - previous_y[None, :])
+        for i, j in zip(*np.nonzero(distance < max_distance)):
+            total = pairs.setdefault((int(ids[i]), int(previous_ids[j])), [0.0, 0])
+            total[0] += float(distance[i, j])
+            total[1] += 1
+    # Ghép tham lam theo khoảng cách trung bình nhỏ nhất, mỗi ID chỉ ghép một lần
+    candidates = sorted((total / count, current_id, previous_id)
+                        for (current_id, previous_id), (total, count) in pairs.items()
+                        if count >= min_frames)
+    mapping, used = {}, set()
+    for _, current_id, previous_id in candidates:
+        if current_id in mapping or previous_id in used:
+            continue
+        mapping[current_id] = previous_id
+        used.add(previous_id)
+    return mapping
+
+
+def stitch_segments(results):
+    """
+    Ghép kết quả các đoạn: nối ID qua phần chồng lấn, bỏ lần đếm trùng.
+
+    Returns:
+        tuple: (summary số đếm, danh sách mapping ID cục bộ -> ID toàn cục của từng đoạn)
+    """
+    mappings = []
+    counted = set()
+    events = []
+    duplicates = 0
+    for k, result in enumerate(results):
+        mapping = {}
+        if k > 0:
+            previous = results[k - 1]
+            overlap = [item for item in previous['positions']
+                       if result['warmup_start'] <= item[0] < result['start']]
+            warmup = [item for item in result['positions'] if item[0] < result['start']]
+            previous_mapping = mappings[k - 1]
+            mapping = {current_id: previous_mapping.get(previous_id,
+                                                        previous_id + (k - 1) * ID_STRIDE)
+                       for current_id, previous_id in match_tracks(overlap, warmup).items()}
+        mappings.append(mapping)
+        for event in result['events']:
+            # Xe vượt đường trong phần khởi động đã thuộc về đoạn trước
+            if event['frame'] < result['start']:
+                continue
+            track_id = mapping.get(event['track_id'], event['track_id'] + k * ID_STRIDE)
+            if track_id in counted:
+                duplicates += 1
+                continue
+            counted.add(track_id)
+            events.append(dict(event, track_id=track_id))
+
+    classes = {name: {'up': 0, 'down': 0, 'total': 0} for name in results[0]['class_names']}
+    for event in events:
+        counts = classes.setdefault(event['class_name'], {'up': 0, 'down': 0, 'total': 0})
+        counts[event['direction']] += 1
+        counts['total'] += 1
+    count_up = sum(1 for event in events if event['direction'] == 'up')
+    summary = {
+        'count_up': count_up,
+        'count_down': len(events) - count_up,
+        'total': len(events),
+        'classes': classes,
+        'duplicates_removed': duplicates,
+        'events': events,
+    }
+    return summary, mappings
+
+
+def merge_caches(results, mappings, path):
+    """Ghép cache của các đoạn (bỏ phần khởi động) thành một cache với ID toàn cục"""
+    offsets, timestamps, flags = [np.zeros(1, dtype=np.int64)], [], []
+    columns = {'xyxy': [], 'ids': [], 'classes': [], 'confidences': []}
+    meta = None
+    for k, (result, mapping) in enumerate(zip(results, mappings)):
+        cache = DetectionCache(result['cache'])
+        if meta is None:
+            meta = dict(cache.meta)
+        first = result['start'] - result['warmup_start']
+        segment_offsets = np.asarray(cache.frame_offsets[first:])
+        rows = slice(int(segment_offsets[0]), int(segment_offsets[-1]))
+        offsets.append(segment_offsets[1:] - segment_offsets[0] + offsets[-1][-1])
+        timestamps.append(np.asarray(cache.timestamps[first:]))
+        flags.append(np.asarray(cache.flags[first:]))
+        unique_ids, inverse = np.unique(np.asarray(cache.ids[rows]), return_inverse=True)
+        global_ids = np.array([mapping.get(int(track_id), int(track_id) + k * ID_STRIDE)
+                               for track_id in unique_ids], dtype=np.int64)
+        columns['ids'].append(global_ids[inverse])
+        for name in ('xyxy', 'classes', 'confidences'):
+            columns[name].append(np.asarray(getattr(cache, name)[rows]))
+    meta.update(segments=len(results))
+    return write_cache(path, np.concatenate(offsets), np.concatenate(timestamps),
+                       np.concatenate(flags),
+                       {name: np.concatenate(parts) for name, parts in columns.items()}, meta)
+
+
+def _merge_timings(results):
+    """Gộp độ trễ từng bước của các đoạn (None nếu counter không bật timings)"""
+    parts = [result['timers'] for result in results if result['timers'] is not None]
+    if not parts:
+        return None
+    timers = StageTimers(window=None)
+    for part in parts:
+        timers.merge(part)
+    return timers.snapshot()['stages']
+
+
+def run_chunked(video_path, counter_kwargs, workers=None, overlap=DEFAULT_OVERLAP,
+                cache_path=None, progress_callback=None, decode_size=None):
+    """
+    Xử lý một video dài song song theo đoạn thời gian.
+
+    Args:
+        video_path: Video đầu vào
+        counter_kwargs: Tham số khởi tạo VehicleCounter cho mỗi worker
+        workers: Số tiến trình = số đoạn (mặc định: một nửa số core)
+        overlap: Thời gian chồng lấn giữa hai đoạn (giây) để tracker khởi động
+        cache_path: Thư mục cache detection của cả video (None = không ghi)
+        progress_callback: Hàm nhận (frames_processed, total_frames)
+        decode_size: Giải mã với cạnh dài tối đa này (None = độ phân giải gốc)
+
+    Returns:
+        dict: Tóm tắt như batch_processing.process_video_file, thêm 'segments',
+            'duplicates_removed' và 'events' (các lần vượt đường đếm theo thứ tự thời gian)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Không thể mở video: {video_path}")
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+
+    cpu_count = os.cpu_count() or 1
+    if workers is None:
+        workers = max(1, cpu_count // 2)
+    overlap_frames = int(round(overlap * fps))
+    plan = plan_segments(total_frames, workers, overlap_frames)
+    threads_per_worker = max(1, cpu_count // len(plan))
+    parts_dir = cache_path + '.parts' if cache_path else None
+    if parts_dir:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        os.makedirs(parts_dir)
+
+    # 'spawn' an toàn với CUDA và với các luồng của OpenCV/PyTorch
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager() if progress_callback else None
+    progress_queue = manager.Queue() if manager else None
+    started = time.time()
+    try:
+        with ProcessPoolExecutor(max_workers=len(plan), mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(counter_kwargs, threads_per_worker)) as pool:
+            futures = [
+                pool.submit(_process_segment, k, video_path, warmup_start, start, end,
+                            overlap_frames,
+                            os.path.join(parts_dir, f'{k}.detections') if parts_dir else None,
+                            progress_queue, decode_size)
+                for k, (warmup_start, start, end) in enumerate(plan)]
+            pending = set(futures)
+            sizes = [end - warmup_start for warmup_start, _, end in plan]
+            done_frames = [0] * len(plan)
+            reported = None
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                if progress_queue is None:
+                    continue
+                while not progress_queue.empty():
+                    k, frames = progress_queue.get_nowait()
+                    done_frames[k] = max(done_frames[k], frames)
+                for future in done:
+                    k = futures.index(future)
+                    done_frames[k] = sizes[k]
+                if sum(done_frames) != reported:
+                    reported = sum(done_frames)
+                    progress_callback(reported, sum(sizes))
+            results = [future.result() for future in futures]
+
+        summary, mappings = stitch_segments(results)
+        if cache_path:
+            merge_caches(results, mappings, cache_path)
+    finally:
+        if manager:
+            manager.shutdown()
+        if parts_dir:
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+    elapsed = time.time() - started
+    frames = sum(result['frames'] - (result['start'] - result['warmup_start'])
+                 for result in results)
+    skip_ratios = [result['detector_skip_ratio'] for result in results
+                   if result['detector_skip_ratio'] is not None]
+    summary.update({
+        'video': video_path,
+        'frames': frames,
+        'processing_time': round(elapsed, 3),
+        'processing_fps': round(frames / elapsed, 2) if elapsed > 0 else 0.0,
+        # Đường/vùng bổ sung: đếm lại trên cache đã ghép (recount --layout)
+        'layout': None,
+        'cache': cache_path,
+        'detector_skip_ratio': (round(float(np.mean(skip_ratios)), 4)
+                                if skip_ratios else None),
+        'segments': len(plan),
+        'stage_timings': _merge_timings(results),
+        'error': None,
+    })
+    return summary
@@ -0,0 +1,542 @@
+"""
+Giao diện dòng lệnh (headless) cho hệ thống đếm phương tiện.
+
+Ví dụ:
+    python -m vehicle_counter batch video/ --workers 4 --output-dir results
+    python -m vehicle_counter split recordings/cam1_3h.mp4 --workers 8 --cache
+    python -m vehicle_counter streams rtsp://cam1/stream rtsp://cam2/stream --event-log logs/events
+    python -m vehicle_counter live rtsp://cam1/stream --duration 600
+    python -m vehicle_counter events logs/events/cam0 --from 2026-09-01 --to 2026-10-01 \
+        --between 07:00-09:00 --class Truck --direction down
+"""
+import argparse
+import os
+import sys
+
+
+def _add_counter_arguments(parser):
+    """Các tham số dùng chung để khởi tạo VehicleCounter"""
+    parser.add_argument('--model', default='models/train_100.pt',
+                        help='Đường dẫn model (mặc định: models/train_100.pt)')
+    parser.add_argument('--line-position', type=float, default=0.7,
+                        help='Vị trí đường đếm 0.0-1.0 (mặc định: 0.7)')
+    parser.add_argument('--inference-size', type=int, default=640,
+                        help='Kích thước inference (mặc định: 640)')
+    parser.add_argument('--stride', type=int, default=1,
+                        help='Chạy inference mỗi N frame (mặc định: 1)')
+    parser.add_argument('--batch-size', type=int, default=8,
+                        help='Số frame mỗi lần gọi detector, tracker chạy tách riêng (mặc định: 8)')
+    parser.add_argument('--no-half', action='store_true',
+                        help='Không dùng FP16 trên GPU')
+    parser.add_argument('--motion-gate', action='store_true',
+                        help='Bỏ qua detector khi không có chuyển động quanh đường đếm')
+    parser.add_argument('--roi-band', type=float, default=None,
+                        help='Chỉ detect trong dải quanh đường đếm, nửa chiều cao theo tỷ lệ '
+                             'frame (ví dụ 0.25)')
+    parser.add_argument('--roi-polygon', default=None,
+                        help='Chỉ detect trong polygon, đỉnh theo tỷ lệ 0-1: "x1,y1;x2,y2;..."')
+    parser.add_argument('--layout', default=None,
+                        help='File JSON nhiều đường/vùng đếm (xem counting_zones.py)')
+    parser.add_argument('--timings', action='store_true',
+                        help='Đo độ trễ từng bước (p50/p95/p99) và ghi vào kết quả JSON')
+    _add_backend_arguments(parser)
+
+
+def _add_backend_arguments(parser):
+    parser.add_argument('--backend', choices=['pytorch', 'onnx', 'openvino'], default='pytorch',
+                        help='Backend inference (onnx/openvino: chạy CPU, tự xuất và lưu cache)')
+    parser.add_argument('--int8', action='store_true',
+                        help='Dùng model lượng tử hóa INT8 (chỉ với onnx/openvino)')
+
+
+def _add_decode_argument(parser):
+    parser.add_argument('--decode-size', type=int, default=None,
+                        help='Giải mã thẳng ở cạnh dài tối đa N pixel bằng ffmpeg (ví dụ 1280 '
+                             'cho video 4K); tọa độ và cache theo kích thước đã thu nhỏ')
+
+
+def _add_output_arguments(parser):
+    parser.add_argument('--save-video', action='store_true',
+                        help='Ghi thêm video có overlay (<tên video>_processed.mp4) vào output-dir')
+    parser.add_argument('--output-size', type=int, default=None,
+                        help='Cạnh dài tối đa của video đầu ra (mặc định: bằng frame giải mã)')
+    parser.add_argument('--output-every', type=int, default=1,
+                        help='Chỉ ghi mỗi N frame vào video đầu ra (mặc định: 1)')
+    parser.add_argument('--encoder', choices=['ffmpeg', 'opencv'], default='ffmpeg',
+                        help='ffmpeg libx264 (nhanh, file nhỏ; thiếu ffmpeg thì dùng opencv) '
+                             'hoặc opencv mp4v (mặc định: ffmpeg)')
+    parser.add_argument('--preset', default='veryfast',
+                        choices=['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium'],
+                        help='Preset libx264 (mặc định: veryfast)')
+
+
+def _output_options(args):
+    from video_output import OutputOptions
+
+    if not args.save_video:
+        return None
+    return OutputOptions(size=args.output_size, every=args.output_every,
+                         encoder=args.encoder, preset=args.preset)
+
+
+def _counter_kwargs(args):
+    from roi import InferenceRegion
+    from stage_timing import StageTimers
+
+    return {
+        'model_path': args.model,
+        'line_position': args.line_position,
+        'inference_size': args.inference_size,
+        'use_half_precision': not args.no_half,
+        'inference_stride': args.stride,
+        'batch_size': args.batch_size,
+        'backend': args.backend,
+        'int8': args.int8,
+        'motion_gate': args.motion_gate,
+        'roi': InferenceRegion.from_spec(args.roi_band, args.roi_polygon),
+        'layout': args.layout,
+        # Xử lý file: tính độ trễ trên cả lần chạy thay vì cửa sổ trượt
+        'timings': StageTimers(window=None) if args.timings else False,
+    }
+
+
+def _export_if_needed(args):
+    """Xuất model trước khi khởi động worker để các tiến trình không cùng xuất một lúc"""
+    if args.backend == 'pytorch':
+        return
+    from inference_backends import export_model
+    path = export_model(args.model, args.backend, args.inference_size, int8=args.int8,
+                        calibration_video=getattr(args, 'calibration_video', None)
+                        or 'video/sample_1.mp4')
+    print(f"Model {args.backend}: {path}")
+
+
+def _run_export(args):
+    _export_if_needed(args)
+    return 0
+
+
+def _run_batch(args):
+    from batch_processing import (collect_videos, run_batch,
+                                  write_summaries_csv, write_summaries_json)
+
+    videos = collect_videos(args.inputs)
+    if not videos:
+        print("Không tìm thấy video nào.", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    _export_if_needed(args)
+    print(f"Xử lý {len(videos)} video...")
+
+    def on_result(summary):
+        name = os.path.basename(summary['video'])
+        if summary.get('error'):
+            print(f"  [LỖI] {name}: {summary['error']}")
+            return
+        print(f"  {name}: {summary['total']} xe "
+              f"(lên {summary['count_up']}, xuống {summary['count_down']}) "
+              f"- {summary['processing_fps']} FPS"
+              + (f", bỏ qua {summary['detector_skip_ratio']:.0%} lần detect"
+                 if summary.get('detector_skip_ratio') is not None else ''))
+        # Ghi kết quả từng video ngay khi xong để không mất nếu batch bị dừng giữa chừng
+        base = os.path.splitext(name)[0]
+        write_summaries_json(summary, os.path.join(args.output_dir, f'{base}_counts.json'))
+
+    summaries = run_batch(videos, _counter_kwargs(args), workers=args.workers,
+                          on_result=on_result,
+                          cache_dir=args.output_dir if args.cache else None,
+                          decode_size=args.decode_size,
+                          video_dir=args.output_dir if args.save_video else None,
+                          output_options=_output_options(args))
+
+    if args.format in ('json', 'both'):
+        write_summaries_json(summaries, os.path.join(args.output_dir, 'summary.json'))
+    if args.format in ('csv', 'both'):
+        write_summaries_csv(summaries, os.path.join(args.output_dir, 'summary.csv'))
+
+    failed = sum(1 for s in summaries if s.get('error'))
+    print(f"Hoàn thành: {len(summaries) - failed}/{len(summaries)} video. "
+          f"Kết quả lưu tại {args.output_dir}")
+    return 1 if failed else 0
+
+
+def _run_streams(args):
+    import json
+    from live_source import parse_source
+    from multi_stream import MultiStreamRunner
+
+    kwargs = _counter_kwargs(args)
+    # Mọi luồng dùng chung model; tracker luôn chạy tách riêng cho từng luồng
+    kwargs.pop('batch_size')
+    # Nguồn trực tiếp chạy lâu: độ trễ theo cửa sổ trượt
+    kwargs['timings'] = args.timings
+    _export_if_needed(args)
+    runner = MultiStreamRunner([parse_source(source) for source in args.sources],
+                               event_log_dir=args.event_log, **kwargs)
+    print(f"Theo dõi {len(runner.streams)} luồng với một model dùng chung... (Ctrl+C để dừng)")
+
+    def on_stats(stats):
+        for stream in stats['streams']:
+            latency = stream['latency_ms']
+            print(f"  {stream['name']}: {stream['count_up'] + stream['count_down']} xe, "
+                  f"{stream['processing_fps']} FPS, trễ TB {latency['mean']} ms "
+                  f"(p95 {latency['p95']}), drop {stream['frames_dropped']}")
+
+    try:
+        stats = runner.run(duration=args.duration, on_stats=on_stats,
+                           stats_interval=args.stats_interval)
+    except KeyboardInterrupt:
+        runner.stop()
+        stats = runner.stats()
+    on_stats(stats)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+        print(f"Đã lưu thống kê: {args.output}")
+    return 1 if any(stream['error'] for stream in stats['streams']) else 0
+
+
+def _run_live(args):
+    import json
+    import time
+    from live_source import LatestFrameGrabber, parse_source
+    from vehicle_counter import VehicleCounter
+
+    kwargs = _counter_kwargs(args)
+    # Luôn xử lý frame mới nhất ngay khi có: không gom batch
+    kwargs['batch_size'] = 1
+    kwargs['timings'] = args.timings
+    _export_if_needed(args)
+    counter = VehicleCounter(**kwargs)
+    grabber = LatestFrameGrabber(parse_source(args.source), loop=args.loop,
+                                 timers=counter.timers)
+    print(f"Đếm trực tiếp từ {args.source}... (Ctrl+C để dừng)")
+
+    def stats():
+        result = dict(grabber.stats(), count_up=counter.count_up,
+                      count_down=counter.count_down, classes=counter.get_class_counts())
+        if counter.timers.enabled:
+            result['stage_timings'] = counter.timers.snapshot()['stages']
+        return result
+
+    def on_stats(result):
+        state = ' - mất kết nối' if not (result['connected'] or grabber.finished) else ''
+        print(f"  {result['count_up'] + result['count_down']} xe, đọc {result['capture_fps']} FPS, "
+              f"bỏ {result['frames_dropped']}/{result['frames_read']} frame, "
+              f"kết nối lại {result['reconnects']} lần{state}")
+
+    started = last_stats = time.perf_counter()
+    grabber.start()
+    try:
+        while args.duration is None or time.perf_counter() - started < args.duration:
+            item = grabber.read(timeout=1.0)
+            if item is None:
+                if grabber.finished:
+                    break
+            else:
+                frame, timestamp = item
+                counter.process_frame(frame, draw=False, timestamp=timestamp)
+            if time.perf_counter() - last_stats >= args.stats_interval:
+                last_stats = time.perf_counter()
+                on_stats(stats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        grabber.stop()
+    result = stats()
+    on_stats(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Đã lưu thống kê: {args.output}")
+    return 1 if result['error'] and not result['frames_read'] else 0
+
+
+def _run_events(args):
+    import json
+    import time
+    from count_aggregation import write_table_csv, write_table_parquet
+    from event_log import EventLog
+
+    log = EventLog(args.log_dir)
+    time_of_day = tuple(args.between.split('-')) if args.between else None
+    started = time.perf_counter()
+    records = log.query(start=args.start, end=args.end, classes=args.classes,
+                        directions=args.directions, lines=args.lines, time_of_day=time_of_day)
+    elapsed = (time.perf_counter() - started) * 1000
+    summary = log.summarize(records)
+    print(f"{summary['total']} lượt xe ({len(log.days())} ngày dữ liệu, truy vấn {elapsed:.1f} ms)")
+    for line, directions in summary['lines'].items():
+        for direction, classes in directions.items():
+            detail = ', '.join(f"{name} {count}" for name, count in classes.items())
+            print(f"  {line} / {direction}: {detail}")
+    if args.output:
+        if args.output.lower().endswith('.json'):
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+        elif args.output.lower().endswith('.parquet'):
+            write_table_parquet(log.to_table(records), args.output)
+        else:
+            write_table_csv(log.to_table(records), args.output)
+        print(f"Đã lưu: {args.output}")
+    return 0
+
+
+def _run_bench(args):
+    import json
+    import benchmark
+
+    class_mix = None
+    if args.class_mix:
+        # "2:0.6,3:0.3,7:0.1"
+        class_mix = {int(cls): float(weight) for cls, weight in
+                     (item.split(':') for item in args.class_mix.split(','))}
+    benchmarks = benchmark.build_benchmarks(
+        tracks=[int(count) for count in args.tracks.split(',')], motion=args.motion,
+        class_mix=class_mix, quick=args.quick)
+
+    def on_result(name, result):
+        print(f"  {name:32s} {result['ops_per_sec']:>10.1f} ops/s "
+              f"{result['us_per_op']:>10.2f} µs/op  cấp phát đỉnh {result['alloc_peak_kb']} KB")
+
+    results = benchmark.run_benchmarks(benchmarks, only=args.only, rounds=args.rounds,
+                                       on_result=on_result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        benchmark.save_baseline(results, args.baseline)
+        print(f"Đã lưu baseline: {args.baseline}")
+        return 0
+    baseline = benchmark.load_baseline(args.baseline)
+    if baseline is None:
+        print(f"Chưa có baseline ({args.baseline}), lưu bằng --save-baseline")
+        return 0
+    regressions = benchmark.check_regression(results, baseline, tolerance=args.tolerance)
+    for name, metric, value, previous in regressions:
+        print(f"CHẬM ĐI: {name} {metric} = {value} (baseline {previous})")
+    if not regressions:
+        print("Không có bài đo nào chậm hơn baseline")
+    return 1 if regressions else 0
+
+
+def _run_split(args):
+    from batch_processing import write_summaries_json
+    from chunked_processing import run_chunked
+    from detection_cache import cache_path_for
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    _export_if_needed(args)
+    cache_path = cache_path_for(args.video, args.output_dir) if args.cache else None
+
+    def on_progress(frames, total):
+        print(f"\r  {frames}/{total} frame ({frames / total:.0%})", end='', flush=True)
+
+    print(f"Xử lý {os.path.basename(args.video)} theo đoạn song song...")
+    summary = run_chunked(args.video, _counter_kwargs(args), workers=args.workers,
+                          overlap=args.overlap, cache_path=cache_path,
+                          progress_callback=on_progress, decode_size=args.decode_size)
+    print()
+    print(f"  {summary['total']} xe (lên {summary['count_up']}, xuống {summary['count_down']}) "
+          f"- {summary['segments']} đoạn, {summary['processing_fps']} FPS, "
+          f"bỏ {summary['duplicates_removed']} lần đếm trùng ở chỗ nối")
+    base = os.path.splitext(os.path.basename(args.video))[0]
+    write_summaries_json(summary, os.path.join(args.output_dir, f'{base}_counts.json'))
+    return 0
+
+
+def _run_recount(args):
+    import json
+    import time
+    from count_aggregation import CountAggregator
+    from vehicle_counter import VehicleCounter
+
+    # Không nạp model: chỉ dùng logic đếm trên cache
+    counter = VehicleCounter(model_path=None, line_position=args.line_position,
+                             layout=args.layout)
+    if args.classes:
+        counter.vehicle_classes = [int(cls) for cls in args.classes.split(',')]
+    if args.bins_dir:
+        os.makedirs(args.bins_dir, exist_ok=True)
+        aggregator = CountAggregator.for_counter(
+            counter, bin_seconds=(args.bin_size,),
+            capacity=args.max_events, history=args.history * 3600)
+    results = []
+    for path in args.caches:
+        start = time.time()
+        summary = counter.replay(path)
+        summary['cache'] = path
+        summary['recount_time'] = round(time.time() - start, 3)
+        results.append(summary)
+        print(f"  {os.path.basename(path.rstrip(os.sep))}: {summary['total']} xe "
+              f"(lên {summary['count_up']}, xuống {summary['count_down']}) "
+              f"- {summary['recount_time']}s")
+        if args.bins_dir:
+            # <tên cache>_bins.<định dạng> và <tên cache>_events.<định dạng>
+            base = os.path.join(args.bins_dir, os.path.splitext(
+                os.path.basename(path.rstrip(os.sep)))[0])
+            summary['bins'] = aggregator.export(f'{base}_bins.{args.bins_format}')
+            summary['events'] = aggregator.export(f'{base}_events.{args.bins_format}',
+                                                  events=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m vehicle_counter',
+        description='Hệ thống đếm phương tiện giao thông (chế độ dòng lệnh)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch = subparsers.add_parser('batch', help='Xử lý hàng loạt nhiều video song song')
+    batch.add_argument('inputs', nargs='+', help='Thư mục, file video hoặc mẫu glob')
+    batch.add_argument('--workers', type=int, default=None,
+                       help='Số tiến trình song song (mặc định: một nửa số core)')
+    batch.add_argument('--output-dir', default='batch_results',
+                       help='Thư mục lưu kết quả (mặc định: batch_results)')
+    batch.add_argument('--format', choices=['json', 'csv', 'both'], default='both',
+                       help='Định dạng file tổng hợp (mặc định: both)')
+    batch.add_argument('--cache', action='store_true',
+                       help='Lưu cache detection (<tên video>.detections) vào output-dir '
+                            'để đếm lại bằng lệnh recount')
+    _add_counter_arguments(batch)
+    _add_decode_argument(batch)
+    _add_output_arguments(batch)
+    batch.set_defaults(func=_run_batch)
+
+    split = subparsers.add_parser(
+        'split', help='Xử lý một video dài song song theo đoạn thời gian (mỗi đoạn một tiến trình)')
+    split.add_argument('video', help='Video đầu vào')
+    split.add_argument('--workers', type=int, default=None,
+                       help='Số đoạn/tiến trình song song (mặc định: một nửa số core)')
+    split.add_argument('--overlap', type=float, default=4.0,
+                       help='Thời gian chồng lấn giữa hai đoạn để tracker khởi động, giây '
+                            '(mặc định: 4)')
+    split.add_argument('--output-dir', default='batch_results',
+                       help='Thư mục lưu kết quả (mặc định: batch_results)')
+    split.add_argument('--cache', action='store_true',
+                       help='Lưu cache detection đã ghép vào output-dir')
+    _add_counter_arguments(split)
+    _add_decode_argument(split)
+    split.set_defaults(func=_run_split)
+
+    recount = subparsers.add_parser(
+        'recount', help='Đếm lại từ cache detection với đường đếm/loại xe mới (không chạy model)')
+    recount.add_argument('caches', nargs='+', help='Thư mục cache (*.detections)')
+    recount.add_argument('--line-position', type=float, default=0.7,
+                         help='Vị trí đường đếm 0.0-1.0 (mặc định: 0.7)')
+    recount.add_argument('--classes', default=None,
+                         help='Chỉ đếm các class COCO này, ví dụ "2,7" (mặc định: 2,3,5,7)')
+    recount.add_argument('--layout', default=None,
+                         help='File JSON nhiều đường/vùng đếm (xem counting_zones.py)')
+    recount.add_argument('--output', default=None, help='Lưu kết quả ra file JSON')
+    recount.add_argument('--bins-dir', default=None,
+                         help='Xuất số đếm theo khoảng thời gian và danh sách xe vượt đường '
+                              'vào thư mục này')
+    recount.add_argument('--bin-size', type=int, default=900,
+                         help='Độ dài mỗi khoảng, giây (mặc định: 900 = 15 phút)')
+    recount.add_argument('--bins-format', choices=['csv', 'parquet'], default='csv',
+                         help='Định dạng file xuất (parquet cần pyarrow, mặc định: csv)')
+    recount.add_argument('--history', type=float, default=24,
+                         help='Thời gian giữ lại của bảng theo khoảng, giờ (mặc định: 24)')
+    recount.add_argument('--max-events', type=int, default=65536,
+                         help='Số sự kiện giữ lại tối đa (mặc định: 65536)')
+    recount.set_defaults(func=_run_recount)
+
+    streams = subparsers.add_parser(
+        'streams', help='Đếm trên nhiều camera/video cùng lúc với một model dùng chung')
+    streams.add_argument('sources', nargs='+',
+                         help='Video, URL RTSP hoặc chỉ số webcam (0, 1, ...)')
+    streams.add_argument('--duration', type=float, default=None,
+                         help='Dừng sau số giây này (mặc định: đến khi mọi nguồn kết thúc)')
+    streams.add_argument('--stats-interval', type=float, default=5.0,
+                         help='In thống kê mỗi N giây (mặc định: 5)')
+    streams.add_argument('--output', default=None, help='Lưu thống kê cuối cùng ra file JSON')
+    streams.add_argument('--event-log', default=None,
+                         help='Ghi nhật ký sự kiện vượt đường của từng luồng vào '
+                              '<thư mục>/<tên luồng> (truy vấn bằng lệnh events)')
+    _add_counter_arguments(streams)
+    streams.set_defaults(func=_run_streams)
+
+    live = subparsers.add_parser(
+        'live', help='Đếm trực tiếp một camera với độ trễ thấp (luôn xử lý frame mới nhất, '
+                     'tự kết nối lại)')
+    live.add_argument('source', help='URL RTSP/HTTP, chỉ số webcam (0, 1, ...) hoặc video '
+                                     '(phát theo đúng FPS để thử thay camera)')
+    live.add_argument('--loop', action='store_true',
+                      help='Video file hết thì phát lại từ đầu (giả lập camera chạy liên tục)')
+    live.add_argument('--duration', type=float, default=None,
+                      help='Dừng sau số giây này (mặc định: đến khi Ctrl+C hoặc hết video)')
+    live.add_argument('--stats-interval', type=float, default=5.0,
+                      help='In thống kê mỗi N giây (mặc định: 5)')
+    live.add_argument('--output', default=None, help='Lưu thống kê cuối cùng ra file JSON')
+    _add_counter_arguments(live)
+    live.set_defaults(func=_run_live)
+
+    events = subparsers.add_parser(
+        'events', help='Truy vấn nhật ký sự kiện vượt đường đếm (ghi bởi streams --event-log)')
+    events.add_argument('log_dir', help='Thư mục nhật ký của một luồng')
+    events.add_argument('--from', dest='start', default=None,
+                        help='Từ thời điểm "YYYY-MM-DD[ HH:MM]" (mặc định: đầu nhật ký)')
+    events.add_argument('--to', dest='end', default=None,
+                        help='Đến trước thời điểm "YYYY-MM-DD[ HH:MM]" (mặc định: cuối nhật ký)')
+    events.add_argument('--between', default=None,
+                        help='Chỉ lấy khung giờ này của mỗi ngày, ví dụ "07:00-09:00"')
+    events.add_argument('--class', dest='classes', action='append', default=None,
+                        help='Loại xe (tên hoặc class id), lặp lại để chọn nhiều loại')
+    events.add_argument('--direction', dest='directions', action='append', default=None,
+                        choices=['up', 'down', 'forward', 'backward'],
+                        help='Chiều đi (up/down cho đường đếm chính, forward/backward cho '
+                             'đường của layout)')
+    events.add_argument('--line', dest='lines', action='append', default=None,
+                        help='Tên đường đếm (mặc định: mọi đường)')
+    events.add_argument('--output', default=None,
+                        help='Lưu danh sách sự kiện (.csv/.parquet) hoặc số đếm (.json)')
+    events.set_defaults(func=_run_events)
+
+    bench = subparsers.add_parser(
+        'bench', help='Micro-benchmark với dữ liệu giả lập (không cần model/video)')
+    bench.add_argument('--tracks', default='50,500',
+                       help='Số xe mỗi frame, cách nhau dấu phẩy (mặc định: 50,500)')
+    bench.add_argument('--motion', choices=['linear', 'jitter', 'stop_and_go'],
+                       default='linear', help='Kiểu chuyển động của xe (mặc định: linear)')
+    bench.add_argument('--class-mix', default=None,
+                       help='Tỷ lệ loại xe "class:tỷ lệ,...", ví dụ "2:0.6,3:0.3,7:0.1"')
+    bench.add_argument('--only', action='append', default=None,
+                       help='Chỉ chạy bài đo có tên chứa chuỗi này (lặp lại được)')
+    bench.add_argument('--rounds', type=int, default=3,
+                       help='Số lượt đo mỗi bài, lấy lượt nhanh nhất (mặc định: 3)')
+    bench.add_argument('--quick', action='store_true', help='Ít lần gọi hơn (kiểm tra nhanh)')
+    bench.add_argument('--baseline', default=os.path.join('logs', 'benchmark_baseline.json'),
+                       help='File baseline (mặc định: logs/benchmark_baseline.json)')
+    bench.add_argument('--save-baseline', action='store_true',
+                       help='Lưu kết quả lần này làm baseline')
+    bench.add_argument('--tolerance', type=float, default=1.3,
+                       help='Báo chậm đi khi thời gian mỗi lần gọi vượt N lần baseline '
+                            '(mặc định: 1.3)')
+    bench.add_argument('--output', default=None, help='Lưu kết quả ra file JSON')
+    bench.set_defaults(func=_run_bench)
+
+    export = subparsers.add_parser('export', help='Xuất model sang ONNX/OpenVINO và lưu cache')
+    export.add_argument('--model', default='models/train_100.pt',
+                        help='Đường dẫn model (mặc định: models/train_100.pt)')
+    export.add_argument('--inference-size', type=int, default=640,
+                        help='Kích thước input của model xuất ra (mặc định: 640)')
+    export.add_argument('--calibration-video', default='video/sample_1.mp4',
+                        help='Video lấy frame hiệu chỉnh INT8 (mặc định: video/sample_1.mp4)')
+    _add_backend_arguments(export)
+    export.set_defaults(func=_run_export)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.exit(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
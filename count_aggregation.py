@@ -0,0 +1,313 @@
+"""
+Ghi lại từng sự kiện vượt đường đếm và tổng hợp số đếm theo khoảng thời gian.
+
+VehicleCounter chỉ giữ tổng cộng dồn từ lần reset_counts() gần nhất. Khi gắn
+CountAggregator (counter.aggregator), mỗi lượt xe vượt đường đếm chính hoặc
+một đường của layout được:
+
+    - ghi vào bộ đệm vòng (ring buffer) cấp phát sẵn: thời điểm, frame, ID,
+      class, chiều, đường đếm, vị trí; đầy thì ghi đè sự kiện cũ nhất
+    - cộng vào các bảng đếm theo khoảng (mặc định 1 phút và 15 phút), mỗi
+      bảng là mảng [ô thời gian, đường, class, chiều] dùng vòng theo thời
+      gian (mặc định giữ 24 giờ gần nhất)
+
+Mỗi sự kiện chỉ tốn O(1) (ghi vào vị trí cố định, cộng vào một ô), mảng
+không cấp phát lại khi chạy; frame không có xe vượt đường không tốn gì.
+Bảng theo khoảng và danh sách sự kiện xuất được ra CSV hoặc Parquet
+(cần pyarrow).
+
+Chiều đếm: đường đếm chính dùng 'up'/'down', đường của layout dùng
+'forward'/'backward' (xem counting_zones.py).
+"""
+import csv
+import math
+import time
+
+import numpy as np
+
+from counting_zones import LINE_DIRECTIONS
+
+# Tên đường đếm chính (ngang theo line_position) trong bảng đếm
+MAIN_LINE = 'line'
+MAIN_DIRECTIONS = ('up', 'down')
+# Khoảng tổng hợp mặc định (giây): 1 phút và 15 phút
+DEFAULT_BIN_SECONDS = (60, 900)
+# Timestamp lớn hơn mốc này là giờ hệ thống (nguồn trực tiếp), nhỏ hơn là vị trí trong video
+EPOCH_THRESHOLD = 1e9
+
+_EVENT_COLUMNS = (
+    ('timestamp', np.float64),
+    ('frame', np.int64),
+    ('track_id', np.int64),
+    ('class_id', np.int16),
+    ('line', np.int16),
+    ('direction', np.int8),  # 0 = up/forward, 1 = down/backward
+    ('x', np.float32),
+    ('y', np.float32),
+)
+
+
+def format_time(seconds, wall_clock):
+    """Thời điểm dễ đọc: ngày giờ hệ thống hoặc H:MM:SS tính từ đầu video"""
+    if wall_clock:
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class EventRing:
+    def __init__(self, capacity=65536):
+        """
+        Args:
+            capacity: Số sự kiện giữ lại tối đa (cũ nhất bị ghi đè khi đầy)
+        """
+        self.capacity = max(1, int(capacity))
+        for name, dtype in _EVENT_COLUMNS:
+            setattr(self, name, np.zeros(self.capacity, dtype=dtype))
+        self.clear()
+
+    def clear(self):
+        self.size = 0
+        self.total = 0  # Tổng số sự kiện đã ghi (kể cả đã bị ghi đè)
+        self._head = 0  # Vị trí ghi tiếp theo
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, **values):
+        """Ghi một nhóm sự kiện (cùng độ dài hoặc giá trị vô hướng) theo tên cột"""
+        count = len(values['track_id'])
+        # Nhiều hơn sức chứa: chỉ các sự kiện cuối còn lại
+        skip = max(0, count - self.capacity)
+        written = count - skip
+        head = self._head
+        first = min(written, self.capacity - head)
+        for name, _ in _EVENT_COLUMNS:
+            column = getattr(self, name)
+            value = values[name]
+            if np.ndim(value) == 0:
+                column[head:head + first] = value
+                column[:written - first] = value
+            else:
+                column[head:head + first] = value[skip:skip + first]
+                column[:written - first] = value[skip + first:]
+        self._head = (head + written) % self.capacity
+        self.size = min(self.size + written, self.capacity)
+        self.total += count
+
+    def columns(self):
+        """Các cột theo thứ tự thời gian (cũ nhất trước)"""
+        start = (self._head - self.size) % self.capacity
+        order = (start + np.arange(self.size)) % self.capacity
+        return {name: getattr(self, name)[order] for name, _ in _EVENT_COLUMNS}
+
+
+class TimeBins:
+    def __init__(self, bin_seconds, lines, classes, history=24 * 3600):
+        """
+        Args:
+            bin_seconds: Độ dài mỗi khoảng (giây)
+            lines, classes: Số đường đếm và số class
+            history: Thời gian giữ lại (giây); ô cũ hơn được dùng lại cho khoảng mới
+        """
+        self.bin_seconds = bin_seconds
+        self.slots = max(1, math.ceil(history / bin_seconds))
+        # counts[ô, đường, class, chiều]
+        self.counts = np.zeros((self.slots, lines, classes, 2), dtype=np.int32)
+        # Chỉ số khoảng (timestamp // bin_seconds) mà mỗi ô đang giữ, -1 = trống
+        self.bin_index = np.full(self.slots, -1, dtype=np.int64)
+        self.latest = -1
+
+    def clear(self):
+        self.counts[:] = 0
+        self.bin_index[:] = -1
+        self.latest = -1
+
+    def add(self, timestamp, lines, class_index, direction):
+        """Cộng các sự kiện xảy ra tại cùng thời điểm timestamp"""
+        index = int(timestamp // self.bin_seconds)
+        if index <= self.latest - self.slots:
+            return  # Cũ hơn khoảng thời gian được giữ lại
+        slot = index % self.slots
+        if self.bin_index[slot] != index:
+            self.counts[slot] = 0
+            self.bin_index[slot] = index
+        if index > self.latest:
+            self.latest = index
+        np.add.at(self.counts[slot], (lines, class_index, direction), 1)
+
+    def valid(self):
+        """
+        (chỉ số khoảng, ô) của các khoảng còn trong history, sắp theo thời gian.
+
+        Ô = -1 với khoảng không có xe mà ô tương ứng vẫn giữ một khoảng đã hết hạn.
+        """
+        if self.latest < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        kept = (self.bin_index >= 0) & (self.bin_index > self.latest - self.slots)
+        first = int(self.bin_index[kept].min())
+        # Khoảng không có xe nào vẫn có dòng (số đếm 0)
+        indices = np.arange(first, self.latest + 1, dtype=np.int64)
+        slots = indices % self.slots
+        slots[self.bin_index[slots] != indices] = -1
+        return indices, slots
+
+
+class CountAggregator:
+    def __init__(self, classes=(2, 3, 5, 7), class_names=None, line_names=(MAIN_LINE,),
+                 bin_seconds=DEFAULT_BIN_SECONDS, capacity=65536, history=24 * 3600,
+                 wall_clock=None):
+        """
+        Args:
+            classes: Các class được đếm (thứ tự cột trong bảng đếm)
+            class_names: dict class -> tên hiển thị
+            line_names: Tên các đường đếm; đường đầu tiên là đường đếm chính
+            bin_seconds: Các độ dài khoảng tổng hợp (giây)
+            capacity: Sức chứa bộ đệm sự kiện
+            history: Thời gian giữ lại của bảng theo khoảng (giây)
+            wall_clock: Timestamp là giờ hệ thống (None = tự nhận theo giá trị)
+        """
+        self.classes = np.asarray(sorted(classes), dtype=np.int64)
+        self.class_names = class_names or {}
+        self.bin_seconds = tuple(bin_seconds)
+        self.history = history
+        self.wall_clock = wall_clock
+        self.events = EventRing(capacity)
+        self.set_lines(line_names)
+
+    @classmethod
+    def for_counter(cls, counter, **kwargs):
+        """Tạo aggregator theo class/đường đếm của counter và gắn vào counter"""
+        aggregator = cls(classes=counter.vehicle_classes, class_names=counter.class_names,
+                         line_names=counter.line_names(), **kwargs)
+        counter.aggregator = aggregator
+        return aggregator
+
+    def set_lines(self, line_names):
+        """Đổi danh sách đường đếm (xóa số đếm theo khoảng nếu khác danh sách cũ)"""
+        line_names = list(line_names)
+        if getattr(self, 'line_names', None) == line_names:
+            return
+        self.line_names = line_names
+        self.bins = {seconds: TimeBins(seconds, len(line_names), len(self.classes),
+                                       self.history)
+                     for seconds in self.bin_seconds}
+        self.events.clear()
+
+    def reset(self):
+        self.events.clear()
+        for bins in self.bins.values():
+            bins.clear()
+
+    def record(self, frame, timestamp, track_ids, classes, directions, line=0, x=0.0, y=0.0):
+        """
+        Ghi các lượt vượt đường đếm của một frame.
+
+        Args:
+            frame, timestamp: Frame và thời điểm (giây) của các sự kiện
+            track_ids, classes: Mảng ID và class của các xe
+            directions: Mảng chiều 0 = up/forward, 1 = down/backward
+            line: Chỉ số đường đếm (vô hướng hoặc mảng; 0 = đường đếm chính)
+            x, y: Tâm box lúc vượt đường
+        """
+        class_index = np.minimum(np.searchsorted(self.classes, classes), len(self.classes) - 1)
+        known = self.classes[class_index] == classes
+        if not known.all():
+            track_ids, class_index = track_ids[known], class_index[known]
+            classes, directions = classes[known], directions[known]
+            line = line if np.ndim(line) == 0 else line[known]
+            x = x if np.ndim(x) == 0 else x[known]
+            y = y if np.ndim(y) == 0 else y[known]
+        if len(track_ids) == 0:
+            return
+        if self.wall_clock is None:
+            self.wall_clock = timestamp > EPOCH_THRESHOLD
+        self.events.extend(timestamp=timestamp, frame=frame, track_id=track_ids,
+                           class_id=classes, line=line, direction=directions, x=x, y=y)
+        for bins in self.bins.values():
+            bins.add(timestamp, line, class_index, directions)
+
+    def _direction_names(self, line):
+        return MAIN_DIRECTIONS if line == 0 else LINE_DIRECTIONS
+
+    def _class_labels(self):
+        return [self.class_names.get(int(cls), str(cls)) for cls in self.classes]
+
+    def bin_table(self, bin_seconds=None):
+        """
+        Bảng số đếm theo khoảng: mỗi (khoảng, đường, chiều) một dòng, mỗi class một cột.
+
+        Returns:
+            dict: tên cột -> list, các cột bin_start, bin_end (giây), start_time,
+                line, direction, <tên class>..., total
+        """
+        bins = self.bins[bin_seconds or self.bin_seconds[0]]
+        indices, slots = bins.valid()
+        labels = self._class_labels()
+        table = {name: [] for name in ('bin_start', 'bin_end', 'start_time', 'line',
+                                       'direction', *labels, 'total')}
+        empty = np.zeros((len(self.line_names), len(labels), 2), dtype=np.int32)
+        for index, slot in zip(indices, slots):
+            start = float(index * bins.bin_seconds)
+            for line, line_name in enumerate(self.line_names):
+                for direction, direction_name in enumerate(self._direction_names(line)):
+                    counts = (bins.counts[slot] if slot >= 0 else empty)[line, :, direction]
+                    table['bin_start'].append(start)
+                    table['bin_end'].append(start + bins.bin_seconds)
+                    table['start_time'].append(format_time(start, self.wall_clock))
+                    table['line'].append(line_name)
+                    table['direction'].append(direction_name)
+                    for label, count in zip(labels, counts):
+                        table[label].append(int(count))
+                    table['total'].append(int(counts.sum()))
+        return table
+
+    def event_table(self):
+        """Các sự kiện còn trong bộ đệm (cũ nhất trước), dạng dict tên cột -> list"""
+        columns = self.events.columns()
+        names = dict(zip(self.classes.tolist(), self._class_labels()))
+        lines = columns['line'].tolist()
+        return {
+            'timestamp': columns['timestamp'].tolist(),
+            'time': [format_time(t, self.wall_clock) for t in columns['timestamp']],
+            'frame': columns['frame'].tolist(),
+            'track_id': columns['track_id'].tolist(),
+            'class_id': columns['class_id'].tolist(),
+            'class_name': [names.get(cls, str(cls)) for cls in columns['class_id'].tolist()],
+            'line': [self.line_names[line] for line in lines],
+            'direction': [self._direction_names(line)[direction]
+                          for line, direction in zip(lines, columns['direction'].tolist())],
+            'x': np.round(columns['x'].astype(np.float64), 1).tolist(),
+            'y': np.round(columns['y'].astype(np.float64), 1).tolist(),
+        }
+
+    def export(self, path, bin_seconds=None, events=False):
+        """
+        Xuất bảng theo khoảng (hoặc danh sách sự kiện nếu events=True) ra file;
+        định dạng theo phần mở rộng: .parquet hoặc CSV.
+        """
+        table = self.event_table() if events else self.bin_table(bin_seconds)
+        if path.lower().endswith('.parquet'):
+            write_table_parquet(table, path)
+        else:
+            write_table_csv(table, path)
+        return path
+
+
+def write_table_csv(table, path):
+    """Ghi bảng dạng cột (dict tên cột -> list) ra CSV"""
+    names = list(table)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(table[name] for name in names)))
+
+
+def write_table_parquet(table, path):
+    """Ghi bảng dạng cột ra Parquet (cần pyarrow)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Xuất Parquet cần pyarrow: pip install pyarrow") from None
+    pq.write_table(pa.table(table), path)
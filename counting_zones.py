@@ -0,0 +1,330 @@
+"""
+Nhiều đường đếm (đoạn thẳng bất kỳ) và vùng đếm (polygon) cho một camera.
+
+Mỗi frame, đoạn di chuyển của mọi track (tâm frame trước -> tâm frame này)
+được kiểm tra giao cắt với mọi đường đếm cùng lúc bằng phép toán mảng
+(N track x L đường), và điểm trong polygon cho mọi (track x vùng) bằng
+ray casting vector hóa. Mỗi track chỉ được đếm một lần cho mỗi đường
+(bitmask trong TrackTable), vùng đếm ghi nhận lượt vào/ra.
+
+Chiều của đường đếm A -> B:
+    - forward: đi từ phía "âm" sang phía "dương" của A -> B, tức là theo
+      pháp tuyến (-dy, dx). Với đường ngang vẽ từ trái sang phải, forward = đi xuống.
+    - backward: chiều ngược lại.
+
+File cấu hình JSON (tọa độ theo tỷ lệ 0.0-1.0 của frame):
+    {
+        "lines": [{"name": "Bắc", "points": [[0.1, 0.6], [0.9, 0.6]]}],
+        "zones": [{"name": "Ngã tư", "polygon": [[0.3, 0.3], [0.7, 0.3], [0.7, 0.8], [0.3, 0.8]]}]
+    }
+"""
+import json
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# Mỗi track lưu trạng thái đường/vùng trong một cột uint64
+MAX_ITEMS = 64
+LINE_DIRECTIONS = ('forward', 'backward')
+ZONE_EVENTS = ('enter', 'exit')
+
+# Tọa độ pixel của đường đếm và cạnh vùng ở một kích thước frame (xem CountingLayout._geometry)
+LayoutGeometry = namedtuple('LayoutGeometry',
+                            ['line_start', 'line_end', 'edge_start', 'edge_end', 'edge_offsets'])
+
+
+class CountingLine:
+    def __init__(self, name, start, end):
+        self.name = name
+        self.start = tuple(start)
+        self.end = tuple(end)
+
+
+class CountingZone:
+    def __init__(self, name, polygon):
+        if len(polygon) < 3:
+            raise ValueError(f"Vùng '{name}' cần ít nhất 3 đỉnh")
+        self.name = name
+        self.polygon = [tuple(point) for point in polygon]
+
+
+def _bits(count):
+    return np.left_shift(np.uint64(1), np.arange(count, dtype=np.uint64))
+
+
+def _pack(mask, weights):
+    """Gộp ma trận bool (N x K) thành bitmask uint64 cho từng dòng"""
+    if mask.shape[1] == 0:
+        return np.zeros(len(mask), dtype=np.uint64)
+    return np.bitwise_or.reduce(np.where(mask, weights, np.uint64(0)), axis=1)
+
+
+def _unpack(packed, weights):
+    """Tách bitmask uint64 thành ma trận bool (N x K)"""
+    return (packed[:, np.newaxis] & weights) != 0
+
+
+class CountingLayout:
+    def __init__(self, lines=(), zones=(), normalized=True, classes=(2, 3, 5, 7)):
+        """
+        Args:
+            lines: Danh sách CountingLine
+            zones: Danh sách CountingZone
+            normalized: Tọa độ theo tỷ lệ 0.0-1.0 của frame (False = pixel)
+            classes: Các class được đếm (thứ tự cột trong bảng đếm)
+        """
+        self.lines = list(lines)
+        self.zones = list(zones)
+        if len(self.lines) > MAX_ITEMS or len(self.zones) > MAX_ITEMS:
+            raise ValueError(f"Tối đa {MAX_ITEMS} đường đếm và {MAX_ITEMS} vùng")
+        self.normalized = normalized
+        self.classes = np.asarray(sorted(classes), dtype=np.int64)
+        self._line_bits = _bits(len(self.lines))
+        self._zone_bits = _bits(len(self.zones))
+        self._geometries = {}  # (width, height) -> LayoutGeometry
+        self._layer = None  # (kích thước frame + version, lớp overlay, pixel của lớp)
+        self.version = 0  # Tăng mỗi khi số đếm thay đổi (để biết khi nào vẽ lại overlay)
+        self.reset()
+
+    @classmethod
+    def from_dict(cls, data, **kwargs):
+        lines = [CountingLine(item['name'], *item['points']) for item in data.get('lines', [])]
+        zones = [CountingZone(item['name'], item['polygon']) for item in data.get('zones', [])]
+        kwargs.setdefault('normalized', data.get('normalized', True))
+        return cls(lines, zones, **kwargs)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f), **kwargs)
+
+    def to_dict(self):
+        return {
+            'normalized': self.normalized,
+            'lines': [{'name': line.name, 'points': [list(line.start), list(line.end)]}
+                      for line in self.lines],
+            'zones': [{'name': zone.name, 'polygon': [list(point) for point in zone.polygon]}
+                      for zone in self.zones],
+        }
+
+    def reset(self):
+        """Xóa bộ đếm: [đường, class, forward/backward] và [vùng, class, enter/exit]"""
+        self.line_counts = np.zeros((len(self.lines), len(self.classes), 2), dtype=np.int64)
+        self.zone_counts = np.zeros((len(self.zones), len(self.classes), 2), dtype=np.int64)
+        self.version += 1
+
+    def _geometry(self, width, height):
+        """
+        Tọa độ pixel của đường/cạnh vùng theo kích thước frame (cache theo kích thước).
+
+        Luồng đếm (kích thước nguồn) và luồng vẽ (kích thước giải mã/đầu ra) dùng
+        kích thước khác nhau cùng lúc: mỗi kích thước có một LayoutGeometry riêng,
+        không đổi sau khi tạo, người gọi giữ trong biến cục bộ.
+        """
+        key = (width, height)
+        geometry = self._geometries.get(key)
+        if geometry is not None:
+            return geometry
+        scale = np.array([width, height], dtype=np.float64) if self.normalized else 1.0
+        line_start = np.array([line.start for line in self.lines],
+                              dtype=np.float64).reshape(-1, 2) * scale
+        line_end = np.array([line.end for line in self.lines],
+                            dtype=np.float64).reshape(-1, 2) * scale
+        # Tất cả cạnh của mọi vùng nối liền nhau; edge_offsets = cạnh đầu tiên của từng vùng
+        starts, ends, offsets = [], [], []
+        for zone in self.zones:
+            polygon = np.array(zone.polygon, dtype=np.float64) * scale
+            offsets.append(sum(len(s) for s in starts))
+            starts.append(polygon)
+            ends.append(np.roll(polygon, -1, axis=0))
+        geometry = LayoutGeometry(
+            line_start, line_end,
+            np.concatenate(starts) if starts else np.zeros((0, 2)),
+            np.concatenate(ends) if ends else np.zeros((0, 2)),
+            np.array(offsets, dtype=np.intp))
+        for array in geometry:
+            array.setflags(write=False)
+        # Luồng khác có thể tính cùng kích thước cùng lúc: giữ bản đã có trong cache
+        return self._geometries.setdefault(key, geometry)
+
+    def crossings(self, previous, current, width, height):
+        """
+        Giao cắt giữa đoạn di chuyển của từng track và từng đường đếm.
+
+        Args:
+            previous, current: Tọa độ tâm (N x 2) ở frame trước và frame này
+
+        Returns:
+            tuple: (crossed, forward) - ma trận bool N x L
+        """
+        geometry = self._geometry(width, height)
+        line_start = geometry.line_start[np.newaxis]        # 1 x L x 2
+        direction = (geometry.line_end - geometry.line_start)[np.newaxis]
+        p = previous[:, np.newaxis]                          # N x 1 x 2
+        q = current[:, np.newaxis]
+        motion = q - p
+
+        def cross(u, v):
+            return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+        # Phía của điểm đầu/cuối so với đường (dấu tích có hướng)
+        side_before = cross(direction, p - line_start)
+        side_after = cross(direction, q - line_start)
+        # Hai đầu mút của đường nằm hai phía của đoạn di chuyển
+        end_a = cross(motion, line_start - p)
+        end_b = cross(motion, line_start + direction - p)
+        changed = (side_before < 0) != (side_after < 0)
+        crossed = changed & (end_a * end_b <= 0)
+        return crossed, side_before < 0
+
+    def inside(self, points, width, height):
+        """Điểm (N x 2) nằm trong vùng nào - ma trận bool N x Z (ray casting)"""
+        geometry = self._geometry(width, height)
+        if len(self.zones) == 0 or len(points) == 0:
+            return np.zeros((len(points), len(self.zones)), dtype=bool)
+        px = points[:, 0:1]
+        py = points[:, 1:2]
+        x1, y1 = geometry.edge_start[:, 0], geometry.edge_start[:, 1]
+        x2, y2 = geometry.edge_end[:, 0], geometry.edge_end[:, 1]
+        spans = (y1 > py) != (y2 > py)
+        dy = np.where(y2 == y1, 1.0, y2 - y1)
+        x_cross = x1 + (py - y1) * (x2 - x1) / dy
+        hits = (spans & (px < x_cross)).astype(np.int32)
+        return (np.add.reduceat(hits, geometry.edge_offsets, axis=1) % 2).astype(bool)
+
+    def _class_index(self, classes):
+        index = np.searchsorted(self.classes, classes)
+        index = np.minimum(index, len(self.classes) - 1)
+        return index, self.classes[index] == classes
+
+    def initialize(self, tracks, rows, width, height):
+        """Ghi nhận vùng chứa track mới (không tính là lượt vào)"""
+        if len(rows) == 0:
+            return
+        points = np.column_stack([tracks.center_x[rows], tracks.center_y[rows]])
+        tracks.lines_crossed[rows] = 0
+        tracks.zones_inside[rows] = _pack(self.inside(points, width, height), self._zone_bits)
+
+    def update(self, tracks, rows, previous_x, previous_y, width, height):
+        """
+        Cập nhật đếm cho các track đã có trong bảng (vị trí mới đã được ghi vào tracks).
+
+        Args:
+            rows: Dòng của các track trong TrackTable
+            previous_x, previous_y: Tâm của các track đó ở frame trước
+
+        Returns:
+            tuple: (track_index, line_index, direction) của các lượt vượt đường trong
+                frame này (track_index theo thứ tự rows, direction 0 = forward,
+                1 = backward), None nếu không có
+        """
+        line_crossings = None
+        if len(rows) == 0:
+            return line_crossings
+        previous = np.column_stack([previous_x, previous_y])
+        current = np.column_stack([tracks.center_x[rows], tracks.center_y[rows]])
+        class_index, known = self._class_index(tracks.cls[rows])
+        changed = False
+
+        if self.lines:
+            crossed, forward = self.crossings(previous, current, width, height)
+            # Mỗi track chỉ đếm một lần cho mỗi đường
+            crossed &= ~_unpack(tracks.lines_crossed[rows], self._line_bits)
+            crossed &= known[:, np.newaxis]
+            track_index, line_index = np.nonzero(crossed)
+            if len(track_index):
+                direction = np.where(forward[track_index, line_index], 0, 1)
+                np.add.at(self.line_counts, (line_index, class_index[track_index], direction), 1)
+                tracks.lines_crossed[rows] |= _pack(crossed, self._line_bits)
+                changed = True
+                line_crossings = (track_index, line_index, direction)
+
+        if self.zones:
+            before = _unpack(tracks.zones_inside[rows], self._zone_bits)
+            now = self.inside(current, width, height)
+            for event, mask in enumerate((now & ~before, before & ~now)):
+                track_index, zone_index = np.nonzero(mask & known[:, np.newaxis])
+                if len(track_index):
+                    np.add.at(self.zone_counts, (zone_index, class_index[track_index], event), 1)
+                    changed = True
+            tracks.zones_inside[rows] = _pack(now, self._zone_bits)
+
+        if changed:
+            self.version += 1
+        return line_crossings
+
+    def occupancy(self, tracks):
+        """Số track hiện đang ở trong từng vùng"""
+        inside = _unpack(tracks.zones_inside[:tracks.size], self._zone_bits)
+        return inside.sum(axis=0)
+
+    def counts(self, class_names):
+        """
+        Số đếm dạng dict:
+            {'lines': {tên: {class: {'forward', 'backward', 'total'}}},
+             'zones': {tên: {class: {'enter', 'exit'}}}}
+        """
+        names = [class_names.get(int(cls), str(cls)) for cls in self.classes]
+        lines = {}
+        for line, table in zip(self.lines, self.line_counts):
+            lines[line.name] = {
+                name: {'forward': int(row[0]), 'backward': int(row[1]),
+                       'total': int(row[0] + row[1])}
+                for name, row in zip(names, table)
+            }
+        zones = {}
+        for zone, table in zip(self.zones, self.zone_counts):
+            zones[zone.name] = {name: {'enter': int(row[0]), 'exit': int(row[1])}
+                                for name, row in zip(names, table)}
+        return {'lines': lines, 'zones': zones}
+
+    def snapshot(self):
+        """Trạng thái cần để vẽ overlay ở luồng khác (tổng theo chiều của từng đường/vùng)"""
+        return self.version, self.line_counts.sum(axis=1), self.zone_counts.sum(axis=1)
+
+    def _render(self, shape, line_totals, zone_totals):
+        """Vẽ toàn bộ đường/vùng và số đếm lên một lớp riêng"""
+        height, width = shape[:2]
+        geometry = self._geometry(width, height)
+        layer = np.zeros((height, width, 3), dtype=np.uint8)
+        for zone_index, zone in enumerate(self.zones):
+            start = geometry.edge_offsets[zone_index]
+            polygon = geometry.edge_start[start:start + len(zone.polygon)].astype(np.int32)
+            cv2.polylines(layer, [polygon], True, (255, 200, 0), 2)
+            x, y = polygon.min(axis=0)
+            cv2.putText(layer, f"{zone.name}: in {zone_totals[zone_index][0]} "
+                               f"out {zone_totals[zone_index][1]}",
+                        (int(x) + 5, int(y) + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                        (255, 200, 0), 1)
+        for line_index, line in enumerate(self.lines):
+            a = geometry.line_start[line_index]
+            b = geometry.line_end[line_index]
+            cv2.line(layer, tuple(a.astype(int)), tuple(b.astype(int)), (0, 255, 255), 2)
+            # Mũi tên chỉ chiều forward tại trung điểm
+            middle = (a + b) / 2.0
+            normal = np.array([-(b - a)[1], (b - a)[0]])
+            normal = normal / max(np.hypot(*normal), 1e-6) * 25.0
+            cv2.arrowedLine(layer, tuple(middle.astype(int)), tuple((middle + normal).astype(int)),
+                            (0, 255, 255), 2, tipLength=0.4)
+            cv2.putText(layer, f"{line.name}: F {line_totals[line_index][0]} "
+                               f"B {line_totals[line_index][1]}",
+                        (int(a[0]) + 5, int(a[1]) - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                        (0, 255, 255), 1)
+        return layer, np.nonzero(layer.any(axis=2))
+
+    def draw(self, frame, snapshot=None):
+        """
+        Vẽ overlay lên frame. Lớp overlay chỉ được vẽ lại khi kích thước frame hoặc
+        số đếm thay đổi; mỗi frame chỉ sao chép các pixel của lớp lên frame.
+        """
+        version, line_totals, zone_totals = snapshot if snapshot is not None else self.snapshot()
+        key = (frame.shape[:2], version)
+        # (key, lớp, pixel) thay cùng lúc - không đọc lẫn lớp của kích thước khác
+        cached = self._layer
+        if cached is None or cached[0] != key:
+            cached = (key, *self._render(frame.shape, line_totals, zone_totals))
+            self._layer = cached
+        _, layer, pixels = cached
+        frame[pixels] = layer[pixels]
+        return frame
@@ -0,0 +1,273 @@
+"""
+Cache kết quả detection + tracking theo từng frame để đếm lại không cần chạy model.
+
+Mỗi video được lưu thành một thư mục gồm các cột NumPy (.npy, mở được bằng
+memory map) và meta.json:
+
+    frame_offsets.npy  (F + 1) int64   - box của frame i nằm ở [offsets[i], offsets[i + 1])
+    timestamps.npy     (F,) float64    - thời điểm của frame (giây, MediaClock)
+    flags.npy          (F,) uint8      - FLAG_PREDICTED / FLAG_DETECTED / FLAG_HELD
+    xyxy.npy           (N, 4) float32  - box theo tọa độ frame gốc
+    ids.npy            (N,) int64      - tracking ID
+    classes.npy        (N,) int16
+    confidences.npy    (N,) float32
+
+Chỉ frame chạy detector mới có box; frame bỏ qua theo stride / motion gate
+được phát lại bằng đúng logic dự đoán của VehicleCounter.step(), nên
+VehicleCounter.replay() cho kết quả giống hệt lần chạy gốc với cùng cài đặt.
+"""
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.detections'
+
+# Loại frame
+FLAG_PREDICTED = 0  # Không chạy detector (stride) - vị trí dự đoán
+FLAG_DETECTED = 1   # Có kết quả detector
+FLAG_HELD = 2       # Motion gate bỏ qua - giữ nguyên track
+
+# Cài đặt trong meta.json quyết định detection đã lưu (xem VehicleCounter.detection_settings).
+# Đường đếm/layout không nằm trong đây: phát lại và recount đếm lại từ cache.
+DETECTION_SETTINGS = ('model_path', 'backend', 'int8', 'inference_size', 'vehicle_classes',
+                      'roi', 'motion_gate')
+
+_COLUMNS = (
+    ('xyxy', np.float32),
+    ('ids', np.int64),
+    ('classes', np.int16),
+    ('confidences', np.float32),
+)
+
+
+def cache_path_for(video_path, output_dir=None):
+    """Đường dẫn cache mặc định: <tên video>.detections (cạnh video hoặc trong output_dir)"""
+    base = os.path.splitext(os.path.basename(video_path))[0] + CACHE_SUFFIX
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(video_path)), base)
+
+
+# Số frame gom trong RAM trước khi ghi nối vào các file cột trong thư mục tạm
+FLUSH_FRAMES = 1000
+
+# Cột theo frame khi đang ghi; frame_offsets được tính từ 'counts' lúc close()
+_FRAME_COLUMNS = (
+    ('timestamps', np.float64),
+    ('flags', np.uint8),
+    ('counts', np.int64),
+)
+
+
+class DetectionCacheWriter:
+    def __init__(self, path, video_path=None, fps=None, flush_frames=FLUSH_FRAMES, **meta):
+        """
+        Các cột được ghi nối dần vào thư mục tạm <path>.tmp (mỗi flush_frames frame)
+        nên RAM không tăng theo độ dài video; close() đổi chúng thành .npy rồi mới
+        thay cache cũ.
+
+        Args:
+            path: Thư mục cache (ghi đè nếu đã có)
+            video_path, fps: Thông tin video nguồn lưu trong meta.json
+            flush_frames: Số frame giữ trong RAM trước khi ghi ra thư mục tạm
+            meta: Thông tin thêm (cài đặt model/counter lúc tạo cache)
+        """
+        self.path = path
+        self.meta = dict(meta, video=video_path, fps=fps)
+        self.flush_frames = max(1, int(flush_frames))
+        self.frame_height = None
+        self.frame_width = None
+        self.frames = 0
+        self._temp_path = path + '.tmp'
+        shutil.rmtree(self._temp_path, ignore_errors=True)
+        os.makedirs(self._temp_path)
+        # Nhị phân thô, ghi nối theo thứ tự frame (.bin -> .npy khi close)
+        self._files = {name: open(os.path.join(self._temp_path, f'{name}.bin'), 'wb')
+                       for name, _ in _FRAME_COLUMNS + _COLUMNS}
+        self._pending = {name: [] for name, _ in _FRAME_COLUMNS + _COLUMNS}
+        self._pending_frames = 0
+
+    def __len__(self):
+        return self.frames
+
+    def append(self, timestamp, detections=None, flag=FLAG_DETECTED,
+               frame_height=None, frame_width=None):
+        """Ghi một frame (gọi theo đúng thứ tự frame)"""
+        if self.frame_height is None:
+            self.frame_height, self.frame_width = frame_height, frame_width
+        pending = self._pending
+        pending['timestamps'].append(timestamp)
+        pending['flags'].append(flag)
+        if flag != FLAG_DETECTED or detections is None:
+            pending['counts'].append(0)
+        else:
+            pending['counts'].append(len(detections))
+            if len(detections):
+                pending['xyxy'].append(detections.xyxy)
+                pending['ids'].append(detections.ids)
+                pending['classes'].append(detections.classes)
+                pending['confidences'].append(detections.confidences)
+        self.frames += 1
+        self._pending_frames += 1
+        if self._pending_frames >= self.flush_frames:
+            self._flush()
+
+    def _flush(self):
+        """Ghi nối các frame đang giữ trong RAM vào file cột"""
+        for name, dtype in _FRAME_COLUMNS:
+            np.asarray(self._pending[name], dtype=dtype).tofile(self._files[name])
+        for name, dtype in _COLUMNS:
+            if self._pending[name]:
+                np.concatenate(self._pending[name]).astype(dtype, copy=False).tofile(
+                    self._files[name])
+        for chunks in self._pending.values():
+            chunks.clear()
+        self._pending_frames = 0
+
+    def _column(self, name, dtype):
+        """Mở file cột thô (memory map, không đọc vào RAM)"""
+        raw = os.path.join(self._temp_path, f'{name}.bin')
+        shape = (-1, 4) if name == 'xyxy' else (-1,)
+        if os.path.getsize(raw) == 0:
+            return np.zeros((0,) + shape[1:], dtype=dtype)
+        return np.memmap(raw, dtype=dtype, mode='r').reshape(shape)
+
+    def close(self):
+        """Ghi phần còn lại, đổi các cột thành .npy và thay cache cũ"""
+        self._flush()
+        for f in self._files.values():
+            f.close()
+        temp_path = self._temp_path
+        counts = self._column('counts', np.int64)
+        frame_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=frame_offsets[1:])
+        del counts
+        np.save(os.path.join(temp_path, 'frame_offsets.npy'), frame_offsets)
+        for name, dtype in _FRAME_COLUMNS + _COLUMNS:
+            if name != 'counts':
+                column = self._column(name, dtype)
+                np.save(os.path.join(temp_path, f'{name}.npy'), column)
+                del column
+            os.remove(os.path.join(temp_path, f'{name}.bin'))
+        meta = dict(self.meta, frame_height=self.frame_height, frame_width=self.frame_width)
+        return _publish(temp_path, self.path, frame_offsets, meta)
+
+    def discard(self):
+        """Bỏ cache đang ghi dở (cache cũ ở path, nếu có, giữ nguyên)"""
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self._temp_path, ignore_errors=True)
+
+
+def write_cache(path, frame_offsets, timestamps, flags, columns, meta):
+    """
+    Ghi cache từ các cột đã có sẵn (qua thư mục tạm rồi đổi tên để không để lại
+    cache dở dang).
+
+    Args:
+        columns: dict tên cột -> mảng (None = cột rỗng), xem _COLUMNS
+        meta: Thông tin lưu trong meta.json (cần frame_height, frame_width)
+    """
+    temp_path = path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    frame_offsets = np.asarray(frame_offsets, dtype=np.int64)
+    np.save(os.path.join(temp_path, 'frame_offsets.npy'), frame_offsets)
+    np.save(os.path.join(temp_path, 'timestamps.npy'), np.asarray(timestamps, dtype=np.float64))
+    np.save(os.path.join(temp_path, 'flags.npy'), np.asarray(flags, dtype=np.uint8))
+    for name, dtype in _COLUMNS:
+        column = columns.get(name)
+        if column is None:
+            column = np.zeros((0, 4) if name == 'xyxy' else 0, dtype=dtype)
+        np.save(os.path.join(temp_path, f'{name}.npy'), np.asarray(column).astype(dtype, copy=False))
+    return _publish(temp_path, path, frame_offsets, meta)
+
+
+def _publish(temp_path, path, frame_offsets, meta):
+    """Ghi meta.json vào thư mục tạm đã đủ cột rồi đổi tên thành cache"""
+    meta = dict(meta, version=CACHE_VERSION, frames=len(frame_offsets) - 1,
+                detections=int(frame_offsets[-1]), created=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    with open(os.path.join(temp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+    return path
+
+
+def read_meta(path):
+    """Đọc meta.json của cache (không mở các cột)"""
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def changed_settings(meta, settings):
+    """
+    Các cài đặt detection khác nhau giữa cache và cài đặt hiện tại.
+
+    Args:
+        meta: meta.json của cache
+        settings: Cài đặt hiện tại (dạng VehicleCounter.detection_settings(), khóa
+            không có trong settings thì bỏ qua)
+
+    Returns:
+        list: Tên các cài đặt khác (cache cũ không lưu cài đặt thì coi là khác)
+    """
+    changed = [key for key in DETECTION_SETTINGS
+               if key in settings and (key not in meta or meta[key] != settings[key])]
+    # Với ROI, vùng detect đi theo đường đếm: dời đường đếm thì box ngoài dải cũ không có
+    if (settings.get('roi') is not None and 'line_position' in settings and
+            abs(meta.get('line_position', -1.0) - settings['line_position']) > 1e-6):
+        changed.append('line_position')
+    return changed
+
+
+class DetectionCache:
+    def __init__(self, path, mmap=True):
+        """
+        Mở cache đã ghi.
+
+        Args:
+            mmap: Mở các cột bằng memory map (không đọc toàn bộ vào RAM)
+        """
+        self.path = path
+        self.meta = read_meta(path)
+        if self.meta.get('version') != CACHE_VERSION:
+            raise ValueError(f"Phiên bản cache không hỗ trợ: {self.meta.get('version')}")
+        mode = 'r' if mmap else None
+
+        def load(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode)
+
+        self.frame_offsets = load('frame_offsets')
+        self.timestamps = load('timestamps')
+        self.flags = load('flags')
+        for name, _ in _COLUMNS:
+            setattr(self, name, load(name))
+
+    def __len__(self):
+        return len(self.flags)
+
+    @property
+    def frame_height(self):
+        return self.meta['frame_height']
+
+    @property
+    def frame_width(self):
+        return self.meta['frame_width']
+
+    @property
+    def fps(self):
+        return self.meta.get('fps')
+
+    def frame_slice(self, index):
+        return slice(int(self.frame_offsets[index]), int(self.frame_offsets[index + 1]))
+
+    def frame_columns(self, index):
+        """(xyxy, ids, classes, confidences) của frame index (mảng NumPy)"""
+        rows = self.frame_slice(index)
+        return (np.asarray(self.xyxy[rows], dtype=np.float64),
+                np.asarray(self.ids[rows], dtype=np.int64),
+                np.asarray(self.classes[rows], dtype=np.int64),
+                np.asarray(self.confidences[rows], dtype=np.float32))
@@ -0,0 +1,395 @@
+"""
+Nhật ký sự kiện vượt đường đếm trên đĩa (append-only) cho chạy 24/7.
+
+Mỗi lượt xe vượt đường đếm là một bản ghi nhị phân kích thước cố định
+(RECORD_DTYPE, 40 byte), ghi nối vào file của ngày theo giờ địa phương:
+
+    <thư mục>/meta.json            - tên đường đếm, tên class, định dạng bản ghi
+    <thư mục>/YYYY-MM-DD.events    - các bản ghi của ngày, theo thứ tự thời gian
+    <thư mục>/YYYY-MM-DD.index     - chỉ mục thưa: (timestamp, số bản ghi) của
+                                     mỗi INDEX_STRIDE bản ghi
+
+Khi đọc, file .events được mở bằng memory map; chỉ mục thưa cho biết khối
+bản ghi chứa khoảng thời gian cần tìm nên truy vấn (ví dụ xe tải đi xuống
+từ 07:00 đến 09:00 trong cả tháng) chỉ chạm vào vài trang của mỗi file.
+File không có header: số bản ghi = kích thước file / RECORD_DTYPE.itemsize,
+phần bản ghi dở dang (mất điện giữa lúc ghi) được cắt bỏ khi mở lại để ghi,
+chỉ mục thiếu được dựng lại từ file dữ liệu.
+
+Timestamp theo vị trí trong video (không phải giờ hệ thống) được cộng với
+origin (mặc định: thời điểm tạo writer) trước khi ghi.
+"""
+import datetime
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from count_aggregation import EPOCH_THRESHOLD, MAIN_DIRECTIONS, MAIN_LINE
+from counting_zones import LINE_DIRECTIONS
+
+LOG_VERSION = 1
+# Mỗi INDEX_STRIDE bản ghi có một mục trong chỉ mục thưa
+INDEX_STRIDE = 1024
+EVENTS_SUFFIX = '.events'
+INDEX_SUFFIX = '.index'
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),   # Giây (epoch)
+    ('frame', '<i8'),
+    ('track_id', '<i8'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('class_id', '<i2'),
+    ('line', '<i2'),        # Chỉ số trong meta['lines']
+    ('direction', 'i1'),    # 0 = up/forward, 1 = down/backward
+    ('_reserved', 'V3'),
+])
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('record', '<i8')])
+
+
+def _meta_path(directory):
+    return os.path.join(directory, 'meta.json')
+
+
+def _load_meta(directory):
+    path = _meta_path(directory)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != LOG_VERSION:
+        raise ValueError(f"Phiên bản nhật ký không hỗ trợ: {meta.get('version')}")
+    return meta
+
+
+def _save_meta(directory, meta):
+    temp_path = _meta_path(directory) + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, _meta_path(directory))
+
+
+def _build_index(timestamps):
+    """Chỉ mục thưa từ cột timestamp của cả file"""
+    records = np.arange(0, len(timestamps), INDEX_STRIDE, dtype=np.int64)
+    index = np.zeros(len(records), dtype=INDEX_DTYPE)
+    index['timestamp'] = timestamps[records]
+    index['record'] = records
+    return index
+
+
+def parse_time(value):
+    """
+    Thời điểm (giây epoch) từ số, datetime hoặc chuỗi 'YYYY-MM-DD[ HH:MM[:SS]]'
+    (giờ địa phương).
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return time.mktime(value.timetuple())
+    for pattern in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(value, pattern))
+        except ValueError:
+            continue
+    raise ValueError(f"Thời điểm không hợp lệ: {value} (dạng YYYY-MM-DD HH:MM)")
+
+
+def parse_time_of_day(value):
+    """'HH:MM[:SS]' -> số giây tính từ 0 giờ"""
+    parts = [int(part) for part in value.split(':')]
+    if not 2 <= len(parts) <= 3:
+        raise ValueError(f"Giờ không hợp lệ: {value} (dạng HH:MM)")
+    parts += [0] * (3 - len(parts))
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+class EventLogWriter:
+    def __init__(self, directory, line_names=(MAIN_LINE,), class_names=None, origin=None,
+                 fsync_interval=5.0):
+        """
+        Args:
+            directory: Thư mục nhật ký (tạo mới nếu chưa có, ghi nối nếu đã có)
+            line_names: Tên các đường đếm của counter (đường đầu tiên là đường đếm chính)
+            class_names: dict class -> tên (lưu vào meta.json để truy vấn theo tên)
+            origin: Giây epoch cộng vào timestamp theo video (None = lúc tạo writer)
+            fsync_interval: Đẩy dữ liệu xuống đĩa tối đa mỗi N giây
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta = _load_meta(directory) or {
+            'version': LOG_VERSION,
+            'record_size': RECORD_DTYPE.itemsize,
+            'index_stride': INDEX_STRIDE,
+            'lines': [MAIN_LINE],
+            'classes': {},
+        }
+        for cls, name in (class_names or {}).items():
+            self.meta['classes'][str(cls)] = name
+        self.origin = time.time() if origin is None else origin
+        self.fsync_interval = fsync_interval
+        self.records_written = 0
+        self._day = None
+        self._events_fd = None
+        self._index_fd = None
+        self._count = 0  # Số bản ghi trong file của ngày hiện tại
+        self._last_sync = time.monotonic()
+        self.set_lines(line_names)
+
+    def set_lines(self, line_names):
+        """Ánh xạ đường đếm của counter sang chỉ số trong meta (thêm tên mới nếu chưa có)"""
+        lines = self.meta['lines']
+        for name in line_names:
+            if name not in lines:
+                lines.append(name)
+        self._line_ids = np.array([lines.index(name) for name in line_names], dtype=np.int16)
+        _save_meta(self.directory, self.meta)
+
+    def _open_day(self, day):
+        """Mở file của ngày để ghi nối (cắt bản ghi dở dang, dựng lại chỉ mục nếu thiếu)"""
+        self._close_files()
+        base = os.path.join(self.directory, day)
+        events_path, index_path = base + EVENTS_SUFFIX, base + INDEX_SUFFIX
+        size = os.path.getsize(events_path) if os.path.exists(events_path) else 0
+        self._count = size // RECORD_DTYPE.itemsize
+        if size != self._count * RECORD_DTYPE.itemsize:
+            os.truncate(events_path, self._count * RECORD_DTYPE.itemsize)
+        expected = -(-self._count // INDEX_STRIDE)
+        index_size = os.path.getsize(index_path) if os.path.exists(index_path) else 0
+        if index_size != expected * INDEX_DTYPE.itemsize:
+            timestamps = (np.memmap(events_path, dtype=RECORD_DTYPE, mode='r')['timestamp']
+                          if self._count else np.zeros(0))
+            with open(index_path, 'wb') as f:
+                f.write(_build_index(timestamps).tobytes())
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self._events_fd = os.open(events_path, flags)
+        self._index_fd = os.open(index_path, flags)
+        self._day = day
+
+    def record(self, frame, timestamp, track_ids, classes, directions, line=0, x=0.0, y=0.0):
+        """
+        Ghi các lượt vượt đường đếm của một frame (cùng tham số với
+        CountAggregator.record(), line là chỉ số đường của counter).
+        """
+        count = len(track_ids)
+        if count == 0:
+            return
+        if timestamp < EPOCH_THRESHOLD:
+            timestamp = self.origin + timestamp
+        day = time.strftime('%Y-%m-%d', time.localtime(timestamp))
+        if day != self._day:
+            self._open_day(day)
+
+        records = np.zeros(count, dtype=RECORD_DTYPE)
+        records['timestamp'] = timestamp
+        records['frame'] = frame
+        records['track_id'] = track_ids
+        records['x'] = x
+        records['y'] = y
+        records['class_id'] = classes
+        records['line'] = self._line_ids[line]
+        records['direction'] = directions
+        os.write(self._events_fd, records.tobytes())
+
+        # Mục chỉ mục cho mỗi bản ghi có số thứ tự chia hết cho INDEX_STRIDE
+        first = -(-self._count // INDEX_STRIDE) * INDEX_STRIDE
+        if first < self._count + count:
+            index = np.zeros(len(range(first, self._count + count, INDEX_STRIDE)),
+                             dtype=INDEX_DTYPE)
+            index['timestamp'] = timestamp
+            index['record'] = np.arange(first, self._count + count, INDEX_STRIDE)
+            os.write(self._index_fd, index.tobytes())
+        self._count += count
+        self.records_written += count
+
+        if time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.flush()
+
+    def flush(self):
+        """Đẩy dữ liệu đã ghi xuống đĩa"""
+        for fd in (self._events_fd, self._index_fd):
+            if fd is not None:
+                os.fsync(fd)
+        self._last_sync = time.monotonic()
+
+    def _close_files(self):
+        self.flush()
+        for fd in (self._events_fd, self._index_fd):
+            if fd is not None:
+                os.close(fd)
+        self._events_fd = self._index_fd = None
+        self._day = None
+
+    def close(self):
+        self._close_files()
+
+
+class EventLog:
+    def __init__(self, directory):
+        """Đọc nhật ký sự kiện đã ghi bởi EventLogWriter"""
+        self.directory = directory
+        self.meta = _load_meta(directory)
+        if self.meta is None:
+            raise IOError(f"Không tìm thấy nhật ký sự kiện: {directory}")
+        self.line_names = self.meta['lines']
+        self.class_names = {int(cls): name for cls, name in self.meta['classes'].items()}
+
+    def days(self):
+        """Các ngày có dữ liệu ('YYYY-MM-DD'), theo thứ tự"""
+        pattern = os.path.join(self.directory, '*' + EVENTS_SUFFIX)
+        return sorted(os.path.basename(path)[:-len(EVENTS_SUFFIX)]
+                      for path in glob.glob(pattern))
+
+    def _open_day(self, day):
+        """(bản ghi dạng memory map, chỉ mục thưa) của một ngày"""
+        base = os.path.join(self.directory, day)
+        count = os.path.getsize(base + EVENTS_SUFFIX) // RECORD_DTYPE.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE), np.zeros(0, dtype=INDEX_DTYPE)
+        records = np.memmap(base + EVENTS_SUFFIX, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+        index_path = base + INDEX_SUFFIX
+        expected = -(-count // INDEX_STRIDE)
+        if (os.path.exists(index_path) and
+                os.path.getsize(index_path) >= expected * INDEX_DTYPE.itemsize):
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE, count=expected)
+        else:
+            # Chỉ mục bị thiếu (writer đang ghi hoặc bị ngắt): đọc thưa từ file dữ liệu
+            index = _build_index(records['timestamp'])
+        return records, index
+
+    def _range(self, records, index, start, end):
+        """Các bản ghi có start <= timestamp < end, tìm khối qua chỉ mục thưa"""
+        # Mục cuối cùng có timestamp < start: mọi bản ghi trước nó đều sớm hơn start
+        first = np.searchsorted(index['timestamp'], start, side='left') - 1
+        last = np.searchsorted(index['timestamp'], end, side='left')
+        low = int(index['record'][first]) if first >= 0 else 0
+        high = int(index['record'][last]) if last < len(index) else len(records)
+        block = records[low:high]
+        timestamps = block['timestamp']
+        return block[(timestamps >= start) & (timestamps < end)]
+
+    def _class_ids(self, classes):
+        by_name = {name.lower(): cls for cls, name in self.class_names.items()}
+        ids = []
+        for cls in classes:
+            if isinstance(cls, str) and not cls.isdigit():
+                if cls.lower() not in by_name:
+                    raise ValueError(f"Không có loại xe: {cls} (có: {list(by_name)})")
+                ids.append(by_name[cls.lower()])
+            else:
+                ids.append(int(cls))
+        return ids
+
+    def _direction_mask(self, records, directions):
+        """'up'/'down' chỉ áp dụng cho đường đếm chính, 'forward'/'backward' cho đường khác"""
+        main = self.line_names.index(MAIN_LINE) if MAIN_LINE in self.line_names else -1
+        mask = np.zeros(len(records), dtype=bool)
+        for name in directions:
+            if name in MAIN_DIRECTIONS:
+                mask |= ((records['line'] == main) &
+                         (records['direction'] == MAIN_DIRECTIONS.index(name)))
+            elif name in LINE_DIRECTIONS:
+                mask |= ((records['line'] != main) &
+                         (records['direction'] == LINE_DIRECTIONS.index(name)))
+            else:
+                raise ValueError(f"Chiều không hợp lệ: {name}")
+        return mask
+
+    def query(self, start=None, end=None, classes=None, directions=None, lines=None,
+              time_of_day=None):
+        """
+        Các lượt vượt đường thỏa điều kiện, theo thứ tự thời gian.
+
+        Args:
+            start, end: Khoảng thời gian [start, end) - giây epoch, datetime hoặc
+                chuỗi 'YYYY-MM-DD HH:MM' (None = không giới hạn)
+            classes: Loại xe (tên hoặc class id)
+            directions: 'up', 'down', 'forward', 'backward'
+            lines: Tên đường đếm
+            time_of_day: ('HH:MM', 'HH:MM') - chỉ lấy khung giờ này của mỗi ngày
+
+        Returns:
+            np.ndarray: Mảng bản ghi RECORD_DTYPE
+        """
+        start = -np.inf if start is None else parse_time(start)
+        end = np.inf if end is None else parse_time(end)
+        window = None
+        if time_of_day is not None:
+            window = tuple(parse_time_of_day(value) for value in time_of_day)
+        class_ids = self._class_ids(classes) if classes else None
+        line_ids = None
+        if lines:
+            line_ids = [self.line_names.index(name) for name in lines if name in self.line_names]
+
+        results = []
+        for day in self.days():
+            midnight = time.mktime(time.strptime(day, '%Y-%m-%d'))
+            if midnight > end or midnight + 2 * 86400 < start:
+                continue  # +2 ngày: an toàn với ngày đổi giờ (DST)
+            day_start, day_end = start, end
+            if window is not None:
+                # Giờ địa phương trong ngày (mktime xử lý ngày đổi giờ)
+                year, month, date = (int(part) for part in day.split('-'))
+                base = datetime.datetime(year, month, date)
+                day_start = max(start, time.mktime(
+                    (base + datetime.timedelta(seconds=window[0])).timetuple()))
+                day_end = min(end, time.mktime(
+                    (base + datetime.timedelta(seconds=window[1])).timetuple()))
+                if day_end <= day_start:
+                    continue
+            records, index = self._open_day(day)
+            if len(records) == 0:
+                continue
+            selected = self._range(records, index, day_start, day_end)
+            if class_ids is not None:
+                selected = selected[np.isin(selected['class_id'], class_ids)]
+            if line_ids is not None:
+                selected = selected[np.isin(selected['line'], line_ids)]
+            if directions:
+                selected = selected[self._direction_mask(selected, directions)]
+            results.append(np.array(selected))
+        return np.concatenate(results) if results else np.zeros(0, dtype=RECORD_DTYPE)
+
+    def summarize(self, records):
+        """
+        Số lượt theo đường, chiều và loại xe.
+
+        Returns:
+            dict: {'total', 'lines': {đường: {chiều: {loại xe: số lượt}}}}
+        """
+        lines = {}
+        if len(records):
+            keys, counts = np.unique(
+                np.stack([records['line'], records['direction'], records['class_id']], axis=1),
+                axis=0, return_counts=True)
+            for (line, direction, cls), count in zip(keys.tolist(), counts.tolist()):
+                line_name = self.line_names[line]
+                names = MAIN_DIRECTIONS if line_name == MAIN_LINE else LINE_DIRECTIONS
+                by_class = lines.setdefault(line_name, {}).setdefault(names[direction], {})
+                by_class[self.class_names.get(cls, str(cls))] = count
+        return {'total': int(len(records)), 'lines': lines}
+
+    def to_table(self, records):
+        """Bản ghi dạng dict tên cột -> list (để ghi bằng write_table_csv/parquet)"""
+        lines = records['line'].tolist()
+        classes = records['class_id'].tolist()
+        return {
+            'timestamp': records['timestamp'].tolist(),
+            'time': [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+                     for t in records['timestamp']],
+            'frame': records['frame'].tolist(),
+            'track_id': records['track_id'].tolist(),
+            'class_id': classes,
+            'class_name': [self.class_names.get(cls, str(cls)) for cls in classes],
+            'line': [self.line_names[line] for line in lines],
+            'direction': [(MAIN_DIRECTIONS if self.line_names[line] == MAIN_LINE
+                           else LINE_DIRECTIONS)[direction]
+                          for line, direction in zip(lines, records['direction'].tolist())],
+            'x': np.round(records['x'].astype(np.float64), 1).tolist(),
+            'y': np.round(records['y'].astype(np.float64), 1).tolist(),
+        }
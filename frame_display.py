@@ -0,0 +1,98 @@
+"""
+Chuyển frame sang khung hiển thị Tk với buffer dùng lại.
+
+Trước đây mỗi frame hiển thị được đổi màu ở độ phân giải gốc rồi mới thu
+nhỏ, tạo một ImageTk.PhotoImage mới và xếp một lần root.after cho nó - kể
+cả khi main thread của Tk chưa vẽ xong frame trước, nên khi máy bận hàng
+đợi sự kiện của Tk dài dần.
+
+FrameMailbox:
+- thu nhỏ frame BGR trước (vào buffer BGR dùng lại), rồi mới đổi màu sang
+  RGB vào một trong vài buffer cấp phát sẵn (cv2 ghi thẳng vào dst);
+- là hộp thư một chỗ: frame mới thay frame chưa kịp hiển thị (đếm vào
+  frames_replaced) và chỉ cần xếp root.after khi hộp đang trống, nên Tk
+  không bao giờ tồn đọng quá một frame;
+- main thread lấy frame bằng consume() và dán vào một PhotoImage dùng lại
+  (PhotoImage.paste) thay vì tạo ảnh Tk mới.
+
+    if mailbox.put(frame, 960, 540):          # luồng xử lý
+        root.after(0, show_latest)
+    mailbox.consume(paste_into_photo)         # main thread (trong show_latest)
+"""
+import threading
+
+import cv2
+import numpy as np
+
+# Số buffer RGB: một frame đang chờ, một frame main thread đang dán, một frame đang chuẩn bị
+_POOL_SIZE = 3
+
+
+def display_size(width, height, max_width, max_height):
+    """Kích thước hiển thị giữ tỷ lệ, không phóng to"""
+    ratio = min(max_width / width, max_height / height, 1.0)
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+class FrameMailbox:
+    def __init__(self):
+        self.frames_posted = 0
+        self.frames_replaced = 0  # Bị frame mới thay trước khi kịp hiển thị
+        self._lock = threading.Lock()
+        self._size = None
+        self._buffers = []
+        self._resized = None  # Buffer BGR sau khi thu nhỏ (chỉ luồng xử lý dùng)
+        self._pending = None
+        self._showing = None
+
+    def _free_buffer(self, size):
+        """Buffer RGB không phải frame đang chờ hay đang được dán"""
+        with self._lock:
+            if size != self._size:
+                # Đổi kích thước (đổi video/khung hiển thị): cấp phát lại bộ buffer
+                self._size = size
+                self._buffers = [np.empty((size[1], size[0], 3), dtype=np.uint8)
+                                 for _ in range(_POOL_SIZE)]
+                self._resized = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            for buffer in self._buffers:
+                if buffer is not self._pending and buffer is not self._showing:
+                    return buffer
+        raise RuntimeError("FrameMailbox: không còn buffer rảnh")
+
+    def put(self, frame, max_width, max_height):
+        """
+        Chuẩn bị frame BGR để hiển thị và đặt vào hộp thư (luồng xử lý).
+
+        Returns:
+            bool: True nếu hộp thư đang trống - người gọi cần xếp một lần consume()
+                trên main thread; False nếu đã thay frame đang chờ (lần consume()
+                đã xếp sẽ lấy frame mới này)
+        """
+        height, width = frame.shape[:2]
+        size = display_size(width, height, max_width, max_height)
+        buffer = self._free_buffer(size)
+        if size != (width, height):
+            frame = cv2.resize(frame, size, dst=self._resized)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buffer)
+        with self._lock:
+            replaced = self._pending is not None
+            self._pending = buffer
+            self.frames_posted += 1
+            self.frames_replaced += int(replaced)
+        return not replaced
+
+    def consume(self, show):
+        """
+        Gọi show(frame_rgb) với frame mới nhất (main thread); frame chỉ hợp lệ
+        trong lúc show chạy. Không làm gì nếu hộp thư trống.
+        """
+        with self._lock:
+            buffer, self._pending = self._pending, None
+            self._showing = buffer
+        if buffer is None:
+            return
+        try:
+            show(buffer)
+        finally:
+            with self._lock:
+                self._showing = None
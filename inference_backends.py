@@ -0,0 +1,198 @@
+"""
+Backend inference cho CPU: xuất model sang ONNX / OpenVINO một lần, lưu cache
+và nạp lại bằng Ultralytics (AutoBackend chạy ONNX Runtime / OpenVINO bên dưới),
+nên model.track()/predict(), ByteTrack và update_counts không cần thay đổi.
+
+Cache được đặt tên theo hash nội dung file model + kích thước input + định dạng,
+nên model mới hoặc kích thước khác sẽ tự động được xuất lại.
+
+Tùy chọn INT8 lượng tử hóa tĩnh, hiệu chỉnh (calibration) trên một số frame
+lấy đều từ video mẫu (mặc định video/sample_1.mp4):
+    - ONNX: onnxruntime.quantization.quantize_static (định dạng QDQ)
+    - OpenVINO: nncf.quantize
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('pytorch', 'onnx', 'openvino')
+DEFAULT_CACHE_DIR = os.path.join('models', '.cache')
+DEFAULT_CALIBRATION_VIDEO = os.path.join('video', 'sample_1.mp4')
+
+
+def model_fingerprint(model_path, length=12):
+    """Hash nội dung file model (đổi trọng số -> đổi cache)"""
+    sha1 = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()[:length]
+
+
+def cached_model_path(model_path, backend, imgsz, int8=False, cache_dir=DEFAULT_CACHE_DIR):
+    """Đường dẫn artifact trong cache cho (model, backend, imgsz, int8)"""
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    key = f"{stem}-{model_fingerprint(model_path)}-{imgsz}" + ('-int8' if int8 else '')
+    if backend == 'onnx':
+        return os.path.join(cache_dir, f"{key}.onnx")
+    if backend == 'openvino':
+        # Ultralytics nhận diện model OpenVINO qua hậu tố thư mục _openvino_model
+        return os.path.join(cache_dir, f"{key}_openvino_model")
+    raise ValueError(f"Backend không hỗ trợ xuất: {backend}")
+
+
+def letterbox(frame, imgsz, color=(114, 114, 114)):
+    """Resize giữ tỷ lệ + đệm viền về imgsz x imgsz (giống tiền xử lý của Ultralytics)"""
+    height, width = frame.shape[:2]
+    scale = min(imgsz / width, imgsz / height)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    resized = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top = (imgsz - new_height) // 2
+    left = (imgsz - new_width) // 2
+    return cv2.copyMakeBorder(resized, top, imgsz - new_height - top,
+                              left, imgsz - new_width - left,
+                              cv2.BORDER_CONSTANT, value=color)
+
+
+def calibration_frames(video_path, imgsz, count=64):
+    """
+    Lấy count frame cách đều trong video, đã tiền xử lý thành tensor NCHW float32 [0, 1].
+
+    Returns:
+        list: Mỗi phần tử có shape (1, 3, imgsz, imgsz)
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Không thể mở video hiệu chỉnh INT8: {video_path}")
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    indices = np.linspace(0, max(total - 1, 0), num=count, dtype=int)
+    tensors = []
+    try:
+        for index in np.unique(indices):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            image = cv2.cvtColor(letterbox(frame, imgsz), cv2.COLOR_BGR2RGB)
+            tensor = image.transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+            tensors.append(np.ascontiguousarray(tensor))
+    finally:
+        cap.release()
+    if not tensors:
+        raise IOError(f"Không đọc được frame nào từ {video_path}")
+    return tensors
+
+
+def _quantize_onnx(fp32_path, int8_path, frames):
+    from onnxruntime import InferenceSession
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat,
+                                          QuantType, quantize_static)
+
+    input_name = InferenceSession(fp32_path, providers=['CPUExecutionProvider']) \
+        .get_inputs()[0].name
+
+    class _FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self._frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self._frames, None)
+            return None if frame is None else {input_name: frame}
+
+    quantize_static(fp32_path, int8_path, _FrameReader(),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8)
+
+
+def _quantize_openvino(fp32_dir, int8_dir, frames):
+    import nncf
+    import openvino as ov
+
+    xml_name = next(name for name in os.listdir(fp32_dir) if name.endswith('.xml'))
+    model = ov.Core().read_model(os.path.join(fp32_dir, xml_name))
+    quantized = nncf.quantize(model, nncf.Dataset(frames))
+    os.makedirs(int8_dir, exist_ok=True)
+    ov.save_model(quantized, os.path.join(int8_dir, xml_name))
+    # Ultralytics đọc names/stride/imgsz từ metadata.yaml trong thư mục model
+    for name in os.listdir(fp32_dir):
+        if name.endswith('.yaml'):
+            shutil.copy(os.path.join(fp32_dir, name), int8_dir)
+
+
+def _move_into_cache(source, target):
+    """Đưa artifact vào cache một cách nguyên tử (an toàn khi nhiều tiến trình cùng xuất)"""
+    try:
+        os.replace(source, target)
+    except OSError:
+        # Tiến trình khác đã xuất xong trước - giữ bản đã có
+        if not os.path.exists(target):
+            raise
+
+
+def export_model(model_path, backend, imgsz, int8=False, cache_dir=DEFAULT_CACHE_DIR,
+                 calibration_video=DEFAULT_CALIBRATION_VIDEO, calibration_count=64):
+    """
+    Xuất model sang backend (nếu chưa có trong cache).
+
+    Returns:
+        str: Đường dẫn artifact trong cache
+    """
+    target = cached_model_path(model_path, backend, imgsz, int8, cache_dir)
+    if os.path.exists(target):
+        return target
+
+    from ultralytics import YOLO
+
+    os.makedirs(cache_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='export-', dir=cache_dir)
+    try:
+        # Xuất từ bản sao trong thư mục tạm để không ghi đè file cạnh model gốc
+        work_model = os.path.join(work_dir, os.path.basename(model_path))
+        shutil.copy(model_path, work_model)
+        logger.info("Xuất %s sang %s (imgsz=%d)...", model_path, backend, imgsz)
+        # dynamic=True: cho phép batch nhiều frame và frame không vuông
+        exported = YOLO(work_model).export(format=backend, imgsz=imgsz,
+                                           dynamic=True, verbose=False)
+        if int8:
+            logger.info("Lượng tử hóa INT8 với %d frame từ %s...",
+                        calibration_count, calibration_video)
+            frames = calibration_frames(calibration_video, imgsz, calibration_count)
+            if backend == 'onnx':
+                quantized = os.path.join(work_dir, 'int8.onnx')
+                _quantize_onnx(exported, quantized, frames)
+            else:
+                quantized = os.path.join(work_dir, 'int8_openvino_model')
+                _quantize_openvino(exported, quantized, frames)
+            exported = quantized
+        _move_into_cache(exported, target)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    logger.info("Đã lưu cache: %s", target)
+    return target
+
+
+def load_model(model_path, backend='pytorch', imgsz=640, int8=False, cache_dir=DEFAULT_CACHE_DIR,
+               calibration_video=DEFAULT_CALIBRATION_VIDEO):
+    """
+    Nạp model theo backend.
+
+    Returns:
+        tuple: (model YOLO, imgsz cần truyền khi predict - None với PyTorch)
+    """
+    from ultralytics import YOLO
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn một trong {BACKENDS})")
+    if backend == 'pytorch':
+        return YOLO(model_path), None
+    path = export_model(model_path, backend, imgsz, int8=int8, cache_dir=cache_dir,
+                        calibration_video=calibration_video)
+    return YOLO(path, task='detect'), imgsz
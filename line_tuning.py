@@ -0,0 +1,248 @@
+"""
+Dò vị trí đường đếm trên quỹ đạo đã cache (không chạy lại video).
+
+Từ cache detection (detection_cache.py), mọi quỹ đạo của cả video được gom
+thành các cặp vị trí liên tiếp của từng track. Với luật đếm của
+VehicleCounter.update_counts() (hướng xác định ở lần di chuyển đầu tiên > 1px,
+dung sai ±10px), mỗi cặp sau khi đã có hướng đếm được cho mọi đường đếm y
+nằm trong một khoảng mở:
+
+    xuống: last_y - 10 < y < center_y + 10
+    lên:   center_y - 10 < y < last_y + 10
+
+Hợp các khoảng của từng track rồi cộng dồn (mảng hiệu) cho ra số xe đếm
+được tại MỌI dòng pixel chỉ trong một lần tính, nên kéo thanh trượt chỉ
+còn là một phép tra mảng. Track đổi class giữa chừng được tính theo class
+của cặp sớm nhất chứa từng dòng y, như khi đếm thật.
+
+Quỹ đạo giống hệt các box update_counts() nhận khi đếm: cache chỉ có frame
+chạy detector thì lấy thẳng từ các cột; có frame bỏ qua theo inference_stride
+hoặc motion gate thì chạy VehicleCounter.replay() một lần để lấy vị trí dự
+đoán/giữ nguyên của các frame đó (vị trí không phụ thuộc đường đếm), nên số
+đếm khớp replay() tại mọi vị trí đường đếm.
+"""
+import numpy as np
+
+from detection_cache import DetectionCache, FLAG_DETECTED
+from track_table import DIRECTION_DOWN, DIRECTION_UP
+from vehicle_counter import VehicleCounter
+
+# Dung sai quanh đường đếm (pixel), giống update_counts()
+LINE_TOLERANCE = 10
+
+
+class LineTuner:
+    def __init__(self, cache, vehicle_classes=(2, 3, 5, 7), track_ttl=2.0):
+        """
+        Args:
+            cache: DetectionCache hoặc đường dẫn thư mục cache
+            vehicle_classes: Các class được đếm (như VehicleCounter.vehicle_classes)
+            track_ttl: Track mất quá track_ttl giây được coi là track mới
+        """
+        if not isinstance(cache, DetectionCache):
+            cache = DetectionCache(cache)
+        self.cache = cache
+        self.vehicle_classes = list(vehicle_classes)
+        self.track_ttl = track_ttl
+        self.frame_height = cache.frame_height
+        # profile[class][direction]: số xe theo từng dòng pixel y = 0..frame_height-1
+        self.profiles = {}
+        self._build()
+
+    def _measured(self):
+        """Box của cache chỉ có frame chạy detector: (frame, id, center_y, class)"""
+        cache = self.cache
+        counts = np.diff(np.asarray(cache.frame_offsets))
+        frames = np.repeat(np.arange(len(counts)), counts)
+        xyxy = np.asarray(cache.xyxy, dtype=np.float64)
+        center_y = (xyxy[:, 1] + xyxy[:, 3]) / 2.0
+        return frames, np.asarray(cache.ids), center_y, np.asarray(cache.classes, dtype=np.int64)
+
+    def _replayed(self):
+        """
+        Box mà update_counts() nhận ở mọi frame, kể cả vị trí dự đoán (stride) và
+        vị trí giữ nguyên (motion gate): (frame, id, center_y, class)
+        """
+        counter = VehicleCounter(model_path=None, track_ttl=self.track_ttl)
+        counter.vehicle_classes = list(self.vehicle_classes)
+        frames, ids, center_y, classes = [], [], [], []
+
+        def on_frame(index, detections):
+            if len(detections):
+                xyxy = detections.xyxy
+                frames.append(np.full(len(detections), index, dtype=np.int64))
+                ids.append(np.asarray(detections.ids))
+                center_y.append((xyxy[:, 1] + xyxy[:, 3]) / 2.0)
+                classes.append(np.asarray(detections.classes, dtype=np.int64))
+
+        counter.replay(self.cache, on_frame=on_frame)
+        if not frames:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                    np.zeros(0), np.zeros(0, dtype=np.int64))
+        return tuple(np.concatenate(column) for column in (frames, ids, center_y, classes))
+
+    def _trajectories(self):
+        """Các vị trí được đếm, sắp theo (track, frame): (segment, center_y, class)"""
+        flags = np.asarray(self.cache.flags)
+        if np.all(flags == FLAG_DETECTED):
+            frames, ids, center_y, classes = self._measured()
+        else:
+            frames, ids, center_y, classes = self._replayed()
+
+        keep = np.isin(classes, self.vehicle_classes)
+        frames, ids, center_y, classes = frames[keep], ids[keep], center_y[keep], classes[keep]
+
+        # Sắp theo (id, frame, thứ tự trong frame); ID trùng trong một frame giữ box cuối
+        order = np.lexsort((np.arange(len(ids)), frames, ids))
+        ids, frames = ids[order], frames[order]
+        center_y, classes = center_y[order], classes[order]
+        last_in_frame = np.ones(len(ids), dtype=bool)
+        last_in_frame[:-1] = (ids[1:] != ids[:-1]) | (frames[1:] != frames[:-1])
+        ids, frames = ids[last_in_frame], frames[last_in_frame]
+        center_y, classes = center_y[last_in_frame], classes[last_in_frame]
+
+        # Bảng track xóa track khi một frame ở giữa hai lần xuất hiện cách lần trước
+        # quá track_ttl giây (kiểm tra sau mỗi frame): track xuất hiện lại là đoạn mới
+        timestamps = np.asarray(self.cache.timestamps)
+        new_segment = np.ones(len(ids), dtype=bool)
+        new_segment[1:] = ((ids[1:] != ids[:-1]) |
+                           (timestamps[frames[1:] - 1] - timestamps[frames[:-1]] > self.track_ttl))
+        segments = np.cumsum(new_segment) - 1
+        return segments, center_y, classes
+
+    def _build(self):
+        segments, center_y, classes = self._trajectories()
+        height = self.frame_height
+        self.profiles = {cls: {'up': np.zeros(height, dtype=np.int64),
+                               'down': np.zeros(height, dtype=np.int64)}
+                         for cls in self.vehicle_classes}
+        self.tracks = int(segments[-1]) + 1 if len(segments) else 0
+        if len(segments) < 2:
+            return
+
+        # Cặp (vị trí trước, vị trí hiện tại) trong cùng một đoạn track
+        same = segments[1:] == segments[:-1]
+        pair_segment = segments[1:][same]
+        last_y = center_y[:-1][same]
+        current_y = center_y[1:][same]
+        pair_class = classes[1:][same]
+
+        # Hướng của đoạn = dấu của lần di chuyển đầu tiên > 1px; các cặp trước đó chưa đếm
+        moved = np.abs(current_y - last_y) > 1.0
+        first_move = np.full(self.tracks, len(pair_segment), dtype=np.int64)
+        np.minimum.at(first_move, pair_segment[moved], np.flatnonzero(moved))
+        decided = first_move[pair_segment] <= np.arange(len(pair_segment))
+        direction = np.zeros(self.tracks, dtype=np.int8)
+        has_direction = first_move < len(pair_segment)
+        direction[has_direction] = np.sign(
+            current_y[first_move[has_direction]] - last_y[first_move[has_direction]])
+        pair_direction = direction[pair_segment]
+
+        for name, sign in (('down', DIRECTION_DOWN), ('up', DIRECTION_UP)):
+            mask = decided & (pair_direction == sign)
+            if sign == DIRECTION_DOWN:
+                low, high = last_y[mask] - LINE_TOLERANCE, current_y[mask] + LINE_TOLERANCE
+            else:
+                low, high = current_y[mask] - LINE_TOLERANCE, last_y[mask] + LINE_TOLERANCE
+            # Dòng nguyên y thỏa low < y < high
+            start = np.floor(low).astype(np.int64) + 1
+            stop = np.ceil(high).astype(np.int64)  # không tính stop
+            start, stop = np.clip(start, 0, height), np.clip(stop, 0, height)
+            valid = stop > start
+            segment, cls = pair_segment[mask][valid], pair_class[mask][valid]
+            start, stop = start[valid], stop[valid]
+            # Track đổi class giữa chừng: class được đếm phụ thuộc vị trí đường đếm
+            class_min = np.full(self.tracks, np.iinfo(np.int64).max, dtype=np.int64)
+            class_max = np.full(self.tracks, np.iinfo(np.int64).min, dtype=np.int64)
+            np.minimum.at(class_min, segment, cls)
+            np.maximum.at(class_max, segment, cls)
+            mixed = (class_min != class_max)[segment]
+            self._accumulate(name, segment[~mixed], start[~mixed], stop[~mixed], cls[~mixed])
+            self._paint(name, segment[mixed], start[mixed], stop[mixed], cls[mixed])
+
+    def _accumulate(self, name, segment, start, stop, classes):
+        """Hợp các khoảng của từng đoạn track (mỗi xe chỉ đếm một lần) rồi cộng vào profile"""
+        if len(segment) == 0:
+            return
+        order = np.lexsort((start, segment))
+        segment, start, stop, classes = segment[order], start[order], stop[order], classes[order]
+        # Dịch mỗi đoạn track ra một dải riêng để running max không tràn sang track khác
+        shift = segment * (self.frame_height + 1)
+        reach = np.maximum.accumulate(stop + shift) - shift
+        opens = np.ones(len(segment), dtype=bool)
+        opens[1:] = (segment[1:] != segment[:-1]) | (start[1:] >= reach[:-1])
+        # Mỗi khoảng hợp: bắt đầu tại khoảng mở, kết thúc ở reach của phần tử cuối nhóm
+        group_end = np.append(np.flatnonzero(opens)[1:] - 1, len(segment) - 1)
+        merged_start = start[opens]
+        merged_stop = reach[group_end]
+        # Class của xe = class ở cặp đầu tiên của khoảng
+        merged_class = classes[opens]
+        for cls, profile in self.profiles.items():
+            selected = merged_class == cls
+            delta = np.zeros(self.frame_height + 1, dtype=np.int64)
+            np.add.at(delta, merged_start[selected], 1)
+            np.add.at(delta, merged_stop[selected], -1)
+            profile[name] += np.cumsum(delta[:-1])
+
+    def _paint(self, name, segment, start, stop, classes):
+        """
+        Track đổi class: với mỗi dòng y, xe được đếm theo class của cặp SỚM NHẤT chứa y
+        (như update_counts()). Trải các khoảng ra từng pixel rồi giữ cặp đầu tiên.
+        """
+        if len(segment) == 0:
+            return
+        lengths = stop - start
+        pair = np.repeat(np.arange(len(segment)), lengths)
+        # y của từng pixel = start của cặp + vị trí trong khoảng
+        first_pixel = np.cumsum(lengths) - lengths
+        y = start[pair] + np.arange(len(pair)) - np.repeat(first_pixel, lengths)
+        key = segment[pair] * self.frame_height + y
+        # Các cặp đã theo thứ tự thời gian: sắp ổn định theo key, phần tử đầu là cặp sớm nhất
+        order = np.argsort(key, kind='stable')
+        key, pair = key[order], pair[order]
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = key[1:] != key[:-1]
+        y = key[first] % self.frame_height
+        counted_class = classes[pair[first]]
+        for cls, profile in self.profiles.items():
+            np.add.at(profile[name], y[counted_class == cls], 1)
+
+    def line_y(self, line_position):
+        """Dòng pixel của đường đếm, giống cách tính trong update_counts()"""
+        return min(max(int(self.frame_height * line_position), 0), self.frame_height - 1)
+
+    def counts(self, line_position, class_names=None):
+        """
+        Số xe của cả video nếu đặt đường đếm tại line_position.
+
+        Returns:
+            dict: {'count_up', 'count_down', 'total', 'classes': {tên: {'up', 'down', 'total'}}}
+        """
+        y = self.line_y(line_position)
+        classes = {}
+        for cls, profile in self.profiles.items():
+            up, down = int(profile['up'][y]), int(profile['down'][y])
+            name = class_names.get(cls, str(cls)) if class_names else str(cls)
+            classes[name] = {'up': up, 'down': down, 'total': up + down}
+        count_up = sum(item['up'] for item in classes.values())
+        count_down = sum(item['down'] for item in classes.values())
+        return {'count_up': count_up, 'count_down': count_down,
+                'total': count_up + count_down, 'classes': classes}
+
+    def histogram(self, bins=50):
+        """
+        Tổng số xe (lên + xuống) theo vị trí đường đếm, gộp thành bins khoảng đều.
+
+        Returns:
+            tuple: (positions - tâm mỗi khoảng theo tỷ lệ 0.0-1.0, totals - giá trị lớn
+                nhất trong khoảng)
+        """
+        bins = max(1, min(bins, self.frame_height))
+        total = np.zeros(self.frame_height, dtype=np.int64)
+        for profile in self.profiles.values():
+            total += profile['up'] + profile['down']
+        edges = np.linspace(0, self.frame_height, bins + 1).astype(np.int64)
+        edges[-1] = self.frame_height
+        totals = np.maximum.reduceat(total, edges[:-1])
+        positions = (edges[:-1] + edges[1:]) / 2.0 / self.frame_height
+        return positions, totals
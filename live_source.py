@@ -0,0 +1,245 @@
+"""
+Nguồn trực tiếp (webcam/RTSP) độ trễ thấp.
+
+Nếu đọc frame ngay trong vòng lặp chạy inference, khi inference chậm hơn
+camera thì buffer nội bộ của OpenCV đầy dần và số đếm hiển thị trễ hàng
+giây so với thực tế. LatestFrameGrabber đọc liên tục ở luồng riêng và chỉ
+giữ frame mới nhất: frame chưa kịp lấy bị thay bằng frame mới (tính vào
+frames_dropped). Mất kết nối thì tự kết nối lại (chờ tăng dần).
+
+Thời điểm của frame lấy theo PTS của luồng, neo vào đồng hồ thật ở frame
+đầu tiên (và sau mỗi lần kết nối lại): khoảng cách giữa các frame theo
+nguồn chứ không theo lúc mạng giao tới. Nguồn không có PTS dùng time.time()
+lúc đọc được frame.
+
+Video file dùng để thử thay camera: đọc theo đúng FPS (realtime) và có thể
+lặp lại từ đầu (loop).
+"""
+import logging
+import threading
+import time
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Lệch quá số giây này so với đồng hồ thật thì neo lại PTS
+MAX_CLOCK_DRIFT = 2.0
+
+
+def is_live_source(source):
+    """Webcam (số) hoặc luồng mạng thì là nguồn trực tiếp"""
+    if isinstance(source, int):
+        return True
+    return str(source).split('://')[0].lower() in ('rtsp', 'rtmp', 'http', 'https', 'udp')
+
+
+def parse_source(source):
+    """Chuỗi số trên dòng lệnh là chỉ số webcam"""
+    return int(source) if isinstance(source, str) and source.isdigit() else source
+
+
+class LatestFrameGrabber:
+    def __init__(self, source, realtime=None, loop=False, reconnect_delay=0.5,
+                 max_reconnect_delay=8.0, timers=None):
+        """
+        Args:
+            source: Chỉ số webcam, URL RTSP/HTTP hoặc video file (giả lập camera)
+            realtime: Đọc theo đúng FPS của nguồn (None = tự bật với video file)
+            loop: Video file hết thì đọc lại từ đầu (False = kết thúc)
+            reconnect_delay, max_reconnect_delay: Thời gian chờ trước khi kết nối lại
+                (gấp đôi sau mỗi lần thất bại liên tiếp, tối đa max_reconnect_delay)
+            timers: StageTimers để đo bước 'decode' (None = không đo)
+        """
+        self.source = source
+        self.live = is_live_source(source)
+        self.realtime = (not self.live) if realtime is None else realtime
+        self.loop = loop
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.timers = timers
+
+        self.fps = 0.0  # FPS khai báo của nguồn (0 = không rõ)
+        self.connected = False
+        self.finished = False  # Video file đã hết (không loop) - read() không còn frame
+        self.error = None
+        self.frames_read = 0
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.reconnects = 0
+
+        self._condition = threading.Condition()
+        self._latest = None  # (frame, timestamp)
+        self._sequence = 0
+        self._taken = 0  # _sequence của frame read() trả về gần nhất
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._started = None
+        self._pts_origin = None
+        self._last_msec = 0.0
+        self._last_timestamp = 0.0
+
+    def start(self):
+        self._stop_event.clear()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='live-grabber', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, wait=True):
+        """
+        Dừng luồng đọc (an toàn khi gọi từ luồng khác).
+
+        Args:
+            wait: Chờ luồng đọc kết thúc (False = không chặn, vd. từ main thread của
+                giao diện khi cap.read() của RTSP còn đang chờ mạng)
+        """
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        if (wait and self._thread is not None and
+                self._thread is not threading.current_thread()):
+            self._thread.join(timeout=5)
+
+    def read(self, timeout=1.0):
+        """
+        Lấy frame mới nhất chưa được lấy, chờ tối đa timeout giây.
+
+        Returns:
+            tuple: (frame, timestamp), hoặc None nếu hết thời gian chờ/đã dừng/hết video
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: (self._sequence > self._taken or self.finished or
+                             self._stop_event.is_set()), timeout):
+                return None
+            if self._sequence == self._taken:
+                return None
+            self._taken = self._sequence
+            frame, timestamp = self._latest
+            self._latest = None  # Không giữ frame đã trả cho người gọi
+            self.frames_delivered += 1
+            return frame, timestamp
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            'source': str(self.source),
+            'connected': self.connected,
+            'frames_read': self.frames_read,
+            'frames_delivered': self.frames_delivered,
+            'frames_dropped': self.frames_dropped,
+            'drop_ratio': round(self.frames_dropped / self.frames_read, 4)
+            if self.frames_read else 0.0,
+            'capture_fps': round(self.frames_read / elapsed, 2) if elapsed > 0 else 0.0,
+            'reconnects': self.reconnects,
+            'error': str(self.error) if self.error else None,
+        }
+
+    def _timestamp(self, cap):
+        """PTS của frame vừa đọc neo vào đồng hồ thật (time.time() nếu nguồn không có PTS)"""
+        now = time.time()
+        msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+        if msec > 0:
+            timestamp = (self._pts_origin + msec / 1000.0
+                         if self._pts_origin is not None else None)
+            # Frame đầu / PTS quay lại (kết nối lại, file lặp) / lệch quá xa: neo lại
+            if (timestamp is None or msec < self._last_msec or
+                    abs(timestamp - now) > MAX_CLOCK_DRIFT):
+                self._pts_origin = now - msec / 1000.0
+                timestamp = now
+            self._last_msec = msec
+        else:
+            timestamp = now
+        # Bộ đếm cần thời gian không giảm
+        timestamp = max(timestamp, self._last_timestamp)
+        self._last_timestamp = timestamp
+        return timestamp
+
+    def _publish(self, frame, timestamp):
+        with self._condition:
+            if self._sequence > self._taken:
+                self.frames_dropped += 1
+            self._latest = (frame, timestamp)
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        if self.live:
+            # Buffer nội bộ nhỏ nhất có thể (không phải backend nào cũng hỗ trợ)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if not cap.isOpened():
+            cap.release()
+            raise IOError(f"Không thể mở nguồn: {self.source}")
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self._pts_origin = None
+        self._last_msec = 0.0
+        return cap
+
+    def _run(self):
+        delay = self.reconnect_delay
+        decode_timer = self.timers.stage('decode') if self.timers is not None else None
+        while not self._stop_event.is_set():
+            try:
+                cap = self._open()
+            except Exception as e:
+                self.error = e
+                logger.warning("%s - thử lại sau %.1fs", e, delay)
+                if self._stop_event.wait(delay):
+                    break
+                delay = min(delay * 2, self.max_reconnect_delay)
+                self.reconnects += 1
+                continue
+            self.connected, self.error = True, None
+            frames_before = self.frames_read
+            try:
+                ended = self._read_loop(cap, decode_timer)
+            except Exception as e:
+                self.error, ended = e, False
+                logger.warning("Lỗi khi đọc %s: %s", self.source, e)
+            finally:
+                cap.release()
+                self.connected = False
+            if ended:
+                break
+            if self.frames_read > frames_before:
+                # Kết nối vừa rồi đã có frame: lần mất kết nối mới, chờ lại từ đầu
+                delay = self.reconnect_delay
+            # Mất kết nối (hoặc nguồn nhận kết nối nhưng không gửi frame): chờ tăng dần
+            logger.warning("Mất kết nối %s, kết nối lại sau %.1fs", self.source, delay)
+            if self._stop_event.wait(delay):
+                break
+            delay = min(delay * 2, self.max_reconnect_delay)
+            self.reconnects += 1
+        with self._condition:
+            self.finished = True
+            self._condition.notify_all()
+
+    def _read_loop(self, cap, decode_timer):
+        """Đọc đến khi mất kết nối (False) hoặc video file kết thúc/bị dừng (True)"""
+        interval = 1.0 / self.fps if self.realtime and self.fps > 0 else 0.0
+        next_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            if decode_timer is not None:
+                with decode_timer:
+                    ret, frame = cap.read()
+            else:
+                ret, frame = cap.read()
+            if not ret:
+                if self.live:
+                    return False
+                if not self.loop or not cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                    return True
+                continue
+            self.frames_read += 1
+            self._publish(frame, self._timestamp(cap))
+            if interval:
+                # Giả lập camera: không đọc nhanh hơn FPS của file
+                next_time += interval
+                wait = next_time - time.perf_counter()
+                if wait > 0:
+                    self._stop_event.wait(wait)
+                else:
+                    next_time = time.perf_counter()
+        return True
@@ -1,12 +1,47 @@
+import time
+# Mốc bắt đầu để đo thời gian khởi động (trước các import nặng)
+_PROCESS_START = time.perf_counter()
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, simpledialog
 import cv2
 from PIL import Image, ImageTk
 import threading
-import queue
 import os
-import torch
-from vehicle_counter import VehicleCounter
+import logging
+# torch/ultralytics không được import ở đây: chúng được nạp ở thread warm-up
+from vehicle_counter import VehicleCounter, detect_device
+from pipeline import PreprocessPipeline
+from media_clock import MediaClock
+from quality_controller import AdaptiveQualityController
+from startup_timing import StartupTimer
+from motion_gate import MotionGate
+from roi import InferenceRegion
+from counting_zones import CountingLayout
+from detection_cache import cache_path_for, changed_settings, read_meta
+from line_tuning import LineTuner
+from live_source import LatestFrameGrabber, is_live_source, parse_source
+from playback import OverlayTimeline, MetadataPlayer, SPEEDS
+from chunked_processing import run_chunked
+from count_aggregation import CountAggregator
+from frame_display import FrameMailbox
+from stage_timing import StageTimers
+from video_input import input_scale, open_video, source_frame_size
+from video_output import OutputOptions
+
+# Lựa chọn khi xuất số đếm: độ dài khoảng (giây), None = danh sách từng xe
+EXPORT_CHOICES = {"Theo 1 phút": 60, "Theo 15 phút": 900, "Từng xe": None}
+# Video có overlay khi xử lý trước (None = chỉ ghi cache detection để phát lại)
+OUTPUT_CHOICES = {
+    "Không ghi (chỉ metadata)": None,
+    "Nhỏ: 960px, 1/2 frame": OutputOptions(size=960, every=2),
+    "Đầy đủ (ffmpeg nhanh)": OutputOptions(),
+}
+# Tên hiển thị của cài đặt detection khi cache detection không khớp
+SETTING_LABELS = {
+    'model_path': "model", 'backend': "backend", 'int8': "INT8",
+    'inference_size': "độ phân giải", 'vehicle_classes': "loại xe", 'roi': "ROI",
+    'motion_gate': "motion gate", 'line_position': "đường đếm (ROI)",
+}
 
 class VehicleCountingApp:
     def __init__(self, root):
@@ -19,9 +54,22 @@ class VehicleCountingApp:
         self.counter = None
         self.video_source = None
         self.cap = None
+        self.grabber = None  # LatestFrameGrabber khi đếm webcam/RTSP
         self.is_running = False
         self.current_frame = None
-        self.processed_video_path = None  # Đường dẫn video đã xử lý
+        # Cache detection của video (có thì phát lại từ metadata, không cần chạy model)
+        self.detection_cache_path = None
+        self.player = None  # MetadataPlayer khi đang phát lại từ cache
+        self.player_lock = threading.Lock()
+        self.playback_position = None
+        self._playback_key = None
+        self._seek_request = None
+        self._updating_timeline = False
+        self.quality_controller = None  # Bộ tự điều chỉnh chất lượng (nếu bật)
+        self.line_tuner = None  # Số đếm cả video theo vị trí đường đếm (từ cache detection)
+        # Độ trễ từng bước, dùng chung cho counter và phần hiển thị (xem stage_timing.py)
+        self.stage_timers = StageTimers()
+        self.timings_visible = False
         
         # Cấu hình hiệu năng
         # Ưu tiên tốc độ trên CPU: mặc định 320
@@ -30,6 +78,10 @@ class VehicleCountingApp:
         self.display_fps = 15  # FPS hiển thị (giảm để tăng tốc)
         # Chỉ chạy inference mỗi N frame để giảm tải CPU (CPU=2, GPU=1)
         self.inference_stride = 2
+        # Số frame mỗi lần gọi detector khi xử lý video trước (tracker chạy tách riêng)
+        self.detection_batch_size = 8
+        # Cạnh dài tối đa khi bật giải mã thu nhỏ (đủ cho inference 960 và khung hiển thị)
+        self.decode_size = 1280
         # Tối ưu hóa OpenCV trên CPU
         cv2.setUseOptimized(True)
         try:
@@ -37,11 +89,21 @@ class VehicleCountingApp:
         except Exception:
             pass
         
-        # Queue cho frame processing
-        self.frame_queue = queue.Queue(maxsize=2)
+        # Frame hiển thị: hộp thư một chỗ + PhotoImage dùng lại (xem frame_display.py)
+        self.display_mailbox = FrameMailbox()
+        self.video_photo = None
+        
+        # Model được nạp và làm nóng ở thread nền ngay sau khi cửa sổ hiện lên
+        self.startup_timer = StartupTimer(origin=_PROCESS_START)
+        self.model_ready = threading.Event()
+        self.model_error = None
         
         # Tạo giao diện
         self.create_widgets()
+        self.startup_timer.mark('window_ready')
+        self.size_var.trace_add('write', self._inference_size_changed)
+        # Chờ một nhịp để Tk vẽ cửa sổ trước khi bắt đầu nạp model
+        self.root.after(50, self.start_model_warmup)
         
     def create_widgets(self):
         """Tạo các widget cho giao diện"""
@@ -94,14 +156,23 @@ class VehicleCountingApp:
         style_button(btn_video)
         btn_video.pack(pady=10, anchor='center')
         
-        # # Nút sử dụng Webcam
-        # btn_webcam = tk.Button(control_frame, text="📷 Sử dụng Webcam", 
-        #                       command=self.use_webcam,
-        #                       bg='#2196F3', fg='white',
-        #                       font=('Arial', 12), 
-        #                       relief=tk.RAISED, bd=3,
-        #                       width=20, height=2)
-        # btn_webcam.pack(pady=10)
+        # Nút sử dụng Webcam
+        btn_webcam = tk.Button(control_frame, text="📷 Sử dụng Webcam", 
+                              command=self.use_webcam,
+                              bg='#2196F3', fg='white',
+                              font=('Arial', 12), 
+                              relief=tk.RAISED, bd=3)
+        style_button(btn_webcam)
+        btn_webcam.pack(pady=10, anchor='center')
+        
+        # Nút camera IP (RTSP/HTTP)
+        btn_stream = tk.Button(control_frame, text="🌐 Camera RTSP", 
+                              command=self.use_stream,
+                              bg='#2196F3', fg='white',
+                              font=('Arial', 12), 
+                              relief=tk.RAISED, bd=3)
+        style_button(btn_stream)
+        btn_stream.pack(pady=10, anchor='center')
         
         # Nút bắt đầu
         self.btn_start = tk.Button(control_frame, text="▶ Bắt đầu", 
@@ -132,6 +203,14 @@ class VehicleCountingApp:
         style_button(btn_reset)
         btn_reset.pack(pady=10, anchor='center')
         
+        # Xuất số đếm theo khoảng thời gian (hoặc danh sách sự kiện) ra CSV/Parquet
+        export_frame = tk.Frame(control_frame, bg='#3c3c3c')
+        export_frame.pack(pady=(0, 10))
+        self.export_bin_var = tk.StringVar(value=next(iter(EXPORT_CHOICES)))
+        tk.OptionMenu(export_frame, self.export_bin_var, *EXPORT_CHOICES).pack(side=tk.LEFT)
+        tk.Button(export_frame, text="📊 Xuất số đếm...", command=self.export_counts,
+                  bg='#607D8B', fg='white', font=('Arial', 9)).pack(side=tk.LEFT, padx=(5, 0))
+        
         # Nút xử lý video trước (preprocessing)
         self.btn_preprocess = tk.Button(control_frame, text="⚡ Xử lý video", 
                                         command=self.preprocess_video,
@@ -155,13 +234,33 @@ class VehicleCountingApp:
                 font=('Arial', 10)).pack()
         
         self.line_scale = tk.Scale(line_frame, from_=0.1, to=0.9, 
-                                   resolution=0.05, orient=tk.HORIZONTAL,
+                                   resolution=0.01, orient=tk.HORIZONTAL,
                                    bg='#3c3c3c', fg='white',
                                    troughcolor='#555555',
                                    command=self.update_line_position)
         self.line_scale.set(0.7)
         self.line_scale.pack(pady=5)
         
+        # Số xe cả video theo vị trí đường đếm (có khi video đã có cache detection):
+        # trục ngang = vị trí đường đếm, cột = tổng số xe; bấm vào biểu đồ để chọn vị trí
+        self.tuning_canvas = tk.Canvas(line_frame, width=260, height=60, bg='#2b2b2b',
+                                       highlightthickness=0)
+        self.tuning_canvas.pack()
+        self.tuning_canvas.bind('<Button-1>', self._tuning_canvas_clicked)
+        self.tuning_label = tk.Label(line_frame, text="Cả video: chưa có cache detection",
+                                     bg='#3c3c3c', fg='#B0BEC5', font=('Arial', 8),
+                                     justify=tk.LEFT)
+        self.tuning_label.pack()
+        
+        # Nhiều đường/vùng đếm từ file JSON (xem counting_zones.py)
+        self.layout = None
+        self.layout_label = tk.Label(line_frame, text="Đường/vùng bổ sung: không",
+                                     bg='#3c3c3c', fg='#B0BEC5', font=('Arial', 8))
+        self.layout_label.pack()
+        tk.Button(line_frame, text="Nạp đường/vùng đếm (JSON)...",
+                  command=self.select_layout, bg='#607D8B', fg='white',
+                  font=('Arial', 9)).pack(pady=(2, 0))
+        
         # Separator
         separator2 = tk.Frame(control_frame, height=2, bg='#555555')
         separator2.pack(fill=tk.X, padx=20, pady=10)
@@ -202,6 +301,61 @@ class VehicleCountingApp:
                           selectcolor='#555555', activebackground='#3c3c3c',
                           activeforeground='white', font=('Arial', 8)).pack(anchor=tk.W, padx=20, pady=2)
         
+        tk.Label(perf_frame, text="Backend inference:", 
+                bg='#3c3c3c', fg='white', 
+                font=('Arial', 9)).pack(pady=(10, 5))
+        
+        self.backend_var = tk.StringVar(value="pytorch")
+        backend_options = [("PyTorch (GPU nếu có)", "pytorch"),
+                           ("ONNX Runtime (CPU)", "onnx"),
+                           ("OpenVINO (CPU)", "openvino")]
+        for text, value in backend_options:
+            tk.Radiobutton(perf_frame, text=text, variable=self.backend_var, 
+                          value=value, bg='#3c3c3c', fg='white',
+                          selectcolor='#555555', activebackground='#3c3c3c',
+                          activeforeground='white', font=('Arial', 8)).pack(anchor=tk.W, padx=20, pady=2)
+        self.int8_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(perf_frame, text="INT8 (ONNX/OpenVINO)",
+                       variable=self.int8_var, bg='#3c3c3c', fg='white',
+                       selectcolor='#555555', activebackground='#3c3c3c',
+                       activeforeground='white', font=('Arial', 8)).pack(anchor=tk.W, padx=20, pady=2)
+        
+        # Tự động điều chỉnh độ phân giải/stride để giữ FPS của video
+        self.adaptive_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(perf_frame, text="Tự động giữ FPS (thích ứng)",
+                       variable=self.adaptive_var, bg='#3c3c3c', fg='white',
+                       selectcolor='#555555', activebackground='#3c3c3c',
+                       activeforeground='white', font=('Arial', 8)).pack(anchor=tk.W, padx=20, pady=(10, 2))
+        # Bỏ qua detector khi không có chuyển động quanh đường đếm (đường vắng ban đêm)
+        self.motion_gate_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(perf_frame, text="Bỏ qua frame tĩnh (motion gate)",
+                       variable=self.motion_gate_var, bg='#3c3c3c', fg='white',
+                       selectcolor='#555555', activebackground='#3c3c3c',
+                       activeforeground='white', font=('Arial', 8)).pack(anchor=tk.W, padx=20, pady=2)
+        # Chỉ detect trong dải quanh đường đếm (nhanh hơn, xe nhỏ rõ hơn)
+        self.roi_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(perf_frame, text="Chỉ detect quanh đường đếm (ROI)",
+                       variable=self.roi_var, bg='#3c3c3c', fg='white',
+                       selectcolor='#555555', activebackground='#3c3c3c',
+                       activeforeground='white', font=('Arial', 8)).pack(anchor=tk.W, padx=20, pady=2)
+        # Video 4K: ffmpeg giải mã thẳng ở kích thước nhỏ (giảm CPU decode)
+        self.small_decode_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(perf_frame, text="Giải mã thu nhỏ (video 4K, cần ffmpeg)",
+                       variable=self.small_decode_var, bg='#3c3c3c', fg='white',
+                       selectcolor='#555555', activebackground='#3c3c3c',
+                       activeforeground='white', font=('Arial', 8)).pack(anchor=tk.W, padx=20, pady=2)
+        # Video có overlay khi xử lý trước (mặc định không ghi, phát lại từ cache)
+        tk.Label(perf_frame, text="Video đầu ra khi xử lý trước:",
+                bg='#3c3c3c', fg='white',
+                font=('Arial', 9)).pack(pady=(10, 2))
+        self.output_video_var = tk.StringVar(value=next(iter(OUTPUT_CHOICES)))
+        tk.OptionMenu(perf_frame, self.output_video_var, *OUTPUT_CHOICES).pack(pady=(0, 5))
+        # Video dài: chia đoạn, mỗi đoạn một tiến trình (mỗi tiến trình nạp một model)
+        self.chunked_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(perf_frame, text="Xử lý song song theo đoạn (video dài)",
+                       variable=self.chunked_var, bg='#3c3c3c', fg='white',
+                       selectcolor='#555555', activebackground='#3c3c3c',
+                       activeforeground='white', font=('Arial', 8)).pack(anchor=tk.W, padx=20, pady=2)
         
         # Hiển thị thông tin
         info_frame = tk.Frame(control_frame, bg='#3c3c3c')
@@ -212,6 +366,28 @@ class VehicleCountingApp:
                                      font=('Arial', 10))
         self.status_label.pack()
         
+        self.model_status_label = tk.Label(info_frame, text="Model: chưa nạp",
+                                           bg='#3c3c3c', fg='#B0BEC5',
+                                           font=('Arial', 9))
+        self.model_status_label.pack(pady=(5, 0))
+        
+        # Độ trễ từng bước (thu gọn mặc định, chỉ cập nhật khi mở)
+        self.timings_button = tk.Button(info_frame, text="▸ Độ trễ từng bước",
+                                        command=self.toggle_timings, bg='#3c3c3c',
+                                        fg='#B0BEC5', font=('Arial', 9), relief=tk.FLAT,
+                                        activebackground='#3c3c3c', activeforeground='white')
+        self.timings_button.pack(pady=(10, 0))
+        self.timings_frame = tk.Frame(info_frame, bg='#3c3c3c')
+        self.timings_label = tk.Label(self.timings_frame, text="", bg='#2b2b2b', fg='white',
+                                      font=('Courier', 8), justify=tk.LEFT, anchor=tk.W)
+        self.timings_label.pack(fill=tk.X)
+        timings_buttons = tk.Frame(self.timings_frame, bg='#3c3c3c')
+        timings_buttons.pack(pady=(2, 0))
+        tk.Button(timings_buttons, text="💾 Lưu JSON...", command=self.save_timings,
+                  bg='#607D8B', fg='white', font=('Arial', 8)).pack(side=tk.LEFT)
+        tk.Button(timings_buttons, text="Xóa", command=self.stage_timers.reset,
+                  bg='#9E9E9E', fg='white', font=('Arial', 8)).pack(side=tk.LEFT, padx=(5, 0))
+        
         # Frame hiển thị video bên phải
         video_frame = tk.Frame(main_frame, bg='#1e1e1e')
         video_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -240,6 +416,21 @@ class VehicleCountingApp:
                                           font=('Arial', 10))
         self.class_stats_label.pack(expand=True, pady=(0, 5))
         
+        # Thanh tua và tốc độ khi phát lại từ cache detection
+        playback_frame = tk.Frame(video_frame, bg='#1e1e1e')
+        playback_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10)
+        self.speed_var = tk.StringVar(value="1x")
+        tk.OptionMenu(playback_frame, self.speed_var,
+                      *[f"{speed}x" for speed in SPEEDS]).pack(side=tk.RIGHT)
+        self.timeline_scale = tk.Scale(playback_frame, from_=0, to=1, orient=tk.HORIZONTAL,
+                                       showvalue=False, bg='#1e1e1e', fg='white',
+                                       troughcolor='#555555', highlightthickness=0,
+                                       command=self._timeline_moved, state=tk.DISABLED)
+        self.timeline_scale.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.position_label = tk.Label(playback_frame, text="--:--", bg='#1e1e1e',
+                                       fg='#B0BEC5', font=('Arial', 9))
+        self.position_label.pack(side=tk.RIGHT, padx=5)
+        
     def select_video(self):
         """Chọn file video"""
         file_path = filedialog.askopenfilename(
@@ -252,48 +443,245 @@ class VehicleCountingApp:
             self.status_label.config(text=f"Đã chọn: {file_path.split('/')[-1]}")
             self.btn_start.config(state=tk.NORMAL)
             self.btn_preprocess.config(state=tk.NORMAL)
-            self.processed_video_path = None  # Reset processed video
+            self._close_player()
+            self.detection_cache_path = cache_path_for(file_path)
+            self.load_line_tuner(self.detection_cache_path)
             
     def use_webcam(self):
         """Sử dụng webcam"""
-        self.video_source = 0  # 0 = default webcam
-        self.status_label.config(text="Đã chọn: Webcam")
+        self._select_live_source(0, "Webcam")  # 0 = default webcam
+        
+    def use_stream(self):
+        """Sử dụng camera IP (RTSP/HTTP) hoặc webcam theo chỉ số"""
+        url = simpledialog.askstring(
+            "Camera RTSP", "Địa chỉ luồng (rtsp://..., http://...) hoặc số thứ tự webcam:",
+            parent=self.root)
+        if not url or not url.strip():
+            return
+        source = parse_source(url.strip())
+        if not is_live_source(source):
+            messagebox.showerror("Lỗi", "Địa chỉ phải bắt đầu bằng rtsp://, rtmp://, http://, "
+                                        "https://, udp:// hoặc là số thứ tự webcam.")
+            return
+        self._select_live_source(source, str(source))
+        
+    def _select_live_source(self, source, name):
+        """Nguồn trực tiếp: không có cache detection, không xử lý trước"""
+        self.video_source = source
+        self.status_label.config(text=f"Đã chọn: {name}")
         self.btn_start.config(state=tk.NORMAL)
+        self.btn_preprocess.config(state=tk.DISABLED)
+        self._close_player()
+        self.detection_cache_path = None
+        self.line_tuner = None
+        self.tuning_canvas.delete('all')
+        self.tuning_label.config(text="Cả video: không dùng với nguồn trực tiếp")
+        
+    def start_model_warmup(self):
+        """Nạp và làm nóng model ở thread nền với cài đặt hiện tại trên giao diện"""
+        self.model_ready.clear()
+        self.model_error = None
+        self.model_status_label.config(text="Model: đang tải...", fg='#FF9800')
+        settings = {
+            'line_position': self.line_scale.get(),
+            'inference_size': int(self.size_var.get()),
+            'backend': self.backend_var.get(),
+            'int8': self.int8_var.get(),
+        }
+        threading.Thread(target=self._warmup_thread, args=(settings,), daemon=True).start()
+        
+    def _warmup_thread(self, settings):
+        """Thread nạp model: import torch/ultralytics, tạo VehicleCounter và chạy warm-up"""
+        timer = self.startup_timer
+        try:
+            with timer.measure('torch_import'):
+                device = detect_device()
+            with timer.measure('ultralytics_import'):
+                import ultralytics  # noqa: F401
+            with timer.measure('model_load'):
+                counter = VehicleCounter(
+                    model_path='models/train_100.pt',
+                    use_half_precision=(device == 'cuda'),
+                    inference_stride=1 if device == 'cuda' else 2,
+                    batch_size=self.detection_batch_size,
+                    **settings
+                )
+            with timer.measure('warmup'):
+                durations = counter.warmup()
+            timer.timings['first_inference'] = round(durations[0], 4)
+            timer.timings['warm_inference'] = round(durations[-1], 4)
+            timer.mark('model_ready')
+            try:
+                timer.record(device=counter.device, backend=counter.backend,
+                             inference_size=counter.inference_size)
+            except OSError as e:
+                logging.getLogger(__name__).warning("Không ghi được thời gian khởi động: %s", e)
+            self.root.after(0, self._on_model_ready, counter, None)
+        except Exception as e:
+            self.root.after(0, self._on_model_ready, None, e)
+        
+    def _on_model_ready(self, counter, error):
+        """Cập nhật trạng thái sẵn sàng (chạy trên thread của Tk)"""
+        if error is not None:
+            self.model_error = error
+            self.model_status_label.config(text="Model: lỗi khi tải", fg='#F44336')
+        else:
+            # Không thay counter nếu người dùng đã tự tạo trong lúc chờ
+            if self.counter is None:
+                self.counter = counter
+            self.model_status_label.config(
+                text=f"Model: sẵn sàng ({counter.device}, "
+                     f"{self.startup_timer.timings['model_ready']:.1f}s)",
+                fg='#4CAF50')
+        self.model_ready.set()
+        
+    def _inference_size_changed(self, *args):
+        """Làm nóng lại model ở kích thước inference mới (khi đang rảnh)"""
+        if self.is_running or not self.model_ready.is_set() or self.counter is None:
+            return
+        counter = self.counter
+        counter.inference_size = int(self.size_var.get())
+        self.model_ready.clear()
+        self.model_status_label.config(text="Model: đang làm nóng...", fg='#FF9800')
+        
+        def warmup():
+            try:
+                counter.warmup()
+            finally:
+                self.root.after(0, self._on_rewarm_done, counter)
+        threading.Thread(target=warmup, daemon=True).start()
+        
+    def _on_rewarm_done(self, counter):
+        self.model_status_label.config(
+            text=f"Model: sẵn sàng ({counter.device}, {counter.inference_size}px)", fg='#4CAF50')
+        self.model_ready.set()
+        
+    def select_layout(self):
+        """Chọn file JSON cấu hình nhiều đường/vùng đếm (bỏ chọn = chỉ dùng đường ngang)"""
+        file_path = filedialog.askopenfilename(
+            title="Chọn file đường/vùng đếm",
+            filetypes=[("JSON", "*.json"), ("All files", "*.*")]
+        )
+        try:
+            layout = CountingLayout.load(file_path) if file_path else None
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Lỗi", f"File đường/vùng đếm không hợp lệ!\n{str(e)}")
+            return
+        self.layout = layout
+        text = (f"Đường/vùng bổ sung: {len(layout.lines)} đường, {len(layout.zones)} vùng"
+                if layout else "Đường/vùng bổ sung: không")
+        self.layout_label.config(text=text)
+        if self.counter and not self.is_running:
+            self.counter.set_layout(layout)
         
     def update_line_position(self, value):
         """Cập nhật vị trí đường đếm"""
         if self.counter:
             self.counter.line_position = float(value)
+        self._show_tuning_counts(float(value))
+    
+    def load_line_tuner(self, cache_path):
+        """Dựng bảng số đếm theo vị trí đường đếm từ cache detection (thread nền)"""
+        self.line_tuner = None
+        self.tuning_canvas.delete('all')
+        if not os.path.isdir(cache_path):
+            self.tuning_label.config(text="Cả video: chưa có cache detection")
+            return
+        self.tuning_label.config(text="Cả video: đang đọc cache...")
+        options = ({'vehicle_classes': self.counter.vehicle_classes,
+                    'track_ttl': self.counter.track_ttl} if self.counter else {})
+        
+        def build():
+            try:
+                tuner = LineTuner(cache_path, **options)
+            except (OSError, ValueError, KeyError) as e:
+                logging.getLogger(__name__).warning("Không đọc được cache %s: %s",
+                                                    cache_path, e)
+                tuner = None
+            self.root.after(0, self._on_line_tuner_ready, tuner)
+        
+        threading.Thread(target=build, daemon=True).start()
+    
+    def _on_line_tuner_ready(self, tuner):
+        self.line_tuner = tuner
+        if tuner is None:
+            self.tuning_label.config(text="Cả video: cache detection không hợp lệ")
+            return
+        self._draw_tuning_histogram()
+        self._show_tuning_counts(self.line_scale.get())
+    
+    def _draw_tuning_histogram(self):
+        """Vẽ cột số xe theo vị trí đường đếm (một lần mỗi cache)"""
+        canvas = self.tuning_canvas
+        canvas.delete('all')
+        width, height = int(canvas['width']), int(canvas['height'])
+        positions, totals = self.line_tuner.histogram(bins=width // 4)
+        peak = max(int(totals.max()), 1) if len(totals) else 1
+        bar_width = width / max(len(totals), 1)
+        for i, total in enumerate(totals):
+            bar_height = (height - 4) * int(total) / peak
+            canvas.create_rectangle(i * bar_width, height - bar_height,
+                                    (i + 1) * bar_width - 1, height,
+                                    fill='#607D8B', outline='')
+        canvas.create_line(0, 0, 0, height, fill='#FFEB3B', width=2, tags='marker')
+    
+    def _show_tuning_counts(self, line_position):
+        """Số xe cả video nếu đặt đường đếm tại line_position (tra mảng, không chạy lại video)"""
+        if self.line_tuner is None:
+            return
+        x = line_position * int(self.tuning_canvas['width'])
+        self.tuning_canvas.coords('marker', x, 0, x, int(self.tuning_canvas['height']))
+        class_names = self.counter.class_names if self.counter else None
+        counts = self.line_tuner.counts(line_position, class_names)
+        classes = " | ".join(f"{name}: {item['total']}"
+                             for name, item in counts['classes'].items())
+        self.tuning_label.config(
+            text=(f"Cả video: {counts['total']} xe (lên {counts['count_up']}, "
+                  f"xuống {counts['count_down']})\n{classes}"))
+    
+    def _tuning_canvas_clicked(self, event):
+        """Bấm vào biểu đồ để đặt đường đếm tại vị trí đó"""
+        if self.line_tuner is not None:
+            self.line_scale.set(event.x / int(self.tuning_canvas['width']))
             
     def start_processing(self):
         """Bắt đầu xử lý video/webcam"""
         if self.video_source is None:
             messagebox.showerror("Lỗi", "Vui lòng chọn video hoặc webcam trước!")
             return
+        # Video đã có cache detection khớp cài đặt: phát lại từ metadata, không cần model
+        live = is_live_source(self.video_source)
+        if (not live and self.detection_cache_path and
+                os.path.isdir(self.detection_cache_path) and self._use_cache_playback()):
+            self.start_playback()
+            return
+        # Model đang được nạp/làm nóng ở nền: thử lại sau
+        if not self.model_ready.is_set():
+            self.status_label.config(text="Đang chờ model khởi động...", fg='#FF9800')
+            self.root.after(200, self.start_processing)
+            return
         
         # Lấy cài đặt hiệu năng
         self.inference_size = int(self.size_var.get())
         self.display_fps = int(self.fps_var.get())
         # Nếu không có GPU, tăng stride để giảm số lần suy luận
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        device = self.counter.device if self.counter else detect_device()
         self.inference_stride = 1 if device == 'cuda' else 2
         # Trên CPU, giảm tần suất hiển thị để tránh nghẽn Tk
         self.frame_skip_display_base = 30 if device == 'cuda' else 45
         
-        # Nếu có video đã xử lý, sử dụng nó
-        if self.processed_video_path and os.path.exists(self.processed_video_path):
-            self.video_source = self.processed_video_path
-            self.status_label.config(text="Đang phát video đã xử lý...", fg='#4CAF50')
-        
         # Khởi tạo vehicle counter nếu chưa có hoặc cần cập nhật cài đặt
-        if self.counter is None:
+        if self.counter is None or self._backend_changed():
             try:
                 self.counter = VehicleCounter(
                     model_path='models/train_100.pt',
                     line_position=self.line_scale.get(),
                     inference_size=self.inference_size,
                     use_half_precision=(device == 'cuda'),
-                    inference_stride=self.inference_stride
+                    inference_stride=self.inference_stride,
+                    batch_size=self.detection_batch_size,
+                    backend=self.backend_var.get(),
+                    int8=self.int8_var.get()
                 )
             except Exception as e:
                 messagebox.showerror("Lỗi", f"Không thể tải model!\n{str(e)}")
@@ -302,30 +690,233 @@ class VehicleCountingApp:
             # Cập nhật cài đặt hiệu năng
             self.counter.inference_size = self.inference_size
             self.counter.inference_stride = self.inference_stride
+        self._apply_detection_options()
+        
+        if live:
+            # Webcam/RTSP: luồng đọc riêng chỉ giữ frame mới nhất, tự kết nối lại
+            self.counter.input_scale = (1.0, 1.0)
+            self.grabber = LatestFrameGrabber(self.video_source,
+                                              timers=self.stage_timers).start()
+            self._start_process_thread(self.process_live)
+            return
         
-        # Mở video/webcam
+        # Mở video
         try:
-            self.cap = cv2.VideoCapture(self.video_source)
+            # Vòng xử lý dùng xong frame trước khi đọc frame tiếp: 2 buffer là đủ
+            self.cap = open_video(self.video_source, self._selected_decode_size(), pool_size=2)
             if not self.cap.isOpened():
                 raise Exception("Không thể mở video/webcam")
+            # Frame giải mã thu nhỏ: đếm theo tọa độ video gốc
+            self.counter.input_scale = input_scale(self.cap)
         except Exception as e:
             messagebox.showerror("Lỗi", f"Không thể mở video source!\n{str(e)}")
             return
         
+        self._start_process_thread(self.process_video)
+        
+    def _start_process_thread(self, target):
         self.is_running = True
         self.btn_start.config(state=tk.DISABLED)
         self.btn_stop.config(state=tk.NORMAL)
         self.status_label.config(text="Đang xử lý...", fg='#4CAF50')
         
         # Bắt đầu thread xử lý
-        self.process_thread = threading.Thread(target=self.process_video, daemon=True)
+        self.process_thread = threading.Thread(target=target, daemon=True)
         self.process_thread.start()
         
+    def _detection_settings(self):
+        """Cài đặt detection đang chọn trên giao diện (dạng VehicleCounter.detection_settings)"""
+        backend = self.backend_var.get()
+        settings = {
+            'model_path': 'models/train_100.pt',
+            'backend': backend,
+            'int8': self.int8_var.get() and backend != 'pytorch',
+            'inference_size': int(self.size_var.get()),
+            'roi': InferenceRegion().spec() if self.roi_var.get() else None,
+            'motion_gate': self.motion_gate_var.get(),
+            'line_position': self.line_scale.get(),
+        }
+        if self.counter is not None:
+            settings['vehicle_classes'] = [int(cls) for cls in self.counter.vehicle_classes]
+        return settings
+        
+    def _use_cache_playback(self):
+        """Cache khớp cài đặt hiện tại thì phát lại; khác thì hỏi phát lại hay xử lý lại"""
+        try:
+            meta = read_meta(self.detection_cache_path)
+        except Exception as e:
+            logging.getLogger(__name__).warning("Không đọc được cache %s: %s",
+                                                self.detection_cache_path, e)
+            return False
+        changed = changed_settings(meta, self._detection_settings())
+        if not changed:
+            return True
+        names = ', '.join(SETTING_LABELS.get(key, key) for key in changed)
+        return messagebox.askyesno(
+            "Cache detection",
+            f"Cache detection của video được tạo với cài đặt khác: {names}.\n\n"
+            "Có: phát lại từ cache (nhanh, theo cài đặt cũ)\n"
+            "Không: xử lý lại trực tiếp với cài đặt hiện tại")
+        
+    def start_playback(self):
+        """Phát lại video gốc, overlay vẽ từ cache detection (không chạy model)"""
+        self.display_fps = int(self.fps_var.get())
+        key = (self.video_source, self.line_scale.get(), id(self.layout))
+        if self.player is not None and self._playback_key == key:
+            self._resume_playback()
+            return
+        self._close_player()
+        self.btn_start.config(state=tk.DISABLED)
+        self.status_label.config(text="Đang dựng overlay từ cache...", fg='#FF9800')
+        options = {'line_position': self.line_scale.get(), 'layout': self.layout}
+        if self.counter:
+            options.update(vehicle_classes=self.counter.vehicle_classes,
+                           track_ttl=self.counter.track_ttl)
+        cache_path, video_path = self.detection_cache_path, self.video_source
+        
+        def build():
+            try:
+                timeline = OverlayTimeline(cache_path, **options)
+                player = MetadataPlayer(video_path, timeline)
+            except Exception as e:
+                self.root.after(0, lambda: messagebox.showerror(
+                    "Lỗi", f"Không thể phát lại từ cache!\n{str(e)}"))
+                self.root.after(0, lambda: self.btn_start.config(state=tk.NORMAL))
+                return
+            self.root.after(0, self._on_playback_ready, player, key)
+        
+        threading.Thread(target=build, daemon=True).start()
+    
+    def _on_playback_ready(self, player, key):
+        self.player = player
+        self._playback_key = key
+        self._updating_timeline = True
+        self.timeline_scale.config(state=tk.NORMAL, to=max(player.frame_count - 1, 1))
+        self.timeline_scale.set(0)
+        self._updating_timeline = False
+        self._resume_playback()
+    
+    def _resume_playback(self):
+        if self.player.position >= self.player.frame_count:
+            self._seek_request = 0  # Đã phát hết: phát lại từ đầu
+        self.is_running = True
+        self.btn_start.config(state=tk.DISABLED)
+        self.btn_stop.config(state=tk.NORMAL)
+        self.status_label.config(text="Đang phát lại từ cache...", fg='#4CAF50')
+        self.process_thread = threading.Thread(target=self._playback_loop, daemon=True)
+        self.process_thread.start()
+    
+    def _playback_loop(self):
+        """Thread phát lại: đọc frame gốc theo tốc độ đã chọn và vẽ overlay từ cache"""
+        player = self.player
+        player.max_display_fps = self.display_fps
+        last_time = time.time()
+        while self.is_running:
+            with self.player_lock:
+                seek, self._seek_request = self._seek_request, None
+                if seek is not None:
+                    player.seek(seek)
+                player.set_speed(int(self.speed_var.get().rstrip('x')))
+                result = player.next_frame()
+            if not self.is_running or self.player is not player:
+                break
+            if result is None:
+                self.is_running = False
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "Thông báo", "Video đã kết thúc!"))
+                break
+            index, frame = result
+            self._show_playback_frame(index, frame)
+            
+            # Giữ đúng tốc độ phát (mỗi lần hiển thị cách nhau frame_interval giây)
+            elapsed = time.time() - last_time
+            if elapsed < player.frame_interval:
+                time.sleep(player.frame_interval - elapsed)
+            last_time = time.time()
+        self.root.after(0, self._on_playback_stopped)
+    
+    def _show_playback_frame(self, index, frame):
+        """Hiển thị frame phát lại và đồng bộ thanh tua + thống kê với vị trí đang phát"""
+        self._display_frame(frame)
+        self.playback_position = index
+        self.root.after(0, self._sync_timeline, index)
+        self.root.after(0, self.update_stats)
+    
+    def _sync_timeline(self, index):
+        # Đặt vị trí thanh tua từ code: không coi là người dùng tua
+        self._updating_timeline = True
+        self.timeline_scale.set(index)
+        self._updating_timeline = False
+        seconds = int(index / self.player.fps) if self.player else 0
+        self.position_label.config(text=f"{seconds // 60:02d}:{seconds % 60:02d}")
+    
+    def _timeline_moved(self, value):
+        """Người dùng kéo thanh tua"""
+        if self._updating_timeline or self.player is None:
+            return
+        index = int(float(value))
+        if self.is_running:
+            self._seek_request = index
+            return
+        # Đang dừng: hiển thị ngay frame tại vị trí tua
+        with self.player_lock:
+            self.player.seek(index)
+            result = self.player.next_frame()
+        if result is not None:
+            self._show_playback_frame(*result)
+    
+    def _on_playback_stopped(self):
+        self.btn_start.config(state=tk.NORMAL)
+        self.btn_stop.config(state=tk.DISABLED)
+    
+    def _close_player(self):
+        """Dừng và giải phóng trình phát từ cache (khi đổi video hoặc tạo lại cache)"""
+        self.is_running = False
+        with self.player_lock:
+            if self.player is not None:
+                self.player.release()
+            self.player = None
+        self._playback_key = None
+        self.playback_position = None
+        self.timeline_scale.config(state=tk.DISABLED)
+        self.position_label.config(text="--:--")
+        
+    def _apply_detection_options(self):
+        """Bật/tắt motion gate, ROI và đường/vùng đếm bổ sung của counter theo giao diện"""
+        if self.counter.aggregator is None:
+            CountAggregator.for_counter(self.counter)
+        self.counter.timers = self.stage_timers
+        if self.counter.layout is not self.layout:
+            self.counter.set_layout(self.layout)
+        if self.roi_var.get() != (self.counter.roi is not None):
+            self.counter.roi = InferenceRegion() if self.roi_var.get() else None
+            # Tọa độ trong ByteTrack đổi theo vùng cắt: bắt đầu lại tracking
+            self.counter.reset_tracker()
+        if not self.motion_gate_var.get():
+            self.counter.motion_gate = None
+        elif self.counter.motion_gate is None:
+            self.counter.motion_gate = MotionGate()
+        else:
+            self.counter.motion_gate.reset()
+        
+    def _selected_decode_size(self):
+        """Cạnh dài tối đa khi giải mã (None = độ phân giải gốc)"""
+        return self.decode_size if self.small_decode_var.get() else None
+        
+    def _backend_changed(self):
+        """Backend/INT8 đã chọn khác với model đang nạp (cần tạo lại counter)"""
+        backend = self.backend_var.get()
+        int8 = self.int8_var.get() and backend != 'pytorch'
+        return (self.counter.backend, self.counter.int8) != (backend, int8)
+        
     def stop_processing(self):
         """Dừng xử lý"""
         self.is_running = False
         if self.cap:
             self.cap.release()
+        if self.grabber:
+            self.grabber.stop(wait=False)
+            self.grabber = None
         self.btn_start.config(state=tk.NORMAL)
         self.btn_stop.config(state=tk.DISABLED)
         self.status_label.config(text="Đã dừng", fg='#F44336')
@@ -337,126 +928,247 @@ class VehicleCountingApp:
             self.update_stats()
             messagebox.showinfo("Thông báo", "Đã reset bộ đếm!")
         
+    def export_counts(self):
+        """Xuất số đếm theo khoảng thời gian hoặc danh sách xe vượt đường ra CSV/Parquet"""
+        # Đang phát lại từ cache: số đếm của cả video nằm trong timeline
+        counter = self.player.timeline.counter if self.player is not None else self.counter
+        aggregator = counter.aggregator if counter is not None else None
+        if aggregator is None or aggregator.events.total == 0:
+            messagebox.showinfo("Thông báo", "Chưa có xe nào vượt đường đếm để xuất.")
+            return
+        bin_seconds = EXPORT_CHOICES[self.export_bin_var.get()]
+        name = 'events' if bin_seconds is None else f'{bin_seconds // 60}min'
+        path = filedialog.asksaveasfilename(
+            title="Xuất số đếm",
+            defaultextension=".csv",
+            initialfile=f"counts_{name}.csv",
+            filetypes=[("CSV", "*.csv"), ("Parquet", "*.parquet")])
+        if not path:
+            return
+        try:
+            aggregator.export(path, bin_seconds=bin_seconds, events=bin_seconds is None)
+        except Exception as e:
+            messagebox.showerror("Lỗi", f"Không thể xuất số đếm:\n{str(e)}")
+            return
+        self.status_label.config(text=f"Đã xuất: {os.path.basename(path)}", fg='#4CAF50')
+        
+    def toggle_timings(self):
+        """Mở/thu gọn bảng độ trễ từng bước"""
+        self.timings_visible = not self.timings_visible
+        if self.timings_visible:
+            self.timings_button.config(text="▾ Độ trễ từng bước")
+            self.timings_frame.pack(fill=tk.X, after=self.timings_button)
+            self.update_timings()
+        else:
+            self.timings_button.config(text="▸ Độ trễ từng bước")
+            self.timings_frame.pack_forget()
+        
+    def update_timings(self):
+        """Cập nhật bảng p50/p95/p99 (ms) mỗi giây khi đang mở"""
+        if not self.timings_visible:
+            return
+        table = self.stage_timers.format_table()
+        self.timings_label.config(text=table if '\n' in table else "Chưa có số đo")
+        self.root.after(1000, self.update_timings)
+        
+    def save_timings(self):
+        """Lưu độ trễ từng bước ra file JSON"""
+        path = filedialog.asksaveasfilename(
+            title="Lưu độ trễ từng bước",
+            defaultextension=".json",
+            initialfile="stage_timings.json",
+            filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        source = self.video_source if is_live_source(self.video_source) else (
+            os.path.basename(self.video_source) if self.video_source else None)
+        try:
+            self.stage_timers.dump(path, source=source)
+        except Exception as e:
+            messagebox.showerror("Lỗi", f"Không thể lưu file:\n{str(e)}")
+            return
+        self.status_label.config(text=f"Đã lưu: {os.path.basename(path)}", fg='#4CAF50')
+        
     def process_video(self):
         """Xử lý video trong thread riêng với tối ưu hóa hiệu năng"""
         import time
         
-        # Nếu là video đã xử lý, chỉ cần phát lại nhanh
-        is_processed = (self.processed_video_path and 
-                       os.path.exists(self.processed_video_path) and 
-                       self.video_source == self.processed_video_path)
+        # Xử lý real-time với tối ưu hóa
+        frame_time = 1.0 / self.display_fps  # Sử dụng display_fps thay vì target_fps
+        last_time = time.time()
+        frames_processed = 0
+        start_time = time.time()
+        frame_skip_display = max(1, int(self.frame_skip_display_base / self.display_fps))
+        # Thời điểm theo video (webcam/RTSP chạy ở process_live)
+        clock = MediaClock.for_capture(self.cap)
+        # Bộ điều khiển vòng kín giữ tốc độ xử lý bằng FPS của nguồn
+        self.quality_controller = None
+        if self.adaptive_var.get() and self.counter:
+            source_fps = self.cap.get(cv2.CAP_PROP_FPS)
+            self.quality_controller = AdaptiveQualityController(
+                target_fps=source_fps if source_fps > 0 else 25.0)
+            self.quality_controller.sync(self.counter)
+        # Kích thước (theo video gốc) cho các frame chỉ grab(), không giải mã ra ảnh
+        frame_width, frame_height = source_frame_size(self.cap)
+        decode_timer = self.stage_timers.stage('decode')
         
-        if is_processed:
-            # Video đã xử lý - chỉ phát lại, không cần inference
-            frame_time = 1.0 / self.display_fps
-            last_time = time.time()
-            frames_processed = 0
+        while self.is_running and self.cap.isOpened():
+            current_time = time.time()
+            
+            display = frames_processed % frame_skip_display == 0
+            with decode_timer:
+                if self.counter and not display and not self.counter.is_inference_frame():
+                    # Frame không chạy detector và không hiển thị: bộ đếm chỉ cần
+                    # vị trí dự đoán, bỏ qua chuyển màu/copy của retrieve()
+                    ret, frame = self.cap.grab(), None
+                else:
+                    ret, frame = self.cap.read()
+            
+            if not ret:  # Video đã hết
+                self.is_running = False
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "Thông báo", "Video đã kết thúc!"))
+                break
             
-            while self.is_running and self.cap.isOpened():
-                current_time = time.time()
+            # QUAN TRỌNG: Luôn xử lý mọi frame để đếm chính xác
+            # (counter tự chạy detector theo inference_stride, frame còn lại dùng vị trí dự đoán)
+            if self.counter:
+                timestamp = clock.timestamp(frames_processed, self.cap)
+                if frame is None:
+                    self.counter.step(frame_height, timestamp, frame_width=frame_width)
+                else:
+                    frame = self.counter.process_frame(frame, draw=display,
+                                                       timestamp=timestamp)
+                self.counter.line_position = self.line_scale.get()
+                
+                if self.quality_controller:
+                    # Độ trễ gồm đọc + xử lý frame (không tính thời gian chờ hiển thị)
+                    self._adapt_quality(time.time() - current_time)
+            
+            # Chỉ hiển thị mỗi N frame để tăng tốc
+            if display:
+                # Điều chỉnh tốc độ để đạt FPS hiển thị
                 elapsed = current_time - last_time
                 if elapsed < frame_time:
                     time.sleep(frame_time - elapsed)
                 
-                ret, frame = self.cap.read()
-                if not ret:
-                    self.is_running = False
-                    self.root.after(0, lambda: messagebox.showinfo(
-                        "Thông báo", "Video đã kết thúc!"))
-                    break
-                
-                # Chỉ hiển thị, không xử lý
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                max_w, max_h = self.get_display_limits(frame_rgb)
-                display_frame = self.resize_frame(frame_rgb, max_w, max_h)
-                image = Image.fromarray(display_frame)
-                photo = ImageTk.PhotoImage(image=image)
-                self.root.after(0, self.update_frame, photo)
-                
-                if frames_processed % 5 == 0:
-                    self.root.after(0, self.update_stats)
-                
-                frames_processed += 1
+                self._display_frame(frame)
                 last_time = time.time()
-        else:
-            # Video chưa xử lý - xử lý real-time với tối ưu hóa
-            frame_time = 1.0 / self.display_fps  # Sử dụng display_fps thay vì target_fps
-            last_time = time.time()
-            frames_processed = 0
-            start_time = time.time()
-            frame_skip_display = max(1, int(self.frame_skip_display_base / self.display_fps))
-            last_processed_frame = None  # Giữ frame đã suy luận để tái sử dụng khi skip inference
             
-            while self.is_running and self.cap.isOpened():
-                current_time = time.time()
-                
-                ret, frame = self.cap.read()
-                
-                if not ret:
-                    if self.video_source == 0:  # Webcam
-                        continue
-                    else:  # Video file đã hết
-                        self.is_running = False
-                        self.root.after(0, lambda: messagebox.showinfo(
-                            "Thông báo", "Video đã kết thúc!"))
-                        break
-                
-                # QUAN TRỌNG: Luôn xử lý mọi frame để đếm chính xác
-                if self.counter:
-                    # Chỉ chạy inference theo stride để giảm tải CPU
-                    if frames_processed % self.counter.inference_stride == 0 or last_processed_frame is None:
-                        frame = self.counter.process_frame(frame)
-                        last_processed_frame = frame
-                    else:
-                        # Tận dụng kết quả đã suy luận ở frame trước để hiển thị nhanh
-                        frame = last_processed_frame if last_processed_frame is not None else frame
-                    self.counter.line_position = self.line_scale.get()
-                
-                # Chỉ hiển thị mỗi N frame để tăng tốc
-                if frames_processed % frame_skip_display == 0:
-                    # Điều chỉnh tốc độ để đạt FPS hiển thị
-                    elapsed = current_time - last_time
-                    if elapsed < frame_time:
-                        time.sleep(frame_time - elapsed)
-                    
-                    # Chuyển đổi frame để hiển thị
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Resize frame để phù hợp với cửa sổ, ưu tiên chiều cao cho video dọc
-                    max_w, max_h = self.get_display_limits(frame_rgb)
-                    display_frame = self.resize_frame(frame_rgb, max_w, max_h)
-                    
-                    # Chuyển đổi sang ImageTk
-                    image = Image.fromarray(display_frame)
-                    photo = ImageTk.PhotoImage(image=image)
-                    
-                    # Cập nhật UI trong main thread
-                    self.root.after(0, self.update_frame, photo)
-                    last_time = time.time()
-                
-                # Cập nhật stats mỗi 5 frame để giảm overhead
-                if frames_processed % 5 == 0:
-                    self.root.after(0, self.update_stats)
-                
-                frames_processed += 1
-                
-                # Hiển thị FPS thực tế mỗi giây
-                if frames_processed % 30 == 0:
-                    elapsed_total = time.time() - start_time
-                    actual_fps = frames_processed / elapsed_total if elapsed_total > 0 else 0
-                    self.root.after(0, lambda f=actual_fps: self.status_label.config(
-                        text=f"Đang xử lý... ({f:.1f} FPS)", fg='#4CAF50'))
+            # Cập nhật stats mỗi 5 frame để giảm overhead
+            if frames_processed % 5 == 0:
+                self.root.after(0, self.update_stats)
+            
+            frames_processed += 1
+            
+            # Hiển thị FPS thực tế mỗi giây
+            if frames_processed % 30 == 0:
+                elapsed_total = time.time() - start_time
+                actual_fps = frames_processed / elapsed_total if elapsed_total > 0 else 0
+                text = f"Đang xử lý... ({actual_fps:.1f} FPS)"
+                gate_stats = self.counter.gate_stats() if self.counter else None
+                if gate_stats:
+                    text += f" | bỏ qua detect: {gate_stats['skip_ratio']:.0%}"
+                self.root.after(0, lambda t=text: self.status_label.config(
+                    text=t, fg='#4CAF50'))
         
         # Đóng video khi kết thúc
         if self.cap:
             self.cap.release()
         self.root.after(0, self.stop_processing)
     
+    def process_live(self):
+        """Đếm webcam/RTSP: luôn xử lý frame mới nhất (frame cũ bị bỏ khi xử lý chậm hơn nguồn)"""
+        grabber = self.grabber
+        display_interval = 1.0 / self.display_fps
+        last_display = 0.0
+        frames_processed = 0
+        start_time = time.time()
+        self.quality_controller = None
+        
+        while self.is_running:
+            item = grabber.read(timeout=1.0)
+            if item is None:
+                if grabber.finished:
+                    break
+                if not grabber.connected:
+                    self.root.after(0, lambda: self.status_label.config(
+                        text="Mất kết nối, đang kết nối lại...", fg='#FF9800'))
+                continue
+            frame, timestamp = item
+            current_time = time.time()
+            if self.quality_controller is None and self.adaptive_var.get():
+                # FPS của nguồn chỉ biết sau khi đã kết nối
+                self.quality_controller = AdaptiveQualityController(
+                    target_fps=grabber.fps if grabber.fps > 0 else 25.0)
+                self.quality_controller.sync(self.counter)
+            
+            # Không chờ theo FPS hiển thị: chỉ vẽ khi đến lượt hiển thị
+            display = current_time - last_display >= display_interval
+            frame = self.counter.process_frame(frame, draw=display, timestamp=timestamp)
+            self.counter.line_position = self.line_scale.get()
+            if self.quality_controller:
+                self._adapt_quality(time.time() - current_time)
+            if display:
+                self._display_frame(frame)
+                last_display = current_time
+            
+            if frames_processed % 5 == 0:
+                self.root.after(0, self.update_stats)
+            frames_processed += 1
+            
+            if frames_processed % 30 == 0:
+                elapsed_total = time.time() - start_time
+                actual_fps = frames_processed / elapsed_total if elapsed_total > 0 else 0
+                stats = grabber.stats()
+                text = (f"Trực tiếp: {actual_fps:.1f} FPS | bỏ frame cũ: "
+                        f"{stats['drop_ratio']:.0%}")
+                if stats['reconnects']:
+                    text += f" | kết nối lại: {stats['reconnects']}"
+                self.root.after(0, lambda t=text: self.status_label.config(
+                    text=t, fg='#4CAF50'))
+        
+        if self.is_running and grabber.error:
+            error = str(grabber.error)
+            self.root.after(0, lambda: messagebox.showerror(
+                "Lỗi", f"Mất kết nối nguồn trực tiếp:\n{error}"))
+        self.root.after(0, self.stop_processing)
+    
+    def _adapt_quality(self, latency):
+        """Cập nhật bộ tự điều chỉnh chất lượng với độ trễ xử lý một frame (giây)"""
+        adjustment = self.quality_controller.update(latency)
+        if adjustment:
+            self.quality_controller.apply(self.counter)
+            text = (f"Tự điều chỉnh: {adjustment['to']['inference_size']}px, "
+                    f"stride {adjustment['to']['inference_stride']} "
+                    f"({adjustment['avg_latency_ms']:.0f} ms/frame)")
+            self.root.after(0, lambda t=text: self.status_label.config(
+                text=t, fg='#FFD700'))
+    
+    def _display_frame(self, frame):
+        """Thu nhỏ + đổi màu frame (BGR) vào hộp thư hiển thị (luồng xử lý)"""
+        with self.stage_timers.stage('display'):
+            # Resize frame để phù hợp với cửa sổ, ưu tiên chiều cao cho video dọc
+            max_w, max_h = self.get_display_limits(frame)
+            schedule = self.display_mailbox.put(frame, max_w, max_h)
+        
+        # Main thread chưa lấy frame trước: frame này đã thay chỗ, không xếp thêm
+        if schedule:
+            self.root.after(0, self.update_frame)
+    
     def preprocess_video(self):
         """Xử lý video trước và lưu kết quả"""
-        if self.video_source is None or isinstance(self.video_source, int):
+        if self.video_source is None or is_live_source(self.video_source):
             messagebox.showerror("Lỗi", "Vui lòng chọn video file trước!")
             return
+        if not self.model_ready.is_set():
+            self.status_label.config(text="Đang chờ model khởi động...", fg='#FF9800')
+            self.root.after(200, self.preprocess_video)
+            return
+        
+        if self.chunked_var.get() and OUTPUT_CHOICES[self.output_video_var.get()]:
+            messagebox.showinfo("Thông báo", "Xử lý song song theo đoạn chỉ ghi cache detection, "
+                                             "không ghi video đầu ra.")
         
         # Hỏi người dùng có muốn xử lý không
         if not messagebox.askyesno("Xác nhận", 
@@ -468,21 +1180,27 @@ class VehicleCountingApp:
         self.inference_size = int(self.size_var.get())
         
         # Khởi tạo vehicle counter
-        if self.counter is None:
+        if self.counter is None or self._backend_changed():
             try:
                 self.counter = VehicleCounter(
                     model_path='models/train_100.pt',
                     line_position=self.line_scale.get(),
                     inference_size=self.inference_size,
-                    use_half_precision=True
+                    use_half_precision=True,
+                    batch_size=self.detection_batch_size,
+                    backend=self.backend_var.get(),
+                    int8=self.int8_var.get()
                 )
             except Exception as e:
                 messagebox.showerror("Lỗi", f"Không thể tải model!\n{str(e)}")
                 return
+        self._apply_detection_options()
         
         # Tạo đường dẫn file output
-        base_name = os.path.splitext(self.video_source)[0]
-        self.processed_video_path = f"{base_name}_processed.mp4"
+        # Chỉ ghi cache detection cạnh video (không ghi video đã vẽ): phát lại vẽ overlay
+        # từ cache, đếm lại/đổi đường đếm không cần chạy model
+        self.detection_cache_path = cache_path_for(self.video_source)
+        self._close_player()
         
         # Chạy preprocessing trong thread riêng
         self.btn_preprocess.config(state=tk.DISABLED)
@@ -491,45 +1209,75 @@ class VehicleCountingApp:
         thread = threading.Thread(target=self._preprocess_video_thread, daemon=True)
         thread.start()
     
+    def _chunked_counter_kwargs(self):
+        """Cài đặt counter hiện tại cho các tiến trình worker (mỗi worker tự nạp model)"""
+        return {
+            'model_path': 'models/train_100.pt',
+            'line_position': self.line_scale.get(),
+            'inference_size': self.inference_size,
+            'inference_stride': self.counter.inference_stride,
+            'use_half_precision': self.counter.use_half,
+            'batch_size': self.detection_batch_size,
+            'backend': self.backend_var.get(),
+            'int8': self.int8_var.get(),
+            'motion_gate': self.motion_gate_var.get(),
+            'roi': InferenceRegion() if self.roi_var.get() else None,
+            'layout': self.layout,
+        }
+    
+    def _preprocess_chunked(self):
+        """Xử lý video trước theo đoạn song song (mỗi đoạn một tiến trình)"""
+        def on_progress(frames, total):
+            text = f"Đang xử lý song song... {frames / total:.0%}" if total else ""
+            self.root.after(0, lambda t=text: self.status_label.config(text=t, fg='#FF9800'))
+        
+        summary = run_chunked(self.video_source, self._chunked_counter_kwargs(),
+                              cache_path=self.detection_cache_path,
+                              progress_callback=on_progress,
+                              decode_size=self._selected_decode_size())
+        self.root.after(0, lambda: self.status_label.config(
+            text=f"Đã xử lý xong! ({summary['frames']} frames, {summary['segments']} đoạn)",
+            fg='#4CAF50'))
+        self.root.after(0, lambda: messagebox.showinfo(
+            "Thành công",
+            f"Đã xử lý xong video ({summary['segments']} đoạn song song)!\n"
+            f"Tổng {summary['total']} xe (lên {summary['count_up']}, "
+            f"xuống {summary['count_down']})\n"
+            f"Cache detection: {self.detection_cache_path}\n"
+            f"Bấm 'Bắt đầu' để phát lại kèm kết quả (tua/tăng tốc được)."))
+        self.root.after(0, lambda: self.btn_preprocess.config(state=tk.NORMAL))
+        self.root.after(0, self.load_line_tuner, self.detection_cache_path)
+    
     def _preprocess_video_thread(self):
-        """Thread xử lý video trước"""
+        """Thread xử lý video trước (pipeline decode -> inference -> annotate -> encode)"""
         try:
-            cap = cv2.VideoCapture(self.video_source)
-            if not cap.isOpened():
-                raise Exception("Không thể mở video")
-            
-            # Lấy thông tin video
-            fps = int(cap.get(cv2.CAP_PROP_FPS))
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            
-            # Tạo video writer
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(self.processed_video_path, fourcc, fps, (width, height))
-            
-            frame_count = 0
+            if self.chunked_var.get():
+                self._preprocess_chunked()
+                return
+            output_options = OUTPUT_CHOICES[self.output_video_var.get()]
+            output_path = (os.path.splitext(self.video_source)[0] + '_processed.mp4'
+                           if output_options else None)
+            pipeline = PreprocessPipeline(self.counter, self.video_source,
+                                          output_path=output_path,
+                                          cache_path=self.detection_cache_path,
+                                          decode_size=self._selected_decode_size(),
+                                          output_options=output_options)
             
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                # Xử lý frame
-                processed_frame = self.counter.process_frame(frame)
-                out.write(processed_frame)
-                
-                frame_count += 1
-                
-                # Cập nhật progress
-                if frame_count % 30 == 0:
-                    progress = (frame_count / total_frames) * 100
-                    self.root.after(0, lambda p=progress: self.status_label.config(
-                        text=f"Đang xử lý... {p:.1f}%", fg='#FF9800'))
-                    self.root.after(0, self.update_stats)
+            # Cập nhật progress kèm độ sâu hàng đợi của từng giai đoạn
+            def on_progress(frame_count, stats):
+                total_frames = stats['total_frames']
+                progress = (frame_count / total_frames) * 100 if total_frames > 0 else 0
+                depth = stats['queue_depth']
+                text = (f"Đang xử lý... {progress:.1f}%\n"
+                        f"Hàng đợi D:{depth['decode']} A:{depth['annotate']} "
+                        f"E:{depth['encode']}")
+                if stats['motion_gate']:
+                    text += f" | bỏ qua detect: {stats['motion_gate']['skip_ratio']:.0%}"
+                self.root.after(0, lambda t=text: self.status_label.config(
+                    text=t, fg='#FF9800'))
+                self.root.after(0, self.update_stats)
             
-            cap.release()
-            out.release()
+            frame_count = pipeline.run(progress_callback=on_progress)
             
             # Hoàn thành
             self.root.after(0, lambda: self.status_label.config(
@@ -537,9 +1285,11 @@ class VehicleCountingApp:
             self.root.after(0, lambda: messagebox.showinfo(
                 "Thành công", 
                 f"Đã xử lý xong video!\n"
-                f"File đã lưu: {self.processed_video_path}\n"
-                f"Bấm 'Bắt đầu' để phát video đã xử lý."))
+                f"Cache detection: {self.detection_cache_path}\n"
+                + (f"Video có overlay: {output_path}\n" if output_path else "") +
+                f"Bấm 'Bắt đầu' để phát lại kèm kết quả (tua/tăng tốc được)."))
             self.root.after(0, lambda: self.btn_preprocess.config(state=tk.NORMAL))
+            self.root.after(0, self.load_line_tuner, self.detection_cache_path)
             
         except Exception as e:
             self.root.after(0, lambda: messagebox.showerror(
@@ -557,36 +1307,42 @@ class VehicleCountingApp:
         # Video ngang dùng kích thước mặc định
         return 960, 540
 
-    def resize_frame(self, frame, max_width, max_height):
-        """Resize frame để phù hợp với kích thước hiển thị"""
-        height, width = frame.shape[:2]
-        
-        # Tính tỷ lệ
-        width_ratio = max_width / width
-        height_ratio = max_height / height
-        ratio = min(width_ratio, height_ratio, 1.0)
-        
-        new_width = int(width * ratio)
-        new_height = int(height * ratio)
-        
-        return cv2.resize(frame, (new_width, new_height))
+    def update_frame(self):
+        """Hiển thị frame mới nhất trong hộp thư (main thread)"""
+        self.display_mailbox.consume(self._paste_frame)
         
-    def update_frame(self, photo):
-        """Cập nhật frame hiển thị"""
+    def _paste_frame(self, frame_rgb):
+        """Dán frame RGB vào PhotoImage đang hiển thị, chỉ tạo mới khi đổi kích thước"""
+        with self.stage_timers.stage('photo'):
+            image = Image.fromarray(frame_rgb)
+            photo = self.video_photo
+            if photo is not None and (photo.width(), photo.height()) == image.size:
+                photo.paste(image)
+                return
+            photo = self.video_photo = ImageTk.PhotoImage(image=image)
         self.video_label.config(image=photo)
         self.video_label.image = photo  # Giữ reference
         
     def update_stats(self):
         """Cập nhật thống kê"""
-        if self.counter:
-            total = self.counter.count_up + self.counter.count_down
+        if self.player is not None and self.playback_position is not None:
+            # Phát lại từ cache: số đếm tại vị trí đang phát
+            stats = self.player.timeline.stats(self.playback_position)
+            count_up, count_down = stats['count_up'], stats['count_down']
+            class_counts = stats['classes']
+        elif self.counter:
+            count_up, count_down = self.counter.count_up, self.counter.count_down
+            class_counts = self.counter.get_class_counts()
+        else:
+            class_counts = None
+        if class_counts is not None:
+            total = count_up + count_down
             stats_text = (f"Tổng số phương tiện: {total}  |  "
-                         f"Đi lên: {self.counter.count_up}  |  "
-                         f"Đi xuống: {self.counter.count_down}")
+                         f"Đi lên: {count_up}  |  "
+                         f"Đi xuống: {count_down}")
             self.stats_label.config(text=stats_text)
             
             # Cập nhật thống kê theo loại
-            class_counts = self.counter.get_class_counts()
             class_stats = []
             # Giữ thứ tự hiển thị cố định
             for name in ["Car", "Motorbike", "Bus", "Truck"]:
@@ -602,9 +1358,14 @@ class VehicleCountingApp:
         self.is_running = False
         if self.cap:
             self.cap.release()
+        if self.grabber:
+            self.grabber.stop(wait=False)
+        self._close_player()
         self.root.destroy()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s')
     root = tk.Tk()
     app = VehicleCountingApp(root)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
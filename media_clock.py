@@ -0,0 +1,49 @@
+"""
+Nguồn thời gian cho bộ đếm.
+
+Với video file, thời gian lấy theo vị trí trong video (CAP_PROP_POS_MSEC,
+hoặc frame_index / fps nếu backend không hỗ trợ), nên thời gian hết hạn
+track không phụ thuộc tốc độ xử lý: chạy nhanh hay chậm hơn thời gian
+thực đều cho cùng kết quả đếm. Chỉ nguồn trực tiếp (webcam/RTSP) mới dùng
+đồng hồ thật.
+"""
+import time
+
+import cv2
+
+# FPS giả định khi video không khai báo FPS
+DEFAULT_FPS = 30.0
+
+
+class MediaClock:
+    def __init__(self, fps=None, live=False, start_frame=0):
+        """
+        Args:
+            fps: FPS của video (None/0 = dùng DEFAULT_FPS)
+            live: Nguồn trực tiếp - dùng time.time()
+            start_frame: Frame bắt đầu nếu video được seek tới giữa chừng
+        """
+        self.fps = fps if fps and fps > 0 else DEFAULT_FPS
+        self.live = live
+        self.start_frame = start_frame
+
+    @classmethod
+    def for_capture(cls, cap, live=False, start_frame=0):
+        """Tạo clock từ thông tin của cv2.VideoCapture"""
+        return cls(cap.get(cv2.CAP_PROP_FPS), live=live, start_frame=start_frame)
+
+    def timestamp(self, frame_index, cap=None):
+        """
+        Thời điểm (giây) của frame vừa đọc.
+
+        Args:
+            frame_index: Số thứ tự frame tính từ lúc bắt đầu đọc
+            cap: VideoCapture vừa đọc frame (để lấy CAP_PROP_POS_MSEC nếu có)
+        """
+        if self.live:
+            return time.time()
+        if cap is not None:
+            msec = cap.get(cv2.CAP_PROP_POS_MSEC)
+            if msec > 0:
+                return msec / 1000.0
+        return (self.start_frame + frame_index) / self.fps
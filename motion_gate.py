@@ -0,0 +1,89 @@
+"""
+Bộ lọc chuyển động trước detector (motion gate).
+
+So sánh frame hiện tại với frame được kiểm tra trước đó trên một bản xám
+thu nhỏ của dải ảnh quanh đường đếm. Nếu tỷ lệ điểm ảnh thay đổi quá nhỏ
+(đường vắng, cảnh tĩnh) thì bỏ qua lần gọi YOLO: các track giữ nguyên vị
+trí, ByteTrack không được cập nhật nên ID được giữ nguyên khi có chuyển
+động trở lại. Định kỳ vẫn chạy detector để bắt các thay đổi rất chậm.
+"""
+import cv2
+
+
+class MotionGate:
+    def __init__(self, band=0.25, width=160, pixel_threshold=20,
+                 min_motion_ratio=0.003, refresh_interval=1.0):
+        """
+        Args:
+            band: Nửa chiều cao dải kiểm tra quanh đường đếm (tỷ lệ chiều cao frame)
+            width: Chiều rộng ảnh xám thu nhỏ dùng để so sánh
+            pixel_threshold: Chênh lệch độ sáng tối thiểu để tính là điểm ảnh thay đổi
+            min_motion_ratio: Tỷ lệ điểm ảnh thay đổi tối thiểu để coi là có chuyển động
+            refresh_interval: Luôn chạy detector nếu đã bỏ qua liên tục quá số giây này
+        """
+        self.band = band
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_motion_ratio = min_motion_ratio
+        self.refresh_interval = refresh_interval
+        self.reset()
+
+    def reset(self):
+        self.checked = 0  # Số frame đã kiểm tra (frame sẽ chạy detector)
+        self.skipped = 0  # Số frame bỏ qua detector
+        self.last_motion = 0.0  # Tỷ lệ điểm ảnh thay đổi ở lần kiểm tra gần nhất
+        self._previous = None
+        self._last_detect_time = None
+
+    @property
+    def skip_ratio(self):
+        """Tỷ lệ lần gọi detector được bỏ qua"""
+        return self.skipped / self.checked if self.checked else 0.0
+
+    def stats(self):
+        return {'checked': self.checked, 'skipped': self.skipped,
+                'skip_ratio': round(self.skip_ratio, 4)}
+
+    def _region(self, frame, line_position):
+        """Ảnh xám thu nhỏ, làm mờ của dải quanh đường đếm"""
+        height, frame_width = frame.shape[:2]
+        line_y = int(height * line_position)
+        half = max(1, int(height * self.band))
+        region = frame[max(0, line_y - half):min(height, line_y + half)]
+        scale = self.width / float(frame_width)
+        small = cv2.resize(region, (self.width, max(1, int(round(region.shape[0] * scale)))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def is_static(self, frame, line_position, timestamp):
+        """
+        Kiểm tra frame có thể bỏ qua detector không.
+
+        Args:
+            frame: Frame BGR gốc
+            line_position: Vị trí đường đếm (tỷ lệ chiều cao)
+            timestamp: Thời điểm của frame (giây)
+
+        Returns:
+            bool: True = không có chuyển động, bỏ qua detector
+        """
+        gray = self._region(frame, line_position)
+        previous, self._previous = self._previous, gray
+        self.checked += 1
+
+        if previous is None or previous.shape != gray.shape:
+            # Frame đầu tiên hoặc đường đếm vừa bị di chuyển
+            self._last_detect_time = timestamp
+            return False
+
+        diff = cv2.absdiff(gray, previous)
+        _, mask = cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)
+        self.last_motion = cv2.countNonZero(mask) / float(mask.size)
+        if (self.last_motion >= self.min_motion_ratio or
+                timestamp - self._last_detect_time >= self.refresh_interval):
+            self._last_detect_time = timestamp
+            return False
+
+        self.skipped += 1
+        return True
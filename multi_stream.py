@@ -0,0 +1,286 @@
+"""
+Đếm phương tiện trên nhiều camera cùng lúc với một model dùng chung.
+
+Mỗi luồng (stream) có luồng đọc frame, tracker ByteTrack và VehicleCounter
+riêng (bảng track, số đếm, motion gate, ROI...), nhưng chỉ có một model
+YOLO được nạp: mỗi vòng lặp lấy tối đa một frame của mỗi luồng và gộp tất
+cả frame cần detect thành một lần model.predict(). Bộ nhớ tăng theo số
+luồng chỉ ở phần trạng thái tracker và hàng đợi frame.
+
+Nguồn trực tiếp (webcam/RTSP) chỉ giữ các frame mới nhất, frame cũ bị bỏ
+khi xử lý không kịp và được tính vào số frame bị drop; video file được đọc
+đủ mọi frame (luồng đọc chờ khi hàng đợi đầy).
+"""
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from inference_backends import load_model
+from event_log import EventLogWriter
+from live_source import is_live_source
+from media_clock import MediaClock
+from stage_timing import StageTimers
+from vehicle_counter import VehicleCounter
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+
+class StreamState:
+    def __init__(self, name, source, counter, queue_size=4, live=None, latency_window=300):
+        """
+        Args:
+            name: Tên luồng (hiển thị trong thống kê)
+            source: Đường dẫn video, URL RTSP hoặc chỉ số webcam
+            counter: VehicleCounter riêng của luồng (dùng model chung)
+            queue_size: Số frame tối đa chờ inference
+            live: Nguồn trực tiếp (None = tự nhận diện theo source)
+        """
+        self.name = name
+        self.source = source
+        self.counter = counter
+        self.live = is_live_source(source) if live is None else live
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.finished = False  # Đã nhận hết frame (video kết thúc hoặc lỗi)
+        self.error = None
+
+        self.frames_read = 0
+        self.frames_processed = 0
+        self.frames_detected = 0
+        self.frames_dropped = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._started = None
+        self._thread = None
+
+    def start(self, stop_event):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._read_loop, args=(stop_event,),
+                                        name=f'stream-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _read_loop(self, stop_event):
+        """Đọc frame vào hàng đợi; nguồn trực tiếp bỏ frame cũ nhất khi đầy"""
+        cap = cv2.VideoCapture(self.source)
+        try:
+            if not cap.isOpened():
+                raise IOError(f"Không thể mở nguồn: {self.source}")
+            clock = MediaClock.for_capture(cap, live=self.live)
+            decode_timer = self.counter.timers.stage('decode')
+            index = 0
+            while not stop_event.is_set():
+                with decode_timer:
+                    ret, frame = cap.read()
+                if not ret:
+                    break
+                item = (index, frame, clock.timestamp(index, cap), time.perf_counter())
+                index += 1
+                self.frames_read += 1
+                if self.live:
+                    self._put_latest(item)
+                else:
+                    self._put_wait(item, stop_event)
+        except Exception as e:
+            self.error = e
+            logger.error("Luồng %s lỗi: %s", self.name, e)
+        finally:
+            cap.release()
+            # Video file: không được bỏ frame cuối còn trong hàng đợi
+            if self.live or not self._put_wait(_END, stop_event):
+                self._put_latest(_END, count_drop=False)
+
+    def _put_wait(self, item, stop_event):
+        """Chờ đến khi hàng đợi có chỗ; False nếu bị dừng trước khi đưa vào được"""
+        while not stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _put_latest(self, item, count_drop=True):
+        """Đưa item vào hàng đợi, bỏ frame cũ nhất nếu đầy (không bao giờ chờ)"""
+        while True:
+            try:
+                self.frames.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    if count_drop:
+                        self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+
+    def take(self):
+        """Lấy frame tiếp theo nếu có (không chờ), None nếu chưa có"""
+        if self.finished:
+            return None
+        try:
+            item = self.frames.get_nowait()
+        except queue.Empty:
+            return None
+        if item is _END:
+            self.finished = True
+            return None
+        return item
+
+    def record(self, captured_at, detected):
+        self.frames_processed += 1
+        self.frames_detected += int(detected)
+        self._latencies.append(time.perf_counter() - captured_at)
+
+    def stats(self):
+        """Thống kê của luồng: số frame, drop, độ trễ (từ lúc đọc đến khi đếm xong)"""
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        latencies = np.asarray(self._latencies, dtype=np.float64) * 1000.0
+        return {
+            'name': self.name,
+            'source': str(self.source),
+            'live': self.live,
+            'frames_read': self.frames_read,
+            'frames_processed': self.frames_processed,
+            'frames_detected': self.frames_detected,
+            'frames_dropped': self.frames_dropped,
+            'drop_ratio': round(self.frames_dropped / self.frames_read, 4)
+            if self.frames_read else 0.0,
+            'queue_depth': self.frames.qsize(),
+            'processing_fps': round(self.frames_processed / elapsed, 2) if elapsed > 0 else 0.0,
+            'latency_ms': {
+                'mean': round(float(latencies.mean()), 2) if len(latencies) else None,
+                'p95': round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None,
+                'max': round(float(latencies.max()), 2) if len(latencies) else None,
+            },
+            'count_up': self.counter.count_up,
+            'count_down': self.counter.count_down,
+            'classes': self.counter.get_class_counts(),
+            # Độ trễ từng bước của luồng (decode, resize, track, đếm), None nếu không bật
+            'stage_timings': (self.counter.timers.snapshot()['stages']
+                              if self.counter.timers.enabled else None),
+            'error': str(self.error) if self.error else None,
+        }
+
+
+class MultiStreamRunner:
+    def __init__(self, sources, model_path='models/train_100.pt', backend='pytorch',
+                 int8=False, inference_size=640, queue_size=4, names=None, event_log_dir=None,
+                 **counter_kwargs):
+        """
+        Args:
+            sources: Danh sách nguồn (đường dẫn video, URL RTSP, chỉ số webcam)
+            model_path, backend, int8, inference_size: Model dùng chung cho mọi luồng
+            queue_size: Hàng đợi frame của mỗi luồng
+            names: Tên từng luồng (mặc định cam0, cam1...)
+            event_log_dir: Ghi nhật ký sự kiện của từng luồng vào <event_log_dir>/<tên luồng>
+                (xem event_log.py), None = không ghi
+            counter_kwargs: Tham số khác cho VehicleCounter của từng luồng
+                (line_position, inference_stride, motion_gate, roi, layout...)
+        """
+        self.model, _ = load_model(model_path, backend=backend, imgsz=inference_size,
+                                   int8=int8 and backend != 'pytorch')
+        names = names or [f'cam{i}' for i in range(len(sources))]
+        self.streams = []
+        for name, source in zip(names, sources):
+            # Motion gate/layout có trạng thái riêng: mỗi luồng một bản sao
+            counter = VehicleCounter(model_path=model_path, inference_size=inference_size,
+                                     backend=backend, int8=int8, model=self.model,
+                                     **copy.deepcopy(counter_kwargs))
+            if event_log_dir:
+                counter.event_log = EventLogWriter(os.path.join(event_log_dir, name),
+                                                   line_names=counter.line_names(),
+                                                   class_names=counter.class_names)
+            self.streams.append(StreamState(name, source, counter, queue_size=queue_size))
+        # Độ trễ của lần predict() dùng chung cho mọi luồng
+        self.timers = StageTimers(enabled=bool(counter_kwargs.get('timings')))
+        self.batches = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Yêu cầu dừng (an toàn khi gọi từ luồng khác)"""
+        self._stop_event.set()
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'stage_timings': self.timers.snapshot()['stages'] if self.timers.enabled else None,
+            'streams': [stream.stats() for stream in self.streams],
+        }
+
+    def _process_round(self, items, on_frame):
+        """Một vòng: gộp các frame cần detect của mọi luồng vào một lần predict()"""
+        to_detect = []
+        for stream, (index, frame, timestamp, captured_at) in items:
+            counter = stream.counter
+            if (counter.is_inference_frame() and
+                    not counter.should_skip_detection(frame, timestamp)):
+                to_detect.append((stream, frame))
+        prepared = [stream.counter._prepare_inference_frame(frame) for stream, frame in to_detect]
+        detected = {}
+        if prepared:
+            # Các counter dùng chung cài đặt model nên lấy tham số của luồng đầu tiên
+            with self.timers.stage('inference'):
+                results = self.model.predict([item[0] for item in prepared],
+                                             **to_detect[0][0].counter._inference_kwargs())
+            for (stream, _), result, item in zip(to_detect, results, prepared):
+                detected[id(stream)] = stream.counter.track_result(result, item)
+            self.batches += 1
+
+        for stream, (index, frame, timestamp, captured_at) in items:
+            counter = stream.counter
+            detections = detected.get(id(stream))
+            # Frame đến lượt detect nhưng không có trong batch = bị motion gate bỏ qua
+            hold = detections is None and counter.is_inference_frame()
+            detections = counter.step(frame.shape[0], timestamp, detections, hold=hold,
+                                      frame_width=frame.shape[1])
+            stream.record(captured_at, id(stream) in detected)
+            if on_frame:
+                on_frame(stream, index, frame, detections)
+
+    def run(self, duration=None, on_frame=None, on_stats=None, stats_interval=5.0):
+        """
+        Chạy đến khi mọi luồng kết thúc, hết duration giây hoặc stop().
+
+        Args:
+            on_frame: Hàm nhận (stream, frame_index, frame, detections) sau mỗi frame
+                (ví dụ để vẽ/hiển thị; chạy trên luồng inference nên cần nhanh)
+            on_stats: Hàm nhận stats() mỗi stats_interval giây
+
+        Returns:
+            dict: stats() lúc kết thúc
+        """
+        self._stop_event.clear()
+        for stream in self.streams:
+            stream.start(self._stop_event)
+        started = last_stats = time.perf_counter()
+        try:
+            while not self._stop_event.is_set():
+                if duration is not None and time.perf_counter() - started >= duration:
+                    break
+                items = []
+                for stream in self.streams:
+                    item = stream.take()
+                    if item is not None:
+                        items.append((stream, item))
+                if items:
+                    self._process_round(items, on_frame)
+                elif all(stream.finished for stream in self.streams):
+                    break
+                else:
+                    time.sleep(0.002)
+                if on_stats and time.perf_counter() - last_stats >= stats_interval:
+                    last_stats = time.perf_counter()
+                    on_stats(self.stats())
+        finally:
+            self._stop_event.set()
+            for stream in self.streams:
+                if stream.counter.event_log is not None:
+                    stream.counter.event_log.close()
+        return self.stats()
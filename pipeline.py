@@ -0,0 +1,341 @@
+"""
+Pipeline xử lý trước video theo từng giai đoạn chạy song song:
+
+    decode (luồng riêng) -> inference (luồng gọi run) -> annotate (luồng riêng) -> encode (luồng riêng)
+
+Nếu counter có batch_size > 1, giai đoạn inference gom nhiều frame cho một
+lần gọi detector rồi cập nhật tracker và bộ đếm tuần tự theo thứ tự frame.
+Với inference_stride > 1 chỉ các frame cần thiết được đưa vào detector; các
+frame không chạy detector và không được ghi ra video chỉ được grab() (không
+chuyển màu, không copy) vì bộ đếm chỉ cần vị trí dự đoán. Video đầu ra có thể
+thu nhỏ, chỉ ghi mỗi N frame và mã hóa bằng ffmpeg (xem video_output.py). decode_size giải mã thẳng ở độ
+phân giải thấp bằng ffmpeg (xem video_input.py); số đếm và cache vẫn theo tọa
+độ video gốc, chỉ video đầu ra có kích thước đã thu nhỏ.
+
+Các giai đoạn nối với nhau bằng queue có giới hạn nên giai đoạn nhanh sẽ tự
+chờ giai đoạn chậm (back-pressure), bộ nhớ không tăng vô hạn. Mỗi giai đoạn
+chỉ có một luồng đọc queue theo FIFO nên thứ tự frame đầu ra luôn đúng.
+OpenCV và PyTorch nhả GIL khi decode/inference/encode nên các giai đoạn
+thực sự chạy chồng lên nhau trên CPU nhiều core.
+"""
+import queue
+import threading
+
+import cv2
+
+from detection_cache import DetectionCacheWriter
+from media_clock import MediaClock
+from video_input import input_scale, open_video, source_frame_size
+from video_output import OutputOptions, open_writer
+
+# Đánh dấu kết thúc luồng dữ liệu giữa các giai đoạn
+_END = object()
+
+
+class PipelineError(Exception):
+    """Lỗi xảy ra trong một giai đoạn của pipeline"""
+
+
+class PreprocessPipeline:
+    def __init__(self, counter, video_path, output_path=None, queue_size=8, cache_path=None,
+                 start_frame=0, end_frame=None, decode_size=None, output_options=None):
+        """
+        Args:
+            counter: VehicleCounter dùng cho giai đoạn inference
+            video_path: Video đầu vào
+            output_path: File video đầu ra có overlay (None = không ghi video)
+            queue_size: Số frame tối đa chờ giữa hai giai đoạn
+            cache_path: Thư mục lưu cache detection để đếm lại không cần model
+                (chỉ ghi khi xử lý hết video; None = không ghi)
+            start_frame, end_frame: Chỉ xử lý các frame [start_frame, end_frame) của video
+                (end_frame=None = đến hết video), dùng khi chia video thành nhiều đoạn
+            decode_size: Giải mã với cạnh dài tối đa này (None = độ phân giải gốc);
+                video đầu ra không lớn hơn kích thước đã thu nhỏ
+            output_options: OutputOptions của video đầu ra (kích thước, mỗi N frame,
+                encoder); None = mặc định (kích thước frame giải mã, mọi frame, ffmpeg)
+        """
+        self.counter = counter
+        self.video_path = video_path
+        self.output_path = output_path
+        self.cache_path = cache_path
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.decode_size = decode_size
+        self.output_options = output_options or OutputOptions()
+        self.output_size = None  # (width, height) của video đầu ra, xác định khi run()
+        # Queue decode phải chứa được ít nhất một batch
+        self.decode_queue = queue.Queue(
+            maxsize=max(queue_size, counter.batch_size * counter.inference_stride))
+        self.annotate_queue = queue.Queue(maxsize=queue_size)
+        self.encode_queue = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+        self._errors = []
+
+        # Số frame đã đi qua từng giai đoạn
+        self.frames_decoded = 0
+        self.frames_inferred = 0
+        self.frames_annotated = 0
+        self.frames_encoded = 0
+
+        self.frames_skipped = 0  # Frame chỉ grab(), không giải mã ra ảnh
+        self.fps = 0
+        self.width = 0  # Kích thước frame giải mã (= video đầu ra)
+        self.height = 0
+        self.source_width = 0  # Kích thước video gốc (tọa độ đếm)
+        self.source_height = 0
+        self.total_frames = 0
+
+    def stop(self):
+        """Yêu cầu dừng pipeline (an toàn khi gọi từ luồng khác)"""
+        self._stop_event.set()
+
+    def stats(self):
+        """Độ sâu hàng đợi và số frame đã xử lý của từng giai đoạn"""
+        return {
+            'queue_depth': {
+                'decode': self.decode_queue.qsize(),
+                'annotate': self.annotate_queue.qsize(),
+                'encode': self.encode_queue.qsize(),
+            },
+            'frames': {
+                'decoded': self.frames_decoded,
+                'inferred': self.frames_inferred,
+                'annotated': self.frames_annotated,
+                'encoded': self.frames_encoded,
+                'skipped': self.frames_skipped,
+            },
+            'total_frames': self.total_frames,
+            'motion_gate': self.counter.gate_stats(),
+        }
+
+    def _put(self, q, item):
+        """Đưa item vào queue, chờ khi queue đầy nhưng vẫn phản hồi lệnh dừng"""
+        while not self._stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """Lấy item từ queue, trả về _END nếu pipeline bị dừng"""
+        while not self._stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, stage, error):
+        self._errors.append(f"{stage}: {error}")
+        self._stop_event.set()
+
+    def _decode_loop(self, cap, skip_phase=0):
+        """
+        Args:
+            skip_phase: Frame thứ k (tính từ start_frame) chạy detector khi
+                (k - skip_phase) % inference_stride == 0; frame không chạy detector
+                và không được ghi ra video chỉ grab()
+        """
+        try:
+            # Thời gian theo vị trí trong video để kết quả không phụ thuộc tốc độ xử lý
+            clock = MediaClock.for_capture(cap)
+            decode_timer = self.counter.timers.stage('decode')
+            stride = self.counter.inference_stride
+            every = self.output_options.every if self.output_path else 0
+            index = self.start_frame
+            if index > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            while not self._stop_event.is_set():
+                if self.end_frame is not None and index >= self.end_frame:
+                    break
+                offset = index - self.start_frame
+                with decode_timer:
+                    if ((offset - skip_phase) % stride != 0 and
+                            not (every and offset % every == 0)):
+                        ret, frame = cap.grab(), None
+                        self.frames_skipped += 1
+                    else:
+                        ret, frame = cap.read()
+                if not ret:
+                    break
+                timestamp = clock.timestamp(index, cap)
+                if not self._put(self.decode_queue, (index, frame, timestamp)):
+                    break
+                index += 1
+                self.frames_decoded = index - self.start_frame
+        except Exception as e:
+            self._fail('decode', e)
+        finally:
+            cap.release()
+            self._put(self.decode_queue, _END)
+
+    def _annotate_loop(self):
+        try:
+            while True:
+                item = self._get(self.annotate_queue)
+                if item is _END:
+                    break
+                index, frame, detections, overlay = item
+                if self.output_size != (self.width, self.height):
+                    # Thu nhỏ trước rồi mới vẽ (rẻ hơn, chữ không bị nhỏ theo). draw_results
+                    # chia box cho input_scale (video gốc -> frame giải mã), nên chỉ cần
+                    # nhân thêm tỷ lệ frame giải mã -> video đầu ra
+                    frame = cv2.resize(frame, self.output_size, interpolation=cv2.INTER_AREA)
+                    detections = detections.scaled(self.output_size[0] / self.width,
+                                                   self.output_size[1] / self.height)
+                frame = self.counter.draw_results(frame, detections, overlay=overlay)
+                self.frames_annotated += 1
+                if not self._put(self.encode_queue, (index, frame)):
+                    break
+        except Exception as e:
+            self._fail('annotate', e)
+        finally:
+            self._put(self.encode_queue, _END)
+
+    def _encode_loop(self, writer):
+        try:
+            expected = self.start_frame
+            encode_timer = self.counter.timers.stage('encode')
+            while True:
+                item = self._get(self.encode_queue)
+                if item is _END:
+                    break
+                index, frame = item
+                if index != expected:
+                    raise PipelineError(f"Sai thứ tự frame: nhận {index}, cần {expected}")
+                with encode_timer:
+                    writer.write(frame)
+                expected += self.output_options.every
+                self.frames_encoded += 1
+        except Exception as e:
+            self._fail('encode', e)
+        finally:
+            writer.release()
+
+    def _infer_batch(self, batch, progress_callback, progress_interval, on_frame=None):
+        """
+        Inference cho các frame cần chạy detector trong batch (theo inference_stride),
+        rồi cập nhật đếm tuần tự theo thứ tự frame; frame bị bỏ qua dùng vị trí dự đoán
+        """
+        candidates = [k for k in range(len(batch)) if self.counter.is_inference_frame(k)]
+        # Motion gate kiểm tra tuần tự theo thứ tự frame; frame tĩnh giữ nguyên track
+        held = {k for k in candidates
+                if self.counter.should_skip_detection(batch[k][1], batch[k][2])}
+        to_detect = [k for k in candidates if k not in held]
+        frames = [batch[k][1] for k in to_detect]
+        if len(frames) > 1:
+            detected = self.counter.detect_batch(frames)
+        else:
+            detected = [self.counter.detect(frame) for frame in frames]
+        detected = dict(zip(to_detect, detected))
+        
+        for k, (index, frame, timestamp) in enumerate(batch):
+            # Frame chỉ grab() là None: bộ đếm chỉ cần kích thước (theo video gốc)
+            detections = self.counter.step(self.source_height, timestamp, detected.get(k),
+                                           hold=k in held, frame_width=self.source_width)
+            self.frames_inferred += 1
+            if on_frame is not None:
+                on_frame(index, detections)
+            if self.output_path and (index - self.start_frame) % self.output_options.every == 0:
+                # Chụp trạng thái đếm tại frame này để luồng annotate vẽ đúng
+                overlay = self.counter.overlay_state(detections)
+                if not self._put(self.annotate_queue, (index, frame, detections, overlay)):
+                    return False
+            if progress_callback and self.frames_inferred % progress_interval == 0:
+                progress_callback(self.frames_inferred, self.stats())
+        return True
+
+    def run(self, progress_callback=None, progress_interval=30, on_frame=None):
+        """
+        Chạy toàn bộ pipeline, chặn cho tới khi xong.
+        Giai đoạn inference chạy ngay trong luồng gọi hàm này.
+
+        Args:
+            progress_callback: Hàm nhận (frames_inferred, stats), gọi mỗi progress_interval frame
+            on_frame: Hàm nhận (frame_index, detections) sau khi đếm xong mỗi frame
+                (chạy trên luồng inference nên cần nhanh)
+
+        Returns:
+            int: Số frame đã xử lý
+        """
+        # Frame còn nằm trong queue/batch/các giai đoạn sau không được bị buffer mới ghi đè
+        in_flight = (self.decode_queue.maxsize + self.annotate_queue.maxsize +
+                     self.encode_queue.maxsize +
+                     self.counter.batch_size * self.counter.inference_stride + 4)
+        cap = open_video(self.video_path, self.decode_size, pool_size=in_flight)
+        if not cap.isOpened():
+            raise IOError(f"Không thể mở video: {self.video_path}")
+
+        # Lấy thông tin video
+        self.fps = int(cap.get(cv2.CAP_PROP_FPS))
+        self.width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.source_width, self.source_height = source_frame_size(cap)
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.end_frame is not None:
+            self.total_frames = min(self.total_frames, self.end_frame)
+        self.total_frames = max(self.total_frames - self.start_frame, 0)
+
+        recorder = None
+        if self.cache_path:
+            counter = self.counter
+            recorder = DetectionCacheWriter(
+                self.cache_path, video_path=self.video_path, fps=cap.get(cv2.CAP_PROP_FPS),
+                inference_stride=counter.inference_stride, **counter.detection_settings())
+            counter.recorder = recorder
+        # Frame giải mã thu nhỏ: box được đưa về tọa độ video gốc
+        self.counter.input_scale = input_scale(cap)
+
+        # Frame không chạy detector (và không ghi ra video) không cần ảnh, chỉ grab()
+        skip_phase = next(k for k in range(self.counter.inference_stride)
+                          if self.counter.is_inference_frame(k))
+        threads = [threading.Thread(target=self._decode_loop, args=(cap, skip_phase),
+                                    name='pipeline-decode', daemon=True)]
+        if self.output_path:
+            self.output_size = self.output_options.frame_size(self.width, self.height)
+            writer = open_writer(self.output_path, cap.get(cv2.CAP_PROP_FPS), self.output_size,
+                                 self.output_options)
+            threads.append(threading.Thread(target=self._annotate_loop,
+                                            name='pipeline-annotate', daemon=True))
+            threads.append(threading.Thread(target=self._encode_loop, args=(writer,),
+                                            name='pipeline-encode', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Gom đủ batch_size frame cần detect rồi mới gọi detector (batch_size=1: từng frame)
+            batch_size = self.counter.batch_size * self.counter.inference_stride
+            batch = []
+            finished = False
+            while not finished:
+                item = self._get(self.decode_queue)
+                if item is _END:
+                    finished = True
+                else:
+                    batch.append(item)
+                if batch and (finished or len(batch) >= batch_size):
+                    if not self._infer_batch(batch, progress_callback, progress_interval,
+                                             on_frame):
+                        break
+                    batch = []
+        except Exception as e:
+            self._fail('inference', e)
+        finally:
+            if self.output_path:
+                self._put(self.annotate_queue, _END)
+            for thread in threads:
+                thread.join()
+            if recorder is not None:
+                self.counter.recorder = None
+            self.counter.input_scale = (1.0, 1.0)
+
+        if recorder is not None and (self._errors or self._stop_event.is_set()):
+            # Lỗi/dừng giữa chừng: bỏ các cột đã ghi dở (cache cũ, nếu có, giữ nguyên)
+            recorder.discard()
+        if self._errors:
+            raise PipelineError("; ".join(self._errors))
+        if recorder is not None and not self._stop_event.is_set():
+            recorder.close()
+        return self.frames_inferred
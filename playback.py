@@ -0,0 +1,203 @@
+"""
+Phát lại kết quả đã xử lý từ cache detection thay vì video đã vẽ sẵn.
+
+Video gốc được giải mã lại và overlay (box, hướng, đường đếm, số đếm) được vẽ
+ngay khi hiển thị từ cache detection (detection_cache.py), nên không phải
+ghi thêm một video full-size cho mỗi đầu vào. OverlayTimeline đếm lại cache
+một lần (không chạy model) và lưu trạng thái vẽ của từng frame, nhờ đó có
+thể tua đến bất kỳ vị trí nào và số đếm hiển thị luôn đúng với vị trí đang
+phát.
+"""
+import copy
+import math
+
+import cv2
+import numpy as np
+
+from count_aggregation import CountAggregator
+from detection_cache import DetectionCache
+from track_table import DIRECTION_NAMES
+from vehicle_counter import Detections, VehicleCounter
+
+# Các tốc độ phát hỗ trợ
+SPEEDS = (1, 2, 4, 8)
+
+
+class OverlayTimeline:
+    def __init__(self, cache, line_position=0.7, layout=None, vehicle_classes=None,
+                 track_ttl=2.0, progress_callback=None):
+        """
+        Đếm lại cache và lưu trạng thái overlay của từng frame.
+
+        Args:
+            cache: DetectionCache hoặc đường dẫn thư mục cache
+            line_position, layout, vehicle_classes, track_ttl: Cài đặt đếm như VehicleCounter
+            progress_callback: Hàm nhận (frame_index, total_frames) trong lúc dựng
+        """
+        if not isinstance(cache, DetectionCache):
+            cache = DetectionCache(cache)
+        self.cache = cache
+        # Counter riêng (không nạp model) để trạng thái layout không lẫn với lúc chạy thật
+        self.counter = VehicleCounter(model_path=None, line_position=line_position,
+                                      track_ttl=track_ttl, layout=copy.deepcopy(layout))
+        if vehicle_classes is not None:
+            self.counter.vehicle_classes = list(vehicle_classes)
+        # Số đếm theo khoảng thời gian của cả video (để xuất CSV/Parquet)
+        CountAggregator.for_counter(self.counter)
+
+        frames = len(cache)
+        self.count_up = np.zeros(frames, dtype=np.int32)
+        self.count_down = np.zeros(frames, dtype=np.int32)
+        # class_counts[frame, class, 0/1] = số xe lên/xuống của class tính đến frame đó
+        self.class_counts = np.zeros((frames, len(self.counter.vehicle_classes), 2),
+                                     dtype=np.int32)
+        self._counts = np.zeros(frames, dtype=np.int64)
+        self._chunks = {'xyxy': [], 'ids': [], 'classes': [], 'confidences': [],
+                        'directions': []}
+        # Snapshot layout chỉ lưu khi số đếm đổi, mỗi frame giữ chỉ số snapshot
+        self._layout_index = np.zeros(frames, dtype=np.int32)
+        self._layout_snapshots = []
+
+        self.counter.replay(cache, progress_callback=progress_callback,
+                            on_frame=self._record)
+
+        self.frame_offsets = np.zeros(frames + 1, dtype=np.int64)
+        np.cumsum(self._counts, out=self.frame_offsets[1:])
+        for name, chunks in self._chunks.items():
+            setattr(self, name, np.concatenate(chunks) if chunks else
+                    np.zeros((0, 4) if name == 'xyxy' else 0))
+        del self._chunks, self._counts
+
+    def __len__(self):
+        return len(self.count_up)
+
+    def _record(self, index, detections):
+        """Lưu box đã dùng để đếm, hướng và số đếm sau frame index"""
+        counter = self.counter
+        self.count_up[index] = counter.count_up
+        self.count_down[index] = counter.count_down
+        for column, cls in enumerate(counter.vehicle_classes):
+            self.class_counts[index, column] = (counter.class_counts[cls]['up'],
+                                                counter.class_counts[cls]['down'])
+        count = len(detections)
+        self._counts[index] = count
+        if count:
+            rows = counter.tracks.lookup(detections.ids)
+            directions = np.where(rows >= 0, counter.tracks.direction[rows], 0)
+            self._chunks['xyxy'].append(detections.xyxy)
+            self._chunks['ids'].append(detections.ids)
+            self._chunks['classes'].append(detections.classes)
+            self._chunks['confidences'].append(detections.confidences)
+            self._chunks['directions'].append(directions.astype(np.int8))
+        if counter.layout is not None:
+            snapshot = counter.layout.snapshot()
+            if not self._layout_snapshots or self._layout_snapshots[-1][0] != snapshot[0]:
+                self._layout_snapshots.append(snapshot)
+            self._layout_index[index] = len(self._layout_snapshots) - 1
+
+    def _clamp(self, index):
+        return min(max(int(index), 0), len(self) - 1)
+
+    def frame_overlay(self, index):
+        """
+        Returns:
+            tuple: (Detections, overlay) để truyền cho VehicleCounter.draw_results()
+        """
+        index = self._clamp(index)
+        rows = slice(int(self.frame_offsets[index]), int(self.frame_offsets[index + 1]))
+        detections = Detections(self.xyxy[rows], self.ids[rows], self.classes[rows],
+                                self.confidences[rows])
+        overlay = {
+            'count_up': int(self.count_up[index]),
+            'count_down': int(self.count_down[index]),
+            'directions': [DIRECTION_NAMES[int(d)] for d in self.directions[rows]],
+            'layout': (self._layout_snapshots[self._layout_index[index]]
+                       if self._layout_snapshots else None),
+        }
+        return detections, overlay
+
+    def render(self, frame, index):
+        """Vẽ overlay của frame index lên frame gốc"""
+        detections, overlay = self.frame_overlay(index)
+        return self.counter.draw_results(frame, detections, overlay=overlay)
+
+    def stats(self, index):
+        """Số đếm tại vị trí index (cùng dạng với VehicleCounter.get_class_counts())"""
+        index = self._clamp(index)
+        classes = {}
+        for column, cls in enumerate(self.counter.vehicle_classes):
+            up, down = (int(v) for v in self.class_counts[index, column])
+            name = self.counter.class_names.get(cls, str(cls))
+            classes[name] = {'up': up, 'down': down, 'total': up + down}
+        count_up, count_down = int(self.count_up[index]), int(self.count_down[index])
+        return {'count_up': count_up, 'count_down': count_down,
+                'total': count_up + count_down, 'classes': classes}
+
+
+class MetadataPlayer:
+    def __init__(self, video_path, timeline, max_display_fps=30):
+        """
+        Args:
+            video_path: Video gốc (đã dùng để tạo cache)
+            timeline: OverlayTimeline của video
+            max_display_fps: Số frame hiển thị tối đa mỗi giây; tốc độ cao hơn thì bỏ
+                bớt frame (grab, không giải mã) để vẫn giữ đúng tốc độ phát
+        """
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise IOError(f"Không thể mở video: {video_path}")
+        self.timeline = timeline
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps > 0 else (timeline.cache.fps or 25.0)
+        total = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_count = min(total, len(timeline)) if total > 0 else len(timeline)
+        self.max_display_fps = max_display_fps
+        self.speed = 1
+        self.position = 0  # Chỉ số frame sẽ đọc tiếp theo
+        self._pending_skip = 0  # Số frame cần bỏ qua trước lần đọc tiếp theo
+
+    @property
+    def step(self):
+        """Số frame video tiến lên giữa hai lần hiển thị"""
+        return max(self.speed, math.ceil(self.speed * self.fps / self.max_display_fps))
+
+    @property
+    def frame_interval(self):
+        """Thời gian (giây) giữa hai lần hiển thị để phát đúng tốc độ"""
+        return self.step / (self.speed * self.fps)
+
+    def set_speed(self, speed):
+        if speed not in SPEEDS:
+            raise ValueError(f"Tốc độ không hỗ trợ: {speed} (chọn {SPEEDS})")
+        self.speed = speed
+
+    def seek(self, index):
+        """Tua đến frame index"""
+        index = min(max(int(index), 0), self.frame_count - 1)
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.position = index
+        self._pending_skip = 0
+
+    def next_frame(self):
+        """
+        Đọc và vẽ frame hiển thị tiếp theo theo tốc độ phát.
+
+        Returns:
+            tuple: (frame_index, frame đã vẽ overlay) hoặc None khi hết video
+        """
+        for _ in range(self._pending_skip):
+            if self.position >= self.frame_count - 1 or not self.cap.grab():
+                break
+            self.position += 1
+        if self.position >= self.frame_count:
+            return None
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        index = self.position
+        self.position += 1
+        self._pending_skip = self.step - 1
+        return index, self.timeline.render(frame, index)
+
+    def release(self):
+        self.cap.release()
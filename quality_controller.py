@@ -0,0 +1,135 @@
+"""
+Bộ điều khiển chất lượng thích ứng (vòng kín) để giữ FPS mục tiêu trên CPU.
+
+Đo độ trễ xử lý thực tế của từng frame, lấy trung bình trượt rồi di chuyển
+trên một "thang chất lượng" gồm các mức (inference_size, inference_stride)
+từ tốt nhất đến rẻ nhất. Có vùng trễ (hysteresis), thời gian chờ sau mỗi
+lần điều chỉnh, và nếu vừa tăng chất lượng đã phải hạ lại thì thời gian chờ
+trước lần tăng tiếp theo được nhân đôi để tránh dao động qua lại giữa hai mức.
+"""
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def build_quality_ladder(sizes=(960, 640, 320), max_stride=4):
+    """
+    Tạo thang chất lượng từ tốt nhất đến rẻ nhất: giảm kích thước inference trước,
+    đến kích thước nhỏ nhất thì mới tăng stride (stride có dự đoán vị trí nên
+    ít ảnh hưởng độ chính xác hơn việc thu nhỏ ảnh quá mức).
+    """
+    sizes = sorted(sizes, reverse=True)
+    ladder = [(size, 1) for size in sizes]
+    ladder += [(sizes[-1], stride) for stride in range(2, max_stride + 1)]
+    return ladder
+
+
+class AdaptiveQualityController:
+    def __init__(self, target_fps=25.0, ladder=None, window=30,
+                 upgrade_ratio=0.6, cooldown=60, max_upgrade_cooldown=3000):
+        """
+        Args:
+            target_fps: Số frame cần xử lý mỗi giây (ví dụ 25 cho camera 25 FPS)
+            ladder: Danh sách mức (inference_size, inference_stride), mặc định build_quality_ladder()
+                (với model có input cố định, sync() chỉ giữ các mức stride)
+            window: Số frame để tính độ trễ trung bình
+            upgrade_ratio: Chỉ tăng chất lượng khi độ trễ < upgrade_ratio * ngân sách (hysteresis)
+            cooldown: Số frame chờ sau mỗi lần điều chỉnh trước khi xét tiếp
+            max_upgrade_cooldown: Giới hạn thời gian chờ (frame) trước khi thử tăng chất lượng lại
+        """
+        self.target_fps = target_fps
+        self._default_ladder = ladder is None
+        self.ladder = ladder or build_quality_ladder()
+        self.window = window
+        self.upgrade_ratio = upgrade_ratio
+        self.cooldown = cooldown
+        self.max_upgrade_cooldown = max_upgrade_cooldown
+        self.level = 0
+        self.adjustments = []  # Nhật ký mọi lần điều chỉnh
+        self._latencies = deque(maxlen=window)
+        self._frames_since_change = 0
+        self._frame_count = 0
+        self._upgrade_cooldown = cooldown
+        self._just_upgraded = False  # Lần đánh giá đầu tiên sau khi tăng chất lượng
+
+    @property
+    def budget(self):
+        """Thời gian xử lý tối đa cho mỗi frame (giây)"""
+        return 1.0 / self.target_fps
+
+    @property
+    def settings(self):
+        """Mức hiện tại dưới dạng (inference_size, inference_stride)"""
+        return self.ladder[self.level]
+
+    def sync(self, counter):
+        """Chọn mức gần nhất với cài đặt hiện tại của counter làm điểm xuất phát"""
+        fixed = getattr(counter, 'fixed_input_size', None)
+        if self._default_ladder:
+            # Model đã xuất (ONNX/OpenVINO) luôn chạy ở kích thước lúc xuất: giảm
+            # inference_size không giảm chi phí mà chỉ mất độ chính xác
+            self.ladder = (build_quality_ladder(sizes=(fixed,)) if fixed
+                           else build_quality_ladder())
+        current = (counter.inference_size, counter.inference_stride)
+        self.level = min(range(len(self.ladder)),
+                         key=lambda i: (abs(self.ladder[i][0] - current[0]),
+                                        abs(self.ladder[i][1] - current[1])))
+        self._latencies.clear()
+        self._frames_since_change = 0
+        self._just_upgraded = False
+
+    def update(self, latency):
+        """
+        Ghi nhận độ trễ xử lý của một frame (giây).
+
+        Returns:
+            dict: Thông tin điều chỉnh nếu cần đổi mức, ngược lại None
+        """
+        self._frame_count += 1
+        self._frames_since_change += 1
+        self._latencies.append(latency)
+        if len(self._latencies) < self.window or self._frames_since_change < self.cooldown:
+            return None
+
+        average = sum(self._latencies) / len(self._latencies)
+        just_upgraded, self._just_upgraded = self._just_upgraded, False
+        if average > self.budget and self.level < len(self.ladder) - 1:
+            if just_upgraded:
+                # Mức tốt hơn không giữ được FPS: chờ lâu hơn trước khi thử lại
+                self._upgrade_cooldown = min(self._upgrade_cooldown * 2,
+                                             self.max_upgrade_cooldown)
+            return self._change(self.level + 1, average, 'quá chậm')
+        if just_upgraded:
+            # Mức mới ổn định
+            self._upgrade_cooldown = self.cooldown
+        if (average < self.budget * self.upgrade_ratio and self.level > 0 and
+                self._frames_since_change >= self._upgrade_cooldown):
+            self._just_upgraded = True
+            return self._change(self.level - 1, average, 'dư tài nguyên')
+        return None
+
+    def _change(self, level, average, reason):
+        old = self.ladder[self.level]
+        self.level = level
+        self._latencies.clear()
+        self._frames_since_change = 0
+        adjustment = {
+            'frame': self._frame_count,
+            'time': time.time(),
+            'from': {'inference_size': old[0], 'inference_stride': old[1]},
+            'to': {'inference_size': self.settings[0], 'inference_stride': self.settings[1]},
+            'avg_latency_ms': round(average * 1000.0, 2),
+            'budget_ms': round(self.budget * 1000.0, 2),
+            'reason': reason,
+        }
+        self.adjustments.append(adjustment)
+        logger.info("Điều chỉnh chất lượng (%s, %.1f ms/frame, ngân sách %.1f ms): "
+                    "size %d -> %d, stride %d -> %d", reason, average * 1000.0,
+                    self.budget * 1000.0, old[0], self.settings[0], old[1], self.settings[1])
+        return adjustment
+
+    def apply(self, counter):
+        """Áp dụng mức hiện tại cho VehicleCounter"""
+        counter.inference_size, counter.inference_stride = self.settings
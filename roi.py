@@ -0,0 +1,96 @@
+"""
+Vùng quan tâm (ROI) cho inference.
+
+Việc đếm chỉ phụ thuộc các box ở gần đường đếm, nên thay vì thu nhỏ cả
+frame rồi detect, chỉ cắt một dải ngang quanh đường đếm (hoặc hình bao của
+một polygon) và đưa riêng phần đó vào detector với toàn bộ inference_size.
+Box trả về được cộng lại offset của vùng cắt để về tọa độ frame gốc.
+"""
+import cv2
+import numpy as np
+
+
+class InferenceRegion:
+    def __init__(self, band=0.25, polygon=None, min_height=64):
+        """
+        Args:
+            band: Nửa chiều cao dải quanh đường đếm (tỷ lệ chiều cao frame), dải di
+                chuyển theo line_position
+            polygon: Danh sách đỉnh (x, y) theo tỷ lệ 0.0-1.0 của frame; nếu có thì
+                dùng polygon (phần ngoài polygon bị tô đen) thay cho dải
+            min_height: Chiều cao tối thiểu của dải (pixel)
+        """
+        self.band = band
+        self.polygon = None if polygon is None else np.asarray(polygon, dtype=np.float64)
+        self.min_height = min_height
+        self._mask_key = None
+        self._mask = None
+
+    def spec(self):
+        """Tham số của vùng dạng JSON (lưu trong meta của cache detection)"""
+        return {'band': self.band,
+                'polygon': None if self.polygon is None else self.polygon.tolist()}
+
+    @classmethod
+    def from_spec(cls, band=None, polygon=None):
+        """
+        Tạo từ tham số dòng lệnh: band là số thực, polygon dạng "x1,y1;x2,y2;...".
+
+        Returns:
+            InferenceRegion hoặc None nếu không có tham số nào
+        """
+        if polygon:
+            points = [tuple(float(v) for v in point.split(','))
+                      for point in polygon.split(';') if point.strip()]
+            if len(points) < 3 or any(len(point) != 2 for point in points):
+                raise ValueError(f"Polygon ROI không hợp lệ: {polygon}")
+            return cls(polygon=points)
+        if band:
+            return cls(band=band)
+        return None
+
+    def _polygon_pixels(self, frame_shape):
+        height, width = frame_shape[:2]
+        return np.round(self.polygon * [width - 1, height - 1]).astype(np.int32)
+
+    def bounds(self, frame_shape, line_position):
+        """Hình chữ nhật cắt (x1, y1, x2, y2) trên frame gốc"""
+        height, width = frame_shape[:2]
+        if self.polygon is not None:
+            points = self._polygon_pixels(frame_shape)
+            x1, y1 = points.min(axis=0)
+            x2, y2 = points.max(axis=0) + 1
+            return int(x1), int(y1), int(x2), int(y2)
+        line_y = int(height * line_position)
+        half = max(int(height * self.band), self.min_height // 2)
+        y1 = max(0, line_y - half)
+        y2 = min(height, line_y + half)
+        return 0, y1, width, y2
+
+    def crop(self, frame, line_position):
+        """
+        Cắt vùng inference từ frame.
+
+        Returns:
+            tuple: (ảnh vùng cắt, offset_x, offset_y) - offset để đưa box về frame gốc
+        """
+        x1, y1, x2, y2 = self.bounds(frame.shape, line_position)
+        region = frame[y1:y2, x1:x2]
+        if self.polygon is not None:
+            key = frame.shape[:2]
+            if self._mask_key != key:
+                # Mask chỉ phụ thuộc kích thước frame, tính một lần
+                mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+                cv2.fillPoly(mask, [self._polygon_pixels(frame.shape) - [x1, y1]], 255)
+                self._mask_key, self._mask = key, mask
+            region = cv2.bitwise_and(region, region, mask=self._mask)
+        return region, x1, y1
+
+    def draw(self, frame, line_position, color=(128, 128, 128)):
+        """Vẽ đường bao vùng inference lên frame"""
+        if self.polygon is not None:
+            cv2.polylines(frame, [self._polygon_pixels(frame.shape)], True, color, 1)
+        else:
+            x1, y1, x2, y2 = self.bounds(frame.shape, line_position)
+            cv2.rectangle(frame, (x1, y1), (x2 - 1, y2 - 1), color, 1)
+        return frame
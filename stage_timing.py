@@ -0,0 +1,223 @@
+"""
+Đo độ trễ từng bước trên đường xử lý nóng (decode, resize, inference, đếm,
+vẽ, chuyển ảnh hiển thị, ghi video).
+
+Mỗi bước có một histogram theo thang log (20 ô mỗi bậc 10, từ 1 µs đến
+100 s, sai số phân vị ~6%): ghi một số đo chỉ là một phép log10 và tăng một
+phần tử list, không cấp phát. Histogram được xoay vòng theo cửa sổ thời
+gian (giữ cửa sổ hiện tại và cửa sổ trước) nên p50/p95/p99 phản ánh
+khoảng window đến 2 x window giây gần nhất; window=None = tính trên cả lần
+chạy (xử lý file không giao diện).
+
+    timers = StageTimers()
+    with timers.stage('decode'):
+        ret, frame = cap.read()
+    timers.snapshot()   # {'stages': {'decode': {'p50_ms': ..., 'p95_ms': ..., ...}}}
+
+Mỗi tên bước dùng một đối tượng đo cố định (không tạo mới mỗi lần gọi), nên
+một bước chỉ được đo từ một luồng tại một thời điểm - trong pipeline mỗi
+bước vốn chạy trên một luồng riêng. Khi tắt (enabled=False), stage() trả về
+một context rỗng dùng chung.
+"""
+import json
+import math
+import os
+import time
+
+# Thứ tự hiển thị các bước đã biết (bước khác xếp sau)
+STAGES = ('decode', 'resize', 'inference', 'track', 'count', 'draw', 'display', 'photo',
+          'encode')
+
+_BUCKETS_PER_DECADE = 20
+_MIN_EXPONENT = -6   # 1 µs
+_MAX_EXPONENT = 2    # 100 s
+_BUCKETS = (_MAX_EXPONENT - _MIN_EXPONENT) * _BUCKETS_PER_DECADE + 2  # + ô tràn dưới/trên
+
+
+def _bucket(seconds):
+    if seconds <= 0:
+        return 0
+    index = int((math.log10(seconds) - _MIN_EXPONENT) * _BUCKETS_PER_DECADE) + 1
+    return min(max(index, 0), _BUCKETS - 1)
+
+
+def _bucket_value(index):
+    """Giá trị đại diện (trung điểm theo thang log) của ô, giây"""
+    exponent = (index - 0.5) / _BUCKETS_PER_DECADE + _MIN_EXPONENT
+    return 10 ** min(max(exponent, _MIN_EXPONENT), _MAX_EXPONENT)
+
+
+class LatencyHistogram:
+    def __init__(self, window=30.0):
+        """
+        Args:
+            window: Độ dài mỗi cửa sổ (giây); phân vị tính trên cửa sổ hiện tại và trước đó.
+                None = không xoay vòng, giữ mọi số đo
+        """
+        self.window = window
+        self.total = 0  # Tổng số lần đo từ lúc tạo
+        self._current = [0] * _BUCKETS
+        self._previous = [0] * _BUCKETS
+        self._sum = self._previous_sum = 0.0
+        self._max = self._previous_max = 0.0
+        self._window_start = time.monotonic()
+
+    def record(self, seconds, now=None):
+        if self.window is not None:
+            now = time.monotonic() if now is None else now
+            if now - self._window_start >= self.window:
+                self._rotate(now)
+        self._current[_bucket(seconds)] += 1
+        self._sum += seconds
+        if seconds > self._max:
+            self._max = seconds
+        self.total += 1
+
+    def _rotate(self, now):
+        # Quá hai cửa sổ không có số đo: cửa sổ trước cũng đã cũ
+        stale = now - self._window_start >= 2 * self.window
+        self._current, self._previous = self._previous, self._current
+        self._previous_sum, self._previous_max = self._sum, self._max
+        if stale:
+            self._previous[:] = [0] * _BUCKETS
+            self._previous_sum = self._previous_max = 0.0
+        self._current[:] = [0] * _BUCKETS
+        self._sum = self._max = 0.0
+        self._window_start = now
+
+    def reset(self):
+        self.__init__(self.window)
+
+    def merge(self, other):
+        """Cộng các số đo của histogram khác (vd. từ tiến trình worker) vào cửa sổ hiện tại"""
+        for source in (other._current, other._previous):
+            for index, count in enumerate(source):
+                self._current[index] += count
+        self._sum += other._sum + other._previous_sum
+        self._max = max(self._max, other._max, other._previous_max)
+        self.total += other.total
+
+    def summary(self):
+        """Số lần đo, trung bình, p50/p95/p99 và lớn nhất (ms) trong cửa sổ gần nhất"""
+        if self.window is not None and time.monotonic() - self._window_start >= self.window:
+            self._rotate(time.monotonic())
+        counts = [a + b for a, b in zip(self._current, self._previous)]
+        count = sum(counts)
+        result = {'count': count, 'total': self.total}
+        if count == 0:
+            return result
+        targets = {'p50_ms': 0.50, 'p95_ms': 0.95, 'p99_ms': 0.99}
+        cumulative = 0
+        pending = sorted(targets.items(), key=lambda item: item[1])
+        for index, bucket_count in enumerate(counts):
+            cumulative += bucket_count
+            while pending and cumulative >= pending[0][1] * count:
+                result[pending.pop(0)[0]] = round(_bucket_value(index) * 1000, 3)
+            if not pending:
+                break
+        maximum = max(self._max, self._previous_max)
+        result['mean_ms'] = round((self._sum + self._previous_sum) / count * 1000, 3)
+        result['max_ms'] = round(maximum * 1000, 3)
+        # Phân vị không vượt quá giá trị lớn nhất thật sự đã đo
+        for key in targets:
+            result[key] = min(result[key], result['max_ms'])
+        return result
+
+
+class _StageTimer:
+    """Context đo một bước: ghi thời gian giữa __enter__ và __exit__ vào histogram"""
+    __slots__ = ('histogram', '_start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.histogram.record(end - self._start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class StageTimers:
+    def __init__(self, enabled=True, window=30.0):
+        """
+        Args:
+            enabled: Bật đo (False = stage() không làm gì)
+            window: Cửa sổ thời gian của histogram (giây, None = cả lần chạy),
+                xem LatencyHistogram
+        """
+        self.enabled = enabled
+        self.window = window
+        self._timers = {}
+
+    def stage(self, name):
+        """Context manager đo thời gian của bước name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = _StageTimer(LatencyHistogram(self.window))
+        return timer
+
+    def record(self, name, seconds):
+        """Ghi một số đo đã có sẵn (giây)"""
+        if self.enabled:
+            self.stage(name).histogram.record(seconds)
+
+    def reset(self):
+        for timer in self._timers.values():
+            timer.histogram.reset()
+
+    def merge(self, other):
+        """Gộp số đo của một StageTimers khác (vd. của từng đoạn video xử lý song song)"""
+        if self.enabled:
+            for name, timer in other._timers.items():
+                self.stage(name).histogram.merge(timer.histogram)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {'window_s', 'stages': {tên bước: {'count', 'total', 'mean_ms',
+                'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'}}} theo thứ tự STAGES
+        """
+        order = {name: index for index, name in enumerate(STAGES)}
+        names = sorted(self._timers, key=lambda name: (order.get(name, len(STAGES)), name))
+        return {
+            'window_s': self.window,
+            'stages': {name: self._timers[name].histogram.summary() for name in names},
+        }
+
+    def format_table(self):
+        """Bảng chữ (font đơn cách) để hiển thị: bước, số lần đo, p50/p95/p99 ms"""
+        lines = [f"{'bước':<10}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}"]
+        for name, stats in self.snapshot()['stages'].items():
+            if stats['count'] == 0:
+                continue
+            lines.append(f"{name:<10}{stats['count']:>7}{stats['p50_ms']:>9.2f}"
+                         f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}")
+        return '\n'.join(lines)
+
+    def dump(self, path, **extra):
+        """Ghi snapshot() (kèm thông tin thêm) ra file JSON"""
+        data = dict(self.snapshot(), time=time.strftime('%Y-%m-%dT%H:%M:%S'), **extra)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        return path
@@ -0,0 +1,100 @@
+"""
+Đo thời gian khởi động (cold start) của ứng dụng.
+
+Mỗi lần khởi động ghi một dòng JSON vào logs/startup_timings.jsonl gồm các mốc
+(giây tính từ lúc tiến trình bắt đầu import) và thời lượng từng bước (import
+torch, nạp model, warm-up...). So sánh với trung vị các lần trước để phát
+hiện khởi động chậm đi (regression).
+"""
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_PATH = os.path.join('logs', 'startup_timings.jsonl')
+
+
+class StartupTimer:
+    def __init__(self, origin=None):
+        """
+        Args:
+            origin: Giá trị time.perf_counter() lúc bắt đầu (mặc định: bây giờ)
+        """
+        self.origin = time.perf_counter() if origin is None else origin
+        self.timings = {}
+
+    def mark(self, name):
+        """Ghi mốc thời gian (giây kể từ origin)"""
+        self.timings[name] = round(time.perf_counter() - self.origin, 4)
+        return self.timings[name]
+
+    @contextmanager
+    def measure(self, name):
+        """Đo thời lượng của một bước: with timer.measure('model_load'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(time.perf_counter() - start, 4)
+
+    def record(self, path=DEFAULT_LOG_PATH, **extra):
+        """
+        Ghi các số đo vào file log và cảnh báo nếu chậm hơn các lần trước.
+
+        Returns:
+            list: Các bước bị chậm, xem check_regression()
+        """
+        history = load_history(path)
+        entry = {'time': datetime.now().isoformat(timespec='seconds'),
+                 'timings': self.timings}
+        entry.update(extra)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+        regressions = check_regression(self.timings, history)
+        for name, value, median in regressions:
+            logger.warning("Khởi động chậm hơn bình thường: %s = %.2fs (trung vị %.2fs)",
+                           name, value, median)
+        return regressions
+
+
+def load_history(path=DEFAULT_LOG_PATH, limit=20):
+    """Đọc tối đa limit lần khởi động gần nhất (bỏ qua dòng lỗi)"""
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line)['timings'])
+            except (ValueError, KeyError):
+                continue
+    return entries[-limit:]
+
+
+def check_regression(timings, history, tolerance=1.5, min_samples=3, min_seconds=0.05):
+    """
+    So sánh số đo hiện tại với trung vị của các lần trước.
+
+    Args:
+        tolerance: Coi là chậm nếu vượt tolerance * trung vị
+        min_samples: Số lần đo trước tối thiểu để so sánh
+        min_seconds: Bỏ qua các bước quá ngắn (nhiễu đo)
+
+    Returns:
+        list: (tên, giá trị hiện tại, trung vị) của các bước bị chậm
+    """
+    regressions = []
+    for name, value in timings.items():
+        previous = sorted(entry[name] for entry in history if name in entry)
+        if len(previous) < min_samples:
+            continue
+        median = previous[len(previous) // 2]
+        if value > min_seconds and value > tolerance * median:
+            regressions.append((name, value, median))
+    return regressions
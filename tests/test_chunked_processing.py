@@ -0,0 +1,172 @@
+"""
+Ghép đoạn (chunked_processing) trên cảnh tổng hợp, không cần model: mỗi đoạn
+chạy VehicleCounter thật trên các frame [warmup_start, end) với ID riêng của
+đoạn (như tracker mới), kết quả ghép phải bằng số đếm khi chạy tuần tự.
+"""
+from collections import Counter
+
+import numpy as np
+
+from chunked_processing import (ID_STRIDE, MATCH_DISTANCE, MIN_MATCH_FRAMES, match_tracks,
+                                plan_segments, stitch_segments)
+from vehicle_counter import Detections, VehicleCounter
+
+FPS = 25.0
+TOTAL_FRAMES = 1500
+OVERLAP_FRAMES = 100
+WIDTH, HEIGHT = 1280, 720
+LINE_POSITION = 0.5
+LINE_Y = int(HEIGHT * LINE_POSITION)
+
+
+def _path(start, y0, speed, stop=None, stop_y=None):
+    """Tâm y theo frame: đi đều với speed px/frame, có thể dừng ở stop_y trong [stop)"""
+    path = {}
+    for frame in range(TOTAL_FRAMES):
+        if stop is None:
+            y = y0 + speed * (frame - start)
+        elif frame < stop[0]:
+            y = stop_y - speed * (stop[0] - frame)
+        elif frame < stop[1]:
+            y = stop_y
+        else:
+            y = stop_y + speed * (frame - stop[1])
+        if frame >= start and 0 <= y <= HEIGHT:
+            path[frame] = float(y)
+    return path
+
+
+def _scene(seams, seed=0):
+    """
+    Xe chạy qua đường đếm trên 12 làn (cả hai chiều, có xe vượt đường ngay ở chỗ
+    nối đoạn) và ở mỗi chỗ nối thêm các xe dừng trên làn riêng:
+    - dừng trong vùng ±10px của đường đếm sau khi đã được đếm, đi tiếp sau chỗ nối
+      (đoạn sau sẽ đếm lại - phải bị bỏ khi ghép);
+    - dừng trước đường đếm, vượt đường sau chỗ nối (chỉ đoạn sau đếm);
+    - vượt đường đúng ở frame cuối của đoạn trước / frame đầu của đoạn sau.
+
+    Returns:
+        tuple: (list (gt_id, class, center_x, {frame: center_y}), số xe bị đếm trùng)
+    """
+    rng = np.random.default_rng(seed)
+    vehicles = []
+    for i in range(TOTAL_FRAMES // 15):
+        speed = float(rng.uniform(5, 10)) * rng.choice([-1, 1])
+        y0 = 0.0 if speed > 0 else float(HEIGHT)
+        vehicles.append((int(rng.choice([2, 3, 5, 7])), 50.0 + 100 * (i % 12),
+                         _path(i * 15, y0, speed)))
+    duplicates = 0
+    for k, seam in enumerate(seams):
+        stop = (seam - OVERLAP_FRAMES - 30, seam + 20)
+        for lane, speed, stop_y in ((0, 4.0, LINE_Y - 5), (1, -4.0, LINE_Y + 5),
+                                    (2, 4.0, LINE_Y - 40), (3, -4.0, LINE_Y + 40)):
+            start = stop[0] - 100
+            vehicles.append((7, 100.0 + 200 * lane + 50 * (k % 2),
+                             _path(start, None, speed, stop, stop_y)))
+            duplicates += abs(stop_y - LINE_Y) < 10
+        # Được đếm ở frame cuối của đoạn trước / frame đầu của đoạn sau (vào vùng
+        # ±10px một frame trước khi tâm tới đường đếm)
+        for lane, cross in ((4, seam), (5, seam + 1)):
+            vehicles.append((2, 100.0 + 200 * lane + 50 * (k % 2),
+                             _path(cross - 60, LINE_Y - 6.0 * 60, 6.0)))
+    return [(gt_id + 1, *vehicle) for gt_id, vehicle in enumerate(vehicles)], duplicates
+
+
+def _detections(vehicles, frame, ids):
+    visible = [(ids[gt_id], cls, x, path[frame])
+               for gt_id, cls, x, path in vehicles if frame in path]
+    if not visible:
+        return Detections.empty()
+    track_ids, classes, center_x, center_y = (np.array(column) for column in zip(*visible))
+    xyxy = np.stack([center_x - 20, center_y - 15, center_x + 20, center_y + 15], axis=1)
+    return Detections(xyxy, track_ids.astype(int), classes.astype(int),
+                      np.full(len(visible), 0.9))
+
+
+def _run_segment(vehicles, index, warmup_start, start, end, ids):
+    """Như _process_segment, nhưng detection lấy từ cảnh tổng hợp"""
+    counter = VehicleCounter(model_path=None, line_position=LINE_POSITION)
+    counter.reset_tracker(start_frame=warmup_start)
+    events, positions = [], []
+    counter.crossing_listeners.append(events.append)
+    for frame in range(warmup_start, end):
+        detections = counter.step(HEIGHT, frame / FPS, _detections(vehicles, frame, ids),
+                                  frame_width=WIDTH)
+        if frame < start or frame >= end - OVERLAP_FRAMES:
+            xyxy = detections.xyxy
+            positions.append((frame, detections.ids.copy(), (xyxy[:, 0] + xyxy[:, 2]) / 2.0,
+                              (xyxy[:, 1] + xyxy[:, 3]) / 2.0))
+    return {
+        'index': index,
+        'warmup_start': warmup_start,
+        'start': start,
+        'end': end,
+        'events': events,
+        'positions': positions,
+        'class_names': [counter.class_names[cls] for cls in counter.vehicle_classes],
+    }
+
+
+def _tally(events):
+    return Counter((event['class_name'], event['direction']) for event in events)
+
+
+def test_plan_segments_overlap_and_cover_video():
+    plan = plan_segments(TOTAL_FRAMES, 4, OVERLAP_FRAMES)
+    assert [start for _, start, _ in plan] == [0, 375, 750, 1125]
+    assert plan[0][0] == 0 and plan[-1][2] == TOTAL_FRAMES
+    for (_, _, end), (warmup_start, start, _) in zip(plan, plan[1:]):
+        assert start == end and warmup_start == start - OVERLAP_FRAMES
+    # Video ngắn: mỗi đoạn dài ít nhất gấp đôi phần chồng lấn
+    assert len(plan_segments(350, 4, OVERLAP_FRAMES)) == 1
+    assert len(plan_segments(450, 4, OVERLAP_FRAMES)) == 2
+
+
+def test_match_tracks_needs_close_positions_on_enough_frames():
+    def positions(frames, track_id, x):
+        return [(frame, np.array([track_id]), np.array([x]), np.array([100.0 + frame]))
+                for frame in frames]
+
+    previous = (positions(range(10), 7, 300.0) + positions(range(10, 12), 8, 600.0) +
+                positions(range(12, 20), 9, 900.0))
+    current = (positions(range(10), 1, 300.0 + MATCH_DISTANCE - 1) +
+               positions(range(10, 12), 2, 600.0) +
+               positions(range(12, 20), 3, 900.0 + MATCH_DISTANCE + 1))
+    # ID 2 chỉ trùng 2 frame, ID 3 lệch quá MATCH_DISTANCE
+    assert MIN_MATCH_FRAMES > 2
+    assert match_tracks(previous, current) == {1: 7}
+
+
+def test_stitched_counts_match_sequential_run():
+    plan = plan_segments(TOTAL_FRAMES, 4, OVERLAP_FRAMES)
+    seams = [start for _, start, _ in plan[1:]]
+    vehicles, expected_duplicates = _scene(seams)
+    gt_ids = [gt_id for gt_id, *_ in vehicles]
+
+    sequential = _run_segment(vehicles, 0, 0, 0, TOTAL_FRAMES,
+                              {gt_id: gt_id for gt_id in gt_ids})['events']
+
+    rng = np.random.default_rng(1)
+    results, local_to_gt = [], []
+    for k, (warmup_start, start, end) in enumerate(plan):
+        # Tracker của mỗi đoạn đánh ID riêng: cùng dải số nhưng khác xe
+        local_ids = dict(zip(gt_ids, (int(i) for i in rng.permutation(len(gt_ids)) + 1)))
+        results.append(_run_segment(vehicles, k, warmup_start, start, end, local_ids))
+        local_to_gt.append({local: gt_id for gt_id, local in local_ids.items()})
+    summary, mappings = stitch_segments(results)
+
+    assert summary['count_up'] == sum(e['direction'] == 'up' for e in sequential)
+    assert summary['count_down'] == sum(e['direction'] == 'down' for e in sequential)
+    assert _tally(summary['events']) == _tally(sequential)
+    assert summary['duplicates_removed'] == expected_duplicates > 0
+    # Mỗi xe có đúng một ID toàn cục, mọi ID được nối đều trỏ đúng xe
+    stitched_ids = [event['track_id'] for event in summary['events']]
+    assert len(set(stitched_ids)) == len(stitched_ids) == len(sequential)
+    global_to_gt = dict(local_to_gt[0])
+    for k in range(1, len(results)):
+        for local, global_id in mappings[k].items():
+            assert global_to_gt[global_id] == local_to_gt[k][local]
+        global_to_gt.update({local + k * ID_STRIDE: gt_id
+                             for local, gt_id in local_to_gt[k].items()})
+        global_to_gt.update({global_id: local_to_gt[k][local]
+                             for local, global_id in mappings[k].items()})
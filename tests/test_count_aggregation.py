@@ -0,0 +1,36 @@
+import numpy as np
+
+from count_aggregation import CountAggregator
+
+
+def _record(aggregator, minute, direction=0):
+    aggregator.record(frame=0, timestamp=minute * 60.0 + 1.0,
+                      track_ids=np.array([minute]), classes=np.array([2]),
+                      directions=np.array([direction]))
+
+
+def test_bin_table_after_wraparound_does_not_show_expired_counts():
+    aggregator = CountAggregator(bin_seconds=(60,), history=3600)
+    for minute in (5, 62, 66):
+        _record(aggregator, minute)
+
+    table = aggregator.bin_table()
+    up = {int(start // 60): total for start, direction, total in
+          zip(table['bin_start'], table['direction'], table['total']) if direction == 'up'}
+
+    # Phút 5 đã hết hạn; phút 65 dùng chung ô với phút 5 nhưng không có xe
+    assert min(up) == 62
+    assert up[62] == 1 and up[66] == 1
+    assert all(up[minute] == 0 for minute in (63, 64, 65))
+
+
+def test_bin_table_keeps_counts_within_history():
+    aggregator = CountAggregator(bin_seconds=(60,), history=3600)
+    _record(aggregator, 0)
+    _record(aggregator, 0, direction=1)
+    _record(aggregator, 2)
+
+    table = aggregator.bin_table()
+    totals = list(zip(table['bin_start'], table['direction'], table['total']))
+    assert totals == [(0.0, 'up', 1), (0.0, 'down', 1), (60.0, 'up', 0), (60.0, 'down', 0),
+                      (120.0, 'up', 1), (120.0, 'down', 0)]
@@ -0,0 +1,100 @@
+"""
+Logic đếm vector hóa (TrackTable + update_counts) so với logic dict-of-dicts ban
+đầu trên các cảnh ngẫu nhiên: số đếm phải giống hệt sau từng frame.
+"""
+import numpy as np
+import pytest
+
+from vehicle_counter import Detections, VehicleCounter
+
+
+class DictCounter:
+    """Logic đếm ban đầu (mỗi track một dict), hết hạn track theo thời gian của frame"""
+
+    def __init__(self, line_position, vehicle_classes, track_ttl=2.0):
+        self.line_position = line_position
+        self.vehicle_classes = vehicle_classes
+        self.track_ttl = track_ttl
+        self.tracks = {}
+        self.last_update = {}
+        self.count_up = 0
+        self.count_down = 0
+        self.class_counts = {cls: {'up': 0, 'down': 0} for cls in vehicle_classes}
+
+    def update_counts(self, boxes, ids, classes, frame_height, current_time):
+        line_y = int(frame_height * self.line_position)
+        for box, track_id, cls in zip(boxes, ids, classes):
+            if cls not in self.vehicle_classes:
+                continue
+            x1, y1, x2, y2 = (float(v) for v in box)
+            center_y = (y1 + y2) / 2.0
+            if track_id not in self.tracks:
+                self.tracks[track_id] = {'crossed': False, 'direction': None,
+                                         'last_y': center_y}
+                self.last_update[track_id] = current_time
+                continue
+            track = self.tracks[track_id]
+            last_y, track['last_y'] = track['last_y'], center_y
+            self.last_update[track_id] = current_time
+            if track['direction'] is None and abs(center_y - last_y) > 1.0:
+                track['direction'] = 'down' if center_y > last_y else 'up'
+            if track['crossed'] or track['direction'] is None:
+                continue
+            if track['direction'] == 'down':
+                if last_y < line_y + 10 and center_y > line_y - 10:
+                    self.count_down += 1
+                    self.class_counts[cls]['down'] += 1
+                    track['crossed'] = True
+            elif last_y > line_y - 10 and center_y < line_y + 10:
+                self.count_up += 1
+                self.class_counts[cls]['up'] += 1
+                track['crossed'] = True
+        for track_id in [t for t, last in self.last_update.items()
+                         if current_time - last > self.track_ttl]:
+            del self.tracks[track_id]
+            del self.last_update[track_id]
+
+
+def random_scene(rng, frames=400, vehicles=60, frame_height=720):
+    """
+    Xe đi lên/xuống với tốc độ, nhiễu và đoạn mất detection ngẫu nhiên; có xe đứng
+    yên, class không được đếm, ID dùng lại sau khi track hết hạn và khoảng trống thời gian.
+    """
+    start = rng.integers(0, frames, vehicles)
+    y0 = rng.uniform(0, frame_height, vehicles)
+    speed = rng.choice([-1, 1], vehicles) * rng.uniform(0, 12, vehicles)
+    speed[rng.random(vehicles) < 0.1] = 0.0
+    jitter = rng.uniform(0, 4, vehicles)
+    classes = rng.choice([0, 2, 3, 5, 7], vehicles)
+    ids = rng.integers(1, vehicles // 2, vehicles)  # ID trùng giữa các xe khác thời điểm
+    timestamp = 0.0
+    for frame in range(frames):
+        timestamp += 3.0 if rng.random() < 0.01 else 1 / 25
+        active = (start <= frame) & (rng.random(vehicles) > 0.15)
+        center_y = y0 + speed * (frame - start) + rng.normal(0, 1, vehicles) * jitter
+        active &= (center_y > -50) & (center_y < frame_height + 50)
+        # Mỗi ID chỉ một box mỗi frame (như tracker)
+        _, first = np.unique(ids[active], return_index=True)
+        index = np.flatnonzero(active)[np.sort(first)]
+        rng.shuffle(index)
+        cy = center_y[index]
+        cx = rng.uniform(50, 1230, len(index))
+        boxes = np.stack([cx - 20, cy - 15, cx + 20, cy + 15], axis=1)
+        yield timestamp, boxes, ids[index], classes[index]
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_vectorized_counts_match_dict_logic(seed):
+    rng = np.random.default_rng(seed)
+    line_position = rng.uniform(0.3, 0.8)
+    counter = VehicleCounter(model_path=None, line_position=line_position)
+    reference = DictCounter(line_position, counter.vehicle_classes)
+    for timestamp, boxes, ids, classes in random_scene(rng):
+        detections = Detections(boxes, ids.astype(int), classes.astype(int),
+                                np.full(len(ids), 0.9))
+        counter.update_counts(detections, 720, timestamp=timestamp)
+        reference.update_counts(boxes, ids, classes, 720, timestamp)
+        assert (counter.count_up, counter.count_down) == \
+            (reference.count_up, reference.count_down)
+        assert counter.class_counts == reference.class_counts
+    assert reference.count_up + reference.count_down > 0
@@ -0,0 +1,62 @@
+import sys
+import threading
+
+import numpy as np
+
+from counting_zones import CountingLayout, CountingLine, CountingZone
+
+
+def _layout():
+    return CountingLayout([CountingLine('A', (0.1, 0.5), (0.9, 0.5)),
+                           CountingLine('B', (0.5, 0.1), (0.5, 0.9))],
+                          [CountingZone('Z', [(0.2, 0.2), (0.4, 0.2), (0.4, 0.4), (0.2, 0.4)])])
+
+
+def test_geometry_is_cached_per_frame_size():
+    layout = _layout()
+    source = layout._geometry(1280, 720)
+    small = layout._geometry(640, 360)
+    assert layout._geometry(1280, 720) is source
+    np.testing.assert_allclose(source.line_start, [[128, 360], [640, 72]])
+    np.testing.assert_allclose(small.line_start, [[64, 180], [320, 36]])
+    assert not source.line_start.flags.writeable
+
+
+def test_drawing_at_other_sizes_does_not_disturb_counting():
+    layout = _layout()
+    rng = np.random.default_rng(0)
+    previous = rng.uniform(0, [1280, 720], (500, 2))
+    current = previous + rng.normal(0, 80, (500, 2))
+    expected = [result.copy() for result in layout.crossings(previous, current, 1280, 720)]
+    expected_inside = layout.inside(current, 1280, 720)
+
+    # Luồng vẽ ở kích thước giải mã/đầu ra: tính hình học ở kích thước khác (như
+    # _render) và thỉnh thoảng vẽ thật lên frame
+    stop = threading.Event()
+    sizes = [(640, 360), (960, 540), (480, 270)]
+    frames = [np.zeros((height, width, 3), np.uint8) for width, height in sizes]
+
+    def draw():
+        i = 0
+        while not stop.is_set():
+            width, height = sizes[i % len(sizes)]
+            layout.inside(current, width, height)
+            if i % 50 == 0:
+                layout.draw(frames[i % len(frames)])
+            i += 1
+
+    # Đổi luồng thường xuyên để lộ ra việc đọc hình học đang bị tính lại dở dang
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    thread = threading.Thread(target=draw)
+    thread.start()
+    try:
+        for _ in range(5000):
+            crossed, forward = layout.crossings(previous, current, 1280, 720)
+            assert np.array_equal(crossed, expected[0])
+            assert np.array_equal(forward, expected[1])
+            assert np.array_equal(layout.inside(current, 1280, 720), expected_inside)
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(interval)
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+
+from detection_cache import (DetectionCache, DetectionCacheWriter, FLAG_DETECTED, FLAG_HELD,
+                             FLAG_PREDICTED, changed_settings, read_meta)
+from roi import InferenceRegion
+from vehicle_counter import Detections, VehicleCounter
+
+
+def _write_cache(path, counter):
+    writer = DetectionCacheWriter(path, video_path='video.mp4', fps=25.0,
+                                  inference_stride=counter.inference_stride,
+                                  **counter.detection_settings())
+    writer.append(0.0, flag=FLAG_PREDICTED, frame_height=720, frame_width=1280)
+    return writer.close()
+
+
+def test_cache_matches_same_settings_even_with_another_line(tmp_path):
+    counter = VehicleCounter(model_path=None, inference_size=640)
+    meta = read_meta(_write_cache(os.path.join(tmp_path, 'a.detections'), counter))
+    assert changed_settings(meta, counter.detection_settings()) == []
+
+    # Không dùng ROI: đường đếm mới được đếm lại từ cache
+    counter.line_position = 0.4
+    assert changed_settings(meta, counter.detection_settings()) == []
+
+
+def test_cache_reports_changed_detection_settings(tmp_path):
+    counter = VehicleCounter(model_path=None, inference_size=640, roi=InferenceRegion())
+    meta = read_meta(_write_cache(os.path.join(tmp_path, 'a.detections'), counter))
+
+    counter.inference_size = 320
+    counter.vehicle_classes = [2, 7]
+    counter.line_position = 0.4  # ROI đi theo đường đếm
+    assert changed_settings(meta, counter.detection_settings()) == [
+        'inference_size', 'vehicle_classes', 'line_position']
+
+    counter.roi = None
+    assert 'roi' in changed_settings(meta, counter.detection_settings())
+
+
+def test_old_cache_without_settings_does_not_match():
+    meta = {'model_path': None, 'backend': 'pytorch', 'inference_size': 640}
+    counter = VehicleCounter(model_path=None, inference_size=640)
+    assert set(changed_settings(meta, counter.detection_settings())) == {
+        'int8', 'vehicle_classes', 'roi', 'motion_gate'}
+
+
+def test_writer_streams_columns_to_disk_and_round_trips(tmp_path):
+    path = os.path.join(tmp_path, 'a.detections')
+    rng = np.random.default_rng(0)
+    writer = DetectionCacheWriter(path, video_path='video.mp4', fps=25.0, flush_frames=7)
+    expected = []
+    for frame in range(50):
+        flag = FLAG_HELD if frame % 11 == 0 else (FLAG_DETECTED, FLAG_PREDICTED)[frame % 2]
+        n = int(rng.integers(0, 5)) if flag == FLAG_DETECTED else 0
+        detections = Detections(rng.uniform(0, 720, (n, 4)), rng.integers(1, 99, n),
+                                rng.choice([2, 3, 5, 7], n), rng.uniform(0, 1, n))
+        writer.append(frame / 25.0, detections, flag, 720, 1280)
+        expected.append((frame / 25.0, flag, detections if flag == FLAG_DETECTED else None))
+        # Chỉ giữ trong RAM các frame chưa tới lượt ghi
+        assert writer._pending_frames < 7
+    assert os.path.getsize(os.path.join(path + '.tmp', 'ids.bin')) > 0
+    assert not os.path.exists(path)
+
+    cache = DetectionCache(writer.close())
+    assert not os.path.exists(path + '.tmp')
+    assert len(cache) == len(writer) == 50 and cache.meta['frames'] == 50
+    for index, (timestamp, flag, detections) in enumerate(expected):
+        assert cache.timestamps[index] == timestamp and cache.flags[index] == flag
+        xyxy, ids, classes, confidences = cache.frame_columns(index)
+        if detections is None:
+            assert len(ids) == 0
+            continue
+        np.testing.assert_allclose(xyxy, detections.xyxy.astype(np.float32))
+        np.testing.assert_array_equal(ids, detections.ids)
+        np.testing.assert_array_equal(classes, detections.classes)
+        np.testing.assert_allclose(confidences, detections.confidences.astype(np.float32))
+
+
+def test_discarded_writer_keeps_previous_cache(tmp_path):
+    path = _write_cache(os.path.join(tmp_path, 'a.detections'),
+                        VehicleCounter(model_path=None))
+    writer = DetectionCacheWriter(path, flush_frames=1)
+    writer.append(0.0, flag=FLAG_PREDICTED, frame_height=720, frame_width=1280)
+    writer.discard()
+    assert not os.path.exists(path + '.tmp')
+    assert len(DetectionCache(path)) == 1
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+from detection_cache import (DetectionCache, DetectionCacheWriter, FLAG_DETECTED, FLAG_HELD,
+                             FLAG_PREDICTED)
+from line_tuning import LineTuner
+from vehicle_counter import Detections, VehicleCounter
+
+HEIGHT, WIDTH = 720, 1280
+
+
+def _write_cache(path, rng, stride=2, frames=900, vehicles=70, fps=25.0):
+    """
+    Cache như khi chạy với inference_stride: frame lẻ dùng vị trí dự đoán, thêm vài
+    đoạn motion gate giữ nguyên track. Xe tăng/giảm tốc (dự đoán lệch), nhiễu, mất
+    detection, đổi class giữa chừng và class không được đếm.
+    """
+    start = rng.integers(0, frames - 50, vehicles)
+    y0 = rng.uniform(0, HEIGHT, vehicles)
+    speed = rng.choice([-1, 1], vehicles) * rng.uniform(1, 14, vehicles)
+    accel = rng.normal(0, 0.08, vehicles)
+    x = rng.uniform(50, WIDTH - 50, vehicles)
+    classes = rng.choice([0, 2, 3, 5, 7], vehicles)
+    flip = rng.random(vehicles) < 0.2
+    held = np.zeros(frames, dtype=bool)
+    for begin in rng.integers(0, frames - 30, 6):
+        held[begin:begin + rng.integers(4, 30)] = True
+
+    writer = DetectionCacheWriter(path, video_path='video.mp4', fps=fps,
+                                  inference_stride=stride)
+    for frame in range(frames):
+        timestamp = frame / fps
+        if held[frame] and frame % stride == 0:
+            writer.append(timestamp, flag=FLAG_HELD, frame_height=HEIGHT, frame_width=WIDTH)
+            continue
+        if frame % stride:
+            writer.append(timestamp, flag=FLAG_PREDICTED, frame_height=HEIGHT, frame_width=WIDTH)
+            continue
+        t = frame - start
+        cy = y0 + speed * t + accel * t * t + rng.normal(0, 1.5, vehicles)
+        visible = (t >= 0) & (cy > 0) & (cy < HEIGHT) & (rng.random(vehicles) > 0.1)
+        index = np.flatnonzero(visible)
+        cls = np.where(flip[index] & (t[index] > 40), 2, classes[index])
+        xyxy = np.stack([x[index] - 20, cy[index] - 15, x[index] + 20, cy[index] + 15], axis=1)
+        writer.append(timestamp, Detections(xyxy, index + 1, cls, np.full(len(index), 0.9)),
+                      FLAG_DETECTED, HEIGHT, WIDTH)
+    return writer.close()
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_counts_match_replay_with_stride_and_held_frames(tmp_path, seed):
+    cache = DetectionCache(_write_cache(os.path.join(tmp_path, 'a.detections'),
+                                        np.random.default_rng(seed)))
+    assert set(np.unique(np.asarray(cache.flags))) == {FLAG_DETECTED, FLAG_PREDICTED, FLAG_HELD}
+    tuner = LineTuner(cache)
+    for line_position in np.linspace(0.02, 0.98, 13):
+        counter = VehicleCounter(model_path=None, line_position=line_position)
+        expected = counter.replay(cache)
+        counts = tuner.counts(line_position, counter.class_names)
+        assert (counts['count_up'], counts['count_down']) == \
+            (expected['count_up'], expected['count_down'])
+        assert counts['classes'] == expected['classes']
@@ -0,0 +1,41 @@
+import time
+
+import live_source
+from live_source import LatestFrameGrabber
+
+
+class _SilentCapture:
+    """Nguồn nhận kết nối nhưng không gửi frame nào"""
+    opened = 0
+
+    def __init__(self, source):
+        _SilentCapture.opened += 1
+
+    def set(self, prop, value):
+        return True
+
+    def get(self, prop):
+        return 0.0
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        return False, None
+
+    def release(self):
+        pass
+
+
+def test_reconnect_backs_off_when_source_sends_no_frames(monkeypatch):
+    monkeypatch.setattr(live_source.cv2, 'VideoCapture', _SilentCapture)
+    _SilentCapture.opened = 0
+    grabber = LatestFrameGrabber('rtsp://camera/stream', reconnect_delay=0.05,
+                                 max_reconnect_delay=0.2).start()
+    time.sleep(1.0)
+    grabber.stop()
+
+    # Chờ 0.05 + 0.1 + 0.2 + 0.2... giữa các lần kết nối: khoảng 6 lần trong 1 giây
+    assert 3 <= _SilentCapture.opened <= 10
+    assert grabber.reconnects >= _SilentCapture.opened - 1
+    assert grabber.frames_read == 0
@@ -0,0 +1,32 @@
+from quality_controller import AdaptiveQualityController, build_quality_ladder
+from vehicle_counter import VehicleCounter
+
+
+def test_pytorch_inference_follows_inference_size():
+    counter = VehicleCounter(model_path=None, inference_size=960)
+    controller = AdaptiveQualityController(target_fps=25)
+    controller.sync(counter)
+    sizes = []
+    for _ in range(2):
+        for _ in range(controller.cooldown):
+            controller.update(1.0)
+        controller.apply(counter)
+        sizes.append(counter._inference_kwargs()['imgsz'])
+    # Mỗi lần hạ mức là một kích thước letterbox nhỏ hơn thật sự
+    assert sizes == [640, 320]
+
+    counter.inference_size = 600  # Không chia hết cho stride: làm tròn lên
+    assert counter._inference_kwargs()['imgsz'] == 608
+
+
+def test_fixed_input_model_only_degrades_stride():
+    counter = VehicleCounter(model_path=None, inference_size=640)
+    counter._model_imgsz = 640  # Như model ONNX/OpenVINO đã xuất
+    controller = AdaptiveQualityController(target_fps=25)
+    controller.sync(counter)
+    assert controller.ladder == build_quality_ladder(sizes=(640,))
+    assert {size for size, _ in controller.ladder} == {640}
+
+    for _ in range(controller.cooldown):
+        adjustment = controller.update(1.0)
+    assert adjustment['to'] == {'inference_size': 640, 'inference_stride': 2}
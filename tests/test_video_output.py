@@ -0,0 +1,49 @@
+import logging
+import os
+import stat
+import threading
+
+import numpy as np
+import pytest
+
+from video_output import FFmpegWriter, OutputOptions
+
+
+@pytest.mark.parametrize('size, source, expected', [
+    (None, (1919, 1079), (1918, 1078)),   # Không thu nhỏ, nguồn lẻ (vd. cắt ROI)
+    (1280, (641, 361), (640, 360)),       # Nguồn đã nhỏ hơn size
+    (960, (1920, 1080), (960, 540)),
+    (None, (1, 1), (2, 2)),
+])
+def test_frame_size_is_always_even(size, source, expected):
+    assert OutputOptions(size=size).frame_size(*source) == expected
+
+
+def test_writer_rejects_odd_size():
+    with pytest.raises(ValueError):
+        FFmpegWriter('out.mp4', 25.0, (641, 360))
+
+
+def test_writer_does_not_block_on_verbose_stderr(tmp_path, caplog):
+    # ffmpeg giả: ghi nhiều hơn buffer của pipe ra stderr trước khi đọc stdin
+    ffmpeg = tmp_path / 'ffmpeg'
+    ffmpeg.write_text('#!/bin/sh\n'
+                      'head -c 300000 /dev/zero | tr "\\0" x >&2\n'
+                      'cat > /dev/null\n'
+                      'exit 1\n')
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IXUSR)
+    writer = FFmpegWriter(os.path.join(tmp_path, 'out.mp4'), 25.0, (64, 32), ffmpeg=str(ffmpeg))
+    frame = np.zeros((32, 64, 3), dtype=np.uint8)
+
+    def write_all():
+        for _ in range(200):
+            writer.write(frame)
+
+    # Luồng riêng: nếu stderr không được xả thì ghi bị chặn mãi, test báo lỗi thay vì treo
+    thread = threading.Thread(target=write_all, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), "ghi video bị chặn vì stderr của ffmpeg đầy"
+    with caplog.at_level(logging.ERROR, logger='video_output'):
+        writer.release()
+    assert 'mã 1' in caplog.text
@@ -0,0 +1,176 @@
+"""
+Bảng lưu trạng thái các track dưới dạng cột NumPy.
+
+Thay cho dict-of-dicts: mỗi thuộc tính của track là một mảng, mỗi track là
+một dòng. Tra cứu ID -> dòng bằng searchsorted trên chỉ mục ID đã sắp xếp,
+nên cập nhật vị trí, xác định hướng, kiểm tra vượt đường đếm và xóa track
+cũ đều thực hiện được bằng phép toán mảng cho cả frame.
+"""
+import numpy as np
+
+# Mã hướng di chuyển lưu trong cột direction
+DIRECTION_NONE = 0
+DIRECTION_DOWN = 1   # center_y tăng (đi xuống trong ảnh)
+DIRECTION_UP = -1    # center_y giảm (đi lên trong ảnh)
+DIRECTION_NAMES = {DIRECTION_NONE: None, DIRECTION_DOWN: 'down', DIRECTION_UP: 'up'}
+
+
+class TrackTable:
+    # Tên cột và kiểu dữ liệu
+    COLUMNS = (
+        ('ids', np.int64),
+        ('center_x', np.float64),
+        ('center_y', np.float64),
+        ('last_y', np.float64),
+        ('crossed', np.bool_),
+        ('direction', np.int8),
+        ('cls', np.int64),
+        ('confidence', np.float32),
+        ('last_update', np.float64),
+        # Kích thước box và chuyển động đo được từ detector (dùng để dự đoán vị trí
+        # ở các frame không chạy inference)
+        ('width', np.float64),
+        ('height', np.float64),
+        ('measured_x', np.float64),
+        ('measured_y', np.float64),
+        ('measured_time', np.float64),
+        ('velocity_x', np.float64),  # px/giây
+        ('velocity_y', np.float64),
+        # Bitmask cho nhiều đường/vùng đếm (xem counting_zones): bit i = đã vượt
+        # đường thứ i / đang ở trong vùng thứ i
+        ('lines_crossed', np.uint64),
+        ('zones_inside', np.uint64),
+    )
+
+    def __init__(self, capacity=256):
+        self.size = 0
+        self._capacity = 0
+        self._order = None  # Chỉ mục sắp xếp theo ID, None = cần tính lại
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """Cấp phát (hoặc mở rộng) các cột, giữ nguyên dữ liệu hiện có"""
+        for name, dtype in self.COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            if self._capacity:
+                column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self._capacity = capacity
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, track_id):
+        return self.lookup(np.asarray([track_id]))[0] >= 0
+
+    def clear(self):
+        self.size = 0
+        self._order = None
+
+    def lookup(self, ids):
+        """
+        Tìm dòng của từng ID.
+
+        Returns:
+            np.ndarray: Chỉ số dòng, -1 nếu ID chưa có trong bảng
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.size == 0 or len(ids) == 0:
+            return np.full(len(ids), -1, dtype=np.intp)
+        if self._order is None:
+            self._order = np.argsort(self.ids[:self.size], kind='stable')
+        sorted_ids = self.ids[self._order]
+        pos = np.searchsorted(sorted_ids, ids)
+        pos = np.minimum(pos, self.size - 1)
+        found = sorted_ids[pos] == ids
+        return np.where(found, self._order[pos], -1)
+
+    def insert(self, ids, center_x, center_y, cls, confidence, timestamp,
+               width=0.0, height=0.0):
+        """Thêm các track mới (ID chưa có trong bảng), trả về chỉ số dòng của chúng"""
+        count = len(ids)
+        if count == 0:
+            return np.zeros(0, dtype=np.intp)
+        if self.size + count > self._capacity:
+            self._allocate(max(self._capacity * 2, self.size + count))
+        rows = np.arange(self.size, self.size + count)
+        self.ids[rows] = ids
+        self.center_x[rows] = center_x
+        self.center_y[rows] = center_y
+        self.last_y[rows] = center_y
+        self.crossed[rows] = False
+        self.direction[rows] = DIRECTION_NONE
+        self.cls[rows] = cls
+        self.confidence[rows] = confidence
+        self.last_update[rows] = timestamp
+        self.width[rows] = width
+        self.height[rows] = height
+        self.measured_x[rows] = center_x
+        self.measured_y[rows] = center_y
+        self.measured_time[rows] = timestamp
+        self.velocity_x[rows] = 0.0
+        self.velocity_y[rows] = 0.0
+        self.lines_crossed[rows] = 0
+        self.zones_inside[rows] = 0
+        self.size += count
+        self._order = None
+        return rows
+
+    def measure(self, rows, center_x, center_y, width, height, cls, confidence,
+                timestamp, smoothing=0.6):
+        """
+        Ghi nhận vị trí đo được từ detector và cập nhật vận tốc (mô hình vận tốc
+        không đổi, làm mượt theo hàm mũ).
+
+        Args:
+            smoothing: Trọng số của vận tốc mới (1.0 = chỉ dùng lần đo gần nhất)
+        """
+        dt = timestamp - self.measured_time[rows]
+        valid = dt > 0
+        safe_dt = np.where(valid, dt, 1.0)
+        for velocity, measured, center in ((self.velocity_x, self.measured_x, center_x),
+                                           (self.velocity_y, self.measured_y, center_y)):
+            old = velocity[rows]
+            new = (center - measured[rows]) / safe_dt
+            velocity[rows] = np.where(valid, smoothing * new + (1.0 - smoothing) * old, old)
+            measured[rows] = center
+        self.measured_time[rows] = timestamp
+        self.width[rows] = width
+        self.height[rows] = height
+        self.cls[rows] = cls
+        self.confidence[rows] = confidence
+
+    def predict(self, rows, timestamp):
+        """Vị trí tâm dự đoán tại timestamp theo vận tốc không đổi"""
+        dt = timestamp - self.measured_time[rows]
+        return (self.measured_x[rows] + self.velocity_x[rows] * dt,
+                self.measured_y[rows] + self.velocity_y[rows] * dt)
+
+    def hold(self, rows, timestamp):
+        """Đánh dấu track đứng yên tại vị trí đo gần nhất (frame không có chuyển động)"""
+        self.velocity_x[rows] = 0.0
+        self.velocity_y[rows] = 0.0
+        self.measured_time[rows] = timestamp
+
+    def expire(self, current_time, ttl):
+        """Xóa các track không được cập nhật quá ttl giây (dồn các dòng còn lại lên đầu)"""
+        if self.size == 0:
+            return 0
+        keep = (current_time - self.last_update[:self.size]) <= ttl
+        removed = self.size - int(np.count_nonzero(keep))
+        if removed:
+            for name, _ in self.COLUMNS:
+                column = getattr(self, name)
+                column[:self.size - removed] = column[:self.size][keep]
+            self.size -= removed
+            self._order = None
+        return removed
+
+    def directions(self, ids):
+        """Tên hướng ('up'/'down'/None) của từng ID, None nếu ID không có trong bảng"""
+        rows = self.lookup(ids)
+        return [DIRECTION_NAMES[int(self.direction[row])] if row >= 0 else None
+                for row in rows]
+
+    def direction_of(self, track_id):
+        return self.directions([track_id])[0]
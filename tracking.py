@@ -0,0 +1,48 @@
+"""
+ByteTrack chạy tách rời khỏi model YOLO.
+
+model.track() gộp detection và tracking trong một lần gọi cho từng frame.
+Khi tách riêng, detection có thể chạy theo batch nhiều frame, sau đó
+detections của từng frame được đưa tuần tự vào tracker - giống hệt cách
+Ultralytics gọi tracker bên trong model.track() nên ID không thay đổi.
+"""
+import numpy as np
+
+
+class ByteTrackTracker:
+    def __init__(self, tracker_config='bytetrack.yaml', frame_rate=30):
+        """
+        Args:
+            tracker_config: File cấu hình tracker của Ultralytics
+            frame_rate: FPS tham chiếu của tracker (Ultralytics dùng 30 trong model.track)
+        """
+        from ultralytics.trackers.byte_tracker import BYTETracker
+        from ultralytics.utils import IterableSimpleNamespace, yaml_load
+        from ultralytics.utils.checks import check_yaml
+
+        self.tracker_config = tracker_config
+        self.frame_rate = frame_rate
+        args = IterableSimpleNamespace(**yaml_load(check_yaml(tracker_config)))
+        self._tracker = BYTETracker(args=args, frame_rate=frame_rate)
+
+    def update(self, result, frame=None):
+        """
+        Cập nhật tracker với kết quả detection của một frame.
+
+        Args:
+            result: Một phần tử trong kết quả model.predict()
+            frame: Ảnh đã dùng để inference (ByteTrack không cần, giữ cho tương thích)
+
+        Returns:
+            np.ndarray: Mảng Nx8 [x1, y1, x2, y2, track_id, conf, cls, idx]
+                (theo tọa độ ảnh inference)
+        """
+        det = result.boxes.cpu().numpy()
+        # Giống Ultralytics: frame không có detection thì không cập nhật tracker
+        if len(det) == 0:
+            return np.zeros((0, 8), dtype=np.float32)
+        return self._tracker.update(det, frame)
+
+    def reset(self):
+        """Xóa toàn bộ track (dùng khi chuyển sang video mới)"""
+        self._tracker.reset()
@@ -1,28 +1,144 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
-from collections import defaultdict
 import time
-import torch
+from tracking import ByteTrackTracker
+from track_table import TrackTable, DIRECTION_DOWN, DIRECTION_NAMES, DIRECTION_UP
+from inference_backends import load_model
+from motion_gate import MotionGate
+from roi import InferenceRegion
+from counting_zones import CountingLayout
+from count_aggregation import MAIN_LINE
+from detection_cache import DetectionCache, FLAG_DETECTED, FLAG_HELD, FLAG_PREDICTED
+from stage_timing import StageTimers
+
+# Stride lớn nhất của YOLO: kích thước input phải là bội số của giá trị này
+MODEL_STRIDE = 32
+
+
+class Detections:
+    """
+    Kết quả detection + tracking của một frame dưới dạng mảng NumPy.
+    Tọa độ box luôn ở kích thước frame gốc (đã scale ngược từ inference_frame).
+    """
+    __slots__ = ('xyxy', 'ids', 'classes', 'confidences')
+
+    def __init__(self, xyxy, ids, classes, confidences):
+        self.xyxy = xyxy
+        self.ids = ids
+        self.classes = classes
+        self.confidences = confidences
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4), dtype=np.float64), np.zeros(0, dtype=int),
+                   np.zeros(0, dtype=int), np.zeros(0, dtype=np.float32))
+
+    @classmethod
+    def from_results(cls, results, scale_x=1.0, scale_y=1.0, offset_x=0, offset_y=0):
+        """
+        Chuyển kết quả của Ultralytics sang Detections (chỉ giữ box có tracking ID).
+        offset_x, offset_y: Góc trên trái của vùng ROI đã cắt (tọa độ frame gốc)
+        """
+        if results is None or len(results) == 0 or results[0].boxes.id is None:
+            return cls.empty()
+        boxes = results[0].boxes
+        # Chuyển sang numpy một lần duy nhất rồi scale về kích thước gốc
+        xyxy = boxes.xyxy.cpu().numpy().astype(np.float64)
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]] * scale_x + offset_x
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]] * scale_y + offset_y
+        return cls(xyxy,
+                   boxes.id.cpu().numpy().astype(int),
+                   boxes.cls.cpu().numpy().astype(int),
+                   boxes.conf.cpu().numpy())
+
+    @classmethod
+    def from_tracks(cls, tracks, scale_x=1.0, scale_y=1.0, offset_x=0, offset_y=0):
+        """Chuyển đầu ra Nx8 của ByteTrackTracker sang Detections"""
+        if len(tracks) == 0:
+            return cls.empty()
+        xyxy = tracks[:, :4].astype(np.float64)
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]] * scale_x + offset_x
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]] * scale_y + offset_y
+        return cls(xyxy, tracks[:, 4].astype(int), tracks[:, 6].astype(int), tracks[:, 5])
+
+    def scaled(self, scale_x, scale_y):
+        """Bản sao với box nhân theo tỷ lệ (đổi giữa frame giải mã thu nhỏ và frame gốc)"""
+        return Detections(self.xyxy * np.array([scale_x, scale_y, scale_x, scale_y]),
+                          self.ids, self.classes, self.confidences)
+
+    def select(self, mask):
+        """Lọc detections theo mask/chỉ số"""
+        return Detections(self.xyxy[mask], self.ids[mask],
+                          self.classes[mask], self.confidences[mask])
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def detect_device():
+    """'cuda' nếu PyTorch thấy GPU, ngược lại 'cpu' (chỉ import torch khi cần để khởi động nhanh)"""
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def as_detections(results, scale_x=1.0, scale_y=1.0):
+    """Chấp nhận cả Detections lẫn results của Ultralytics"""
+    if isinstance(results, Detections):
+        return results
+    return Detections.from_results(results, scale_x, scale_y)
+
 
 class VehicleCounter:
     def __init__(self, model_path='models/train_100.pt', line_position=0.7, 
                  inference_size=640, use_half_precision=True,
-                 inference_stride=1):
+                 inference_stride=1, batch_size=1, track_ttl=2.0,
+                 backend='pytorch', int8=False, motion_gate=False, roi=None, layout=None,
+                 model=None, timings=False):
         """
         Khởi tạo hệ thống đếm phương tiện
         
         Args:
-            model_path: Đường dẫn đến file model đã được huấn luyện
+            model_path: Đường dẫn đến file model đã được huấn luyện (None = không nạp model,
+                chỉ dùng để đếm lại từ cache detection bằng replay())
             line_position: Vị trí đường đếm (0.0-1.0, tính từ trên xuống)
             inference_size: Kích thước frame để inference (nhỏ hơn = nhanh hơn, mặc định 640)
             use_half_precision: Sử dụng FP16 nếu GPU có sẵn (nhanh hơn ~2x)
-            inference_stride: Chỉ chạy inference mỗi N frame (CPU nên >1 để nhẹ hơn)
+            inference_stride: Chỉ chạy inference mỗi N frame (CPU nên >1 để nhẹ hơn); ở các frame
+                bỏ qua, vị trí track được dự đoán theo vận tốc và vẫn kiểm tra vượt đường đếm
+            batch_size: Số frame mỗi lần gọi detector trong detect_batch (>1 = tách tracker
+                khỏi model: detection chạy theo batch, ByteTrack cập nhật tuần tự từng frame)
+            track_ttl: Xóa track không xuất hiện quá số giây này (theo timestamp truyền vào
+                update_counts - thời gian của video với file, đồng hồ thật với nguồn trực tiếp)
+            backend: 'pytorch', 'onnx' (ONNX Runtime) hoặc 'openvino' - hai backend sau chạy
+                trên CPU, model được xuất một lần và lưu cache theo hash model + inference_size
+            int8: Dùng model lượng tử hóa INT8 (chỉ với onnx/openvino)
+            motion_gate: Bỏ qua detector khi dải quanh đường đếm không có chuyển động
+                (True = MotionGate mặc định, hoặc truyền một MotionGate đã cấu hình)
+            roi: Chỉ detect trong vùng quanh đường đếm (True = dải mặc định, hoặc một
+                InferenceRegion với dải/polygon tùy chỉnh); None = cả frame
+            layout: Nhiều đường/vùng đếm (CountingLayout hoặc đường dẫn file JSON),
+                đếm song song với đường đếm ngang line_position
+            model: Model YOLO đã nạp sẵn để dùng chung giữa nhiều counter (nhiều camera);
+                khi đó tracker luôn chạy tách riêng để trạng thái không nằm trong model
+            timings: Đo độ trễ từng bước (resize, inference, đếm, vẽ...) vào self.timers
+                (True = StageTimers mặc định, hoặc truyền một StageTimers đã cấu hình)
         """
-        self.model = YOLO(model_path)
+        self.model_path = model_path
+        self.backend = backend
+        self.int8 = int8 and backend != 'pytorch'
+        # _model_imgsz: kích thước input của model đã xuất (None = PyTorch tự chọn)
+        if model is not None:
+            self.model = model
+            self._model_imgsz = None if backend == 'pytorch' else inference_size
+        elif model_path is None:
+            self.model, self._model_imgsz = None, None
+        else:
+            self.model, self._model_imgsz = load_model(model_path, backend=backend,
+                                                       imgsz=inference_size, int8=self.int8)
+        self.shared_model = model is not None
         
         # Tối ưu hóa model
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        device = detect_device() if backend == 'pytorch' and self.model is not None else 'cpu'
         self.device = device
         # CPU không dùng FP16 để tránh overhead chuyển kiểu
         self.use_half = use_half_precision and device == 'cuda'
@@ -31,12 +147,39 @@ class VehicleCounter:
         self.inference_size = inference_size
         # Giảm tần suất inference để nhẹ CPU
         self.inference_stride = max(1, int(inference_stride))
+        # Batch detection: model chỉ dùng predict(), tracker chạy riêng.
+        # Chế độ cố định khi khởi tạo vì model.track() gắn tracker vào predictor của model
+        self.batch_size = max(1, int(batch_size))
+        self._tracker = (ByteTrackTracker()
+                         if self.batch_size > 1 or self.shared_model else None)
+        # Trạng thái stride: số frame đã xử lý và các ID của lần detect gần nhất
+        self._frame_index = 0
+        self._last_detected_ids = None
+        # Ghi kết quả từng frame vào cache detection (DetectionCacheWriter, None = không ghi)
+        self.recorder = None
+        # Các hàm nhận sự kiện mỗi khi có xe vượt đường đếm (xem _emit_crossings)
+        self.crossing_listeners = []
+        # Ghi sự kiện + đếm theo khoảng thời gian (CountAggregator, None = không ghi)
+        self.aggregator = None
+        # Nhật ký sự kiện trên đĩa (EventLogWriter, None = không ghi)
+        self.event_log = None
+        # Frame đưa vào được giải mã thu nhỏ (video_input.open_video): tọa độ frame *
+        # input_scale = tọa độ video gốc. Đếm/cache luôn theo video gốc để kết quả
+        # (dung sai ±10px quanh đường đếm) không đổi; pipeline/GUI đặt khi mở video
+        self.input_scale = (1.0, 1.0)
+        # Độ trễ từng bước; pipeline/GUI ghi thêm decode, hiển thị, ghi video vào đây
+        self.timers = (timings if isinstance(timings, StageTimers)
+                       else StageTimers(enabled=bool(timings)))
+        # Bộ lọc chuyển động (None = luôn chạy detector)
+        self.motion_gate = (MotionGate() if motion_gate is True else motion_gate) or None
+        # Vùng inference (None = cả frame)
+        self.roi = (InferenceRegion() if roi is True else roi) or None
         
         self.line_position = line_position  # Vị trí đường đếm (tỷ lệ chiều cao)
-        self.tracks = defaultdict(dict)  # Lưu trữ tracking info
+        self.tracks = TrackTable()  # Lưu trữ tracking info (mỗi track một dòng)
+        self.track_ttl = track_ttl
         self.count_up = 0  # Đếm phương tiện đi lên
         self.count_down = 0  # Đếm phương tiện đi xuống
-        self.last_update = {}  # Thời gian cập nhật cuối cùng của mỗi ID
         self.vehicle_classes = [2, 3, 5, 7]  # COCO classes: car, motorcycle, bus, truck
         self.class_names = {
             2: 'Car',
@@ -49,99 +192,191 @@ class VehicleCounter:
             cls: {'up': 0, 'down': 0}
             for cls in self.vehicle_classes
         }
+        self.layout = None
+        self.set_layout(layout)
         
-    def update_counts(self, results, frame_height, scale_x=1.0, scale_y=1.0):
-        """Cập nhật số lượng phương tiện đã vượt qua đường đếm"""
-        current_time = time.time()
+    def update_counts(self, results, frame_height, scale_x=1.0, scale_y=1.0, timestamp=None,
+                      predicted=False, frame_width=None):
+        """
+        Cập nhật số lượng phương tiện đã vượt qua đường đếm
+
+        Args:
+            results: Detections hoặc results của Ultralytics
+            frame_height: Chiều cao frame gốc
+            scale_x, scale_y: Hệ số scale về frame gốc (chỉ dùng với results của Ultralytics)
+            timestamp: Thời điểm của frame (giây, xem MediaClock); None = đồng hồ thật
+            predicted: Box là vị trí dự đoán (frame không chạy detector) - không dùng để
+                cập nhật vận tốc
+            frame_width: Chiều rộng frame gốc (bắt buộc khi có layout với tọa độ tỷ lệ)
+        """
+        current_time = time.time() if timestamp is None else timestamp
         # QUAN TRỌNG: line_y phải tính theo frame_height gốc (không scale)
         line_y = int(frame_height * self.line_position)
         
-        # Lấy các detections có tracking ID
-        if results[0].boxes.id is not None:
-            boxes = results[0].boxes.xyxy.cpu().numpy()
-            ids = results[0].boxes.id.cpu().numpy().astype(int)
-            classes = results[0].boxes.cls.cpu().numpy().astype(int)
-            confidences = results[0].boxes.conf.cpu().numpy()
+        # Lấy các detections có tracking ID (đã scale về kích thước gốc)
+        detections = as_detections(results, scale_x, scale_y)
+        if len(detections) > 0:
+            detections = detections.select(np.isin(detections.classes, self.vehicle_classes))
+        if len(detections) > 0:
+            # Mỗi ID chỉ xử lý một lần mỗi frame (giữ box cuối cùng nếu bị trùng)
+            _, last_index = np.unique(detections.ids[::-1], return_index=True)
+            if len(last_index) < len(detections):
+                detections = detections.select(np.sort(len(detections) - 1 - last_index))
             
-            for box, track_id, cls, conf in zip(boxes, ids, classes, confidences):
-                if cls not in self.vehicle_classes:
-                    continue
-                    
-                x1, y1, x2, y2 = box
-                # Scale boxes về kích thước gốc nếu đã resize
-                # QUAN TRỌNG: Luôn scale về kích thước gốc để so sánh với line_y
-                x1 = float(x1 * scale_x)
-                x2 = float(x2 * scale_x)
-                y1 = float(y1 * scale_y)
-                y2 = float(y2 * scale_y)
-                
-                center_y = (y1 + y2) / 2.0
-                center_x = (x1 + x2) / 2.0
-                
-                # Khởi tạo tracking cho ID mới
-                if track_id not in self.tracks:
-                    # Lưu center_y đã được scale về kích thước gốc
-                    self.tracks[track_id] = {
-                        'center_y': center_y,
-                        'center_x': center_x,
-                        'crossed': False,
-                        'direction': None,
-                        'last_y': center_y,  # Lưu đã scale về kích thước gốc
-                        'class': cls,
-                        'confidence': conf
-                    }
-                    self.last_update[track_id] = current_time
-                else:
-                    # Cập nhật vị trí
-                    # last_y đã được scale về kích thước gốc từ frame trước
-                    last_y = self.tracks[track_id]['last_y']
-                    self.tracks[track_id]['last_y'] = center_y  # Lưu đã scale về kích thước gốc
-                    self.tracks[track_id]['center_x'] = center_x
-                    self.tracks[track_id]['center_y'] = center_y
-                    self.last_update[track_id] = current_time
-                    
-                    # Xác định hướng di chuyển
-                    if self.tracks[track_id]['direction'] is None:
-                        if abs(center_y - last_y) > 1.0:  # Chỉ xác định khi có di chuyển đáng kể
-                            if center_y > last_y:
-                                self.tracks[track_id]['direction'] = 'down'
-                            elif center_y < last_y:
-                                self.tracks[track_id]['direction'] = 'up'
-                    
-                    # Kiểm tra nếu phương tiện vượt qua đường đếm
-                    # Tất cả đều ở kích thước gốc nên so sánh chính xác
-                    if not self.tracks[track_id]['crossed'] and self.tracks[track_id]['direction'] is not None:
-                        if self.tracks[track_id]['direction'] == 'down':
-                            # Đi xuống: từ trên line_y xuống dưới line_y
-                            # Cho phép một khoảng tolerance để tránh bỏ sót
-                            if (last_y < line_y + 10) and center_y > line_y - 10:
-                                self.count_down += 1
-                                self.class_counts[cls]['down'] += 1
-                                self.tracks[track_id]['crossed'] = True
-                        elif self.tracks[track_id]['direction'] == 'up':
-                            # Đi lên: từ dưới line_y lên trên line_y
-                            # Cho phép một khoảng tolerance để tránh bỏ sót
-                            if (last_y > line_y - 10) and center_y < line_y + 10:
-                                self.count_up += 1
-                                self.class_counts[cls]['up'] += 1
-                                self.tracks[track_id]['crossed'] = True
-        
-        # Xóa các track cũ không được cập nhật trong 2 giây
-        tracks_to_remove = []
-        for track_id, last_time in self.last_update.items():
-            if current_time - last_time > 2.0:
-                tracks_to_remove.append(track_id)
+            # QUAN TRỌNG: Box đã ở kích thước gốc để so sánh với line_y
+            xyxy = detections.xyxy
+            center_x = (xyxy[:, 0] + xyxy[:, 2]) / 2.0
+            center_y = (xyxy[:, 1] + xyxy[:, 3]) / 2.0
+            
+            tracks = self.tracks
+            rows = tracks.lookup(detections.ids)
+            existing = rows >= 0
+            
+            width = xyxy[:, 2] - xyxy[:, 0]
+            height = xyxy[:, 3] - xyxy[:, 1]
+            
+            # Khởi tạo tracking cho ID mới (last_y = center_y, chưa có hướng)
+            new = ~existing
+            new_rows = tracks.insert(detections.ids[new], center_x[new], center_y[new],
+                                     detections.classes[new], detections.confidences[new],
+                                     current_time, width[new], height[new])
+            
+            # Cập nhật vị trí các track đã có
+            rows = rows[existing]
+            center_y = center_y[existing]
+            classes = detections.classes[existing]
+            # last_y đã được scale về kích thước gốc từ frame trước
+            last_y = tracks.last_y[rows]
+            last_x = tracks.center_x[rows]
+            tracks.last_y[rows] = center_y
+            tracks.center_x[rows] = center_x[existing]
+            tracks.center_y[rows] = center_y
+            tracks.last_update[rows] = current_time
+            if not predicted:
+                tracks.measure(rows, center_x[existing], center_y, width[existing],
+                               height[existing], classes, detections.confidences[existing],
+                               current_time)
+            
+            # Xác định hướng di chuyển - chỉ khi chưa có và có di chuyển đáng kể
+            direction = tracks.direction[rows]
+            dy = center_y - last_y
+            undecided = (direction == 0) & (np.abs(dy) > 1.0)
+            direction = np.where(undecided, np.sign(dy), direction).astype(np.int8)
+            tracks.direction[rows] = direction
+            
+            # Kiểm tra nếu phương tiện vượt qua đường đếm
+            # Cho phép một khoảng tolerance ±10px để tránh bỏ sót
+            pending = ~tracks.crossed[rows]
+            # Đi xuống: từ trên line_y xuống dưới line_y
+            crossed_down = (pending & (direction == DIRECTION_DOWN) &
+                            (last_y < line_y + 10) & (center_y > line_y - 10))
+            # Đi lên: từ dưới line_y lên trên line_y
+            crossed_up = (pending & (direction == DIRECTION_UP) &
+                          (last_y > line_y - 10) & (center_y < line_y + 10))
+            crossed = crossed_down | crossed_up
+            tracks.crossed[rows[crossed]] = True
+            if (self.aggregator is not None or self.event_log is not None) and crossed.any():
+                self._record_crossings(current_time, tracks.ids[rows[crossed]],
+                                       classes[crossed], crossed_down[crossed].astype(np.int8),
+                                       0, center_x[existing][crossed], center_y[crossed])
+            if self.crossing_listeners and crossed.any():
+                self._emit_crossings(tracks.ids[rows[crossed]], classes[crossed],
+                                     direction[crossed], center_x[existing][crossed],
+                                     center_y[crossed], current_time)
+            
+            self.count_down += int(np.count_nonzero(crossed_down))
+            self.count_up += int(np.count_nonzero(crossed_up))
+            for key, mask in (('down', crossed_down), ('up', crossed_up)):
+                crossed_classes, counts = np.unique(classes[mask], return_counts=True)
+                for cls, count in zip(crossed_classes, counts):
+                    self.class_counts[int(cls)][key] += int(count)
+            
+            # Các đường/vùng đếm bổ sung (kiểm tra giao cắt vector hóa)
+            if self.layout is not None:
+                line_crossings = self.layout.update(tracks, rows, last_x, last_y,
+                                                    frame_width, frame_height)
+                if line_crossings is not None and (self.aggregator is not None or
+                                                   self.event_log is not None):
+                    track_index, line_index, line_direction = line_crossings
+                    crossed_rows = rows[track_index]
+                    # Đường thứ i của layout là đường i + 1 trong line_names()
+                    self._record_crossings(current_time, tracks.ids[crossed_rows],
+                                           tracks.cls[crossed_rows], line_direction,
+                                           line_index + 1, tracks.center_x[crossed_rows],
+                                           tracks.center_y[crossed_rows])
+                self.layout.initialize(tracks, new_rows, frame_width, frame_height)
         
-        for track_id in tracks_to_remove:
-            if track_id in self.tracks:
-                del self.tracks[track_id]
-            if track_id in self.last_update:
-                del self.last_update[track_id]
+        # Xóa các track cũ không được cập nhật trong track_ttl giây
+        self.tracks.expire(current_time, self.track_ttl)
     
-    def draw_results(self, frame, results, scale_x=1.0, scale_y=1.0):
-        """Vẽ kết quả lên frame"""
+    def _record_crossings(self, timestamp, ids, classes, directions, line, center_x, center_y):
+        """Ghi lượt vượt đường vào aggregator và nhật ký sự kiện (nếu có)"""
+        frame = self._frame_index - 1
+        for sink in (self.aggregator, self.event_log):
+            if sink is not None:
+                sink.record(frame, timestamp, ids, classes, directions, line=line,
+                            x=center_x, y=center_y)
+
+    def _emit_crossings(self, ids, classes, directions, center_x, center_y, timestamp):
+        """
+        Gửi sự kiện vượt đường đếm cho crossing_listeners, mỗi xe một dict:
+        frame, timestamp, track_id, class_id, class_name, direction ('up'/'down'), x, y
+        """
+        frame = self._frame_index - 1
+        for track_id, cls, direction, x, y in zip(ids, classes, directions, center_x, center_y):
+            event = {
+                'frame': frame,
+                'timestamp': float(timestamp),
+                'track_id': int(track_id),
+                'class_id': int(cls),
+                'class_name': self.class_names.get(int(cls), str(cls)),
+                'direction': DIRECTION_NAMES[int(direction)],
+                'x': float(x),
+                'y': float(y),
+            }
+            for listener in self.crossing_listeners:
+                listener(event)
+
+    def overlay_state(self, detections):
+        """
+        Chụp lại trạng thái cần để vẽ một frame (số đếm + hướng của từng ID).
+        Dùng khi vẽ ở luồng khác với luồng cập nhật đếm (pipeline preprocessing).
+        """
+        directions = self.tracks.directions(detections.ids)
+        return {
+            'count_up': self.count_up,
+            'count_down': self.count_down,
+            'directions': directions,
+            'layout': self.layout.snapshot() if self.layout is not None else None,
+        }
+
+    def draw_results(self, frame, results, scale_x=1.0, scale_y=1.0, overlay=None):
+        """
+        Vẽ kết quả lên frame
+
+        Args:
+            overlay: Trạng thái từ overlay_state(); None = dùng trạng thái hiện tại của counter
+        """
+        with self.timers.stage('draw'):
+            return self._draw_results(frame, results, scale_x, scale_y, overlay)
+
+    def _draw_results(self, frame, results, scale_x, scale_y, overlay):
         frame_height, frame_width = frame.shape[:2]
         line_y = int(frame_height * self.line_position)
+        detections = as_detections(results, scale_x, scale_y)
+        if self.input_scale != (1.0, 1.0):
+            # Box theo video gốc, frame đang vẽ là bản giải mã thu nhỏ
+            detections = detections.scaled(1.0 / self.input_scale[0], 1.0 / self.input_scale[1])
+        if overlay is None:
+            overlay = self.overlay_state(detections)
+        
+        # Vẽ vùng inference (nếu chỉ detect quanh đường đếm)
+        if self.roi is not None:
+            self.roi.draw(frame, self.line_position)
+        
+        # Các đường/vùng đếm bổ sung (lớp overlay được cache)
+        if self.layout is not None:
+            self.layout.draw(frame, overlay.get('layout'))
         
         # Vẽ đường đếm
         cv2.line(frame, (0, line_y), (frame_width, line_y), (0, 255, 255), 3)
@@ -149,23 +384,14 @@ class VehicleCounter:
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
         
         # Vẽ các bounding boxes và thông tin
-        if results is not None and len(results) > 0 and results[0].boxes.id is not None:
-            # Chuyển sang numpy một lần duy nhất
-            boxes = results[0].boxes.xyxy.cpu().numpy()
-            ids = results[0].boxes.id.cpu().numpy().astype(int)
-            classes = results[0].boxes.cls.cpu().numpy().astype(int)
-            confidences = results[0].boxes.conf.cpu().numpy()
-            
-            # Scale boxes về kích thước gốc
-            boxes[:, [0, 2]] *= scale_x
-            boxes[:, [1, 3]] *= scale_y
-            
+        if len(detections) > 0:
             # Lọc chỉ các vehicle classes trước khi vẽ
-            vehicle_mask = np.isin(classes, self.vehicle_classes)
-            boxes = boxes[vehicle_mask]
-            ids = ids[vehicle_mask]
-            classes = classes[vehicle_mask]
-            confidences = confidences[vehicle_mask]
+            vehicle_mask = np.isin(detections.classes, self.vehicle_classes)
+            boxes = detections.xyxy[vehicle_mask]
+            ids = detections.ids[vehicle_mask]
+            classes = detections.classes[vehicle_mask]
+            confidences = detections.confidences[vehicle_mask]
+            directions = [d for d, keep in zip(overlay['directions'], vehicle_mask) if keep]
             
             # Màu sắc theo loại phương tiện (định nghĩa một lần)
             colors = {
@@ -175,7 +401,8 @@ class VehicleCounter:
                 7: (0, 165, 255)     # Truck - Orange
             }
             
-            for box, track_id, cls, conf in zip(boxes, ids, classes, confidences):
+            for box, track_id, cls, conf, direction in zip(boxes, ids, classes,
+                                                           confidences, directions):
                 x1, y1, x2, y2 = map(int, box)
                 color = colors.get(cls, (255, 255, 255))
                 
@@ -184,10 +411,8 @@ class VehicleCounter:
                 
                 # Vẽ label
                 label = f"{self.class_names[cls]} {track_id} {conf:.2f}"
-                if track_id in self.tracks:
-                    direction = self.tracks[track_id]['direction']
-                    if direction:
-                        label += f" ({direction})"
+                if direction:
+                    label += f" ({direction})"
                 
                 # Background cho text
                 (label_width, label_height), _ = cv2.getTextSize(
@@ -199,31 +424,51 @@ class VehicleCounter:
         
         # Hiển thị số lượng đếm được
         cv2.rectangle(frame, (10, 10), (350, 120), (0, 0, 0), -1)
-        cv2.putText(frame, f'Vehicles Up: {self.count_up}', (20, 40),
+        count_up, count_down = overlay['count_up'], overlay['count_down']
+        cv2.putText(frame, f'Vehicles Up: {count_up}', (20, 40),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-        cv2.putText(frame, f'Vehicles Down: {self.count_down}', (20, 75),
+        cv2.putText(frame, f'Vehicles Down: {count_down}', (20, 75),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
-        cv2.putText(frame, f'Total: {self.count_up + self.count_down}', (20, 110),
+        cv2.putText(frame, f'Total: {count_up + count_down}', (20, 110),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 0), 2)
         
         # Hiển thị thông tin device
         device_text = f'Device: {self.device.upper()}'
         if self.use_half:
             device_text += ' (FP16)'
+        if self.backend != 'pytorch':
+            device_text += f' [{self.backend.upper()}{" INT8" if self.int8 else ""}]'
         cv2.putText(frame, device_text, (20, frame_height - 20),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
         
         return frame
     
-    def process_frame(self, frame):
-        """Xử lý một frame - luôn chạy inference trên mọi frame để đảm bảo độ chính xác"""
+    def _prepare_inference_frame(self, frame):
+        """
+        Cắt vùng ROI (nếu có) rồi resize về inference_size (giữ tỷ lệ khung hình).
+        Với ROI, cạnh dài của vùng cắt được dùng toàn bộ inference_size nên xe nhỏ
+        giữ được nhiều chi tiết hơn so với thu nhỏ cả frame.
+
+        Returns:
+            tuple: (inference_frame, scale_x, scale_y, offset_x, offset_y) - box trên
+                inference_frame * scale + offset = tọa độ frame gốc (nhân thêm input_scale
+                nếu frame được giải mã thu nhỏ)
+        """
+        with self.timers.stage('resize'):
+            inference_frame, scale_x, scale_y, offset_x, offset_y = \
+                self._resize_inference_frame(frame)
+        input_x, input_y = self.input_scale
+        return (inference_frame, scale_x * input_x, scale_y * input_y,
+                offset_x * input_x, offset_y * input_y)
+
+    def _resize_inference_frame(self, frame):
+        offset_x = offset_y = 0
+        if self.roi is not None:
+            frame, offset_x, offset_y = self.roi.crop(frame, self.line_position)
         original_height, original_width = frame.shape[:2]
         
         # Resize frame để giảm độ phân giải inference (tăng tốc đáng kể)
         # Nhưng vẫn giữ tỷ lệ khung hình
-        scale_x = 1.0
-        scale_y = 1.0
-        
         if original_width > self.inference_size or original_height > self.inference_size:
             # Tính scale để fit vào inference_size nhưng giữ tỷ lệ
             scale = min(self.inference_size / original_width, 
@@ -233,43 +478,308 @@ class VehicleCounter:
             inference_frame = cv2.resize(frame, (inference_width, inference_height), 
                                         interpolation=cv2.INTER_LINEAR)
             # Tính scale factors chính xác
-            scale_x = original_width / inference_width
-            scale_y = original_height / inference_height
+            return (inference_frame, original_width / inference_width,
+                    original_height / inference_height, offset_x, offset_y)
+        return frame, 1.0, 1.0, offset_x, offset_y
+
+    def _inference_kwargs(self):
+        """Tham số chung cho model.track()/predict()"""
+        kwargs = {
+            'classes': self.vehicle_classes,
+            'conf': 0.25,
+            'device': self.device,
+            'half': self.use_half,  # Sử dụng FP16 nếu có GPU
+            'verbose': False,  # Tắt output để tăng tốc
+        }
+        if self._model_imgsz is not None:
+            # Model đã xuất (ONNX/OpenVINO) cần đúng kích thước input lúc xuất
+            kwargs['imgsz'] = self._model_imgsz
         else:
-            inference_frame = frame
+            # PyTorch: letterbox theo inference_size (làm tròn lên bội số stride) để
+            # inference_size quyết định chi phí thật sự - không truyền thì Ultralytics
+            # phóng frame đã thu nhỏ lên lại 640. Với ROI, tensor chỉ cao bằng dải
+            kwargs['imgsz'] = -(-self.inference_size // MODEL_STRIDE) * MODEL_STRIDE
+        return kwargs
+
+    @property
+    def fixed_input_size(self):
+        """Kích thước input cố định của model đã xuất (None = PyTorch, đổi được theo inference_size)"""
+        return self._model_imgsz
+
+    def warmup(self, iterations=3, frame_shape=None):
+        """
+        Chạy vài lần inference trên frame đen để nạp kernel/bộ nhớ trước,
+        không làm thay đổi trạng thái tracker và bộ đếm.
+
+        Args:
+            frame_shape: (height, width) của frame giả, mặc định 16:9 theo inference_size
+
+        Returns:
+            list: Thời gian (giây) của từng lần chạy - lần đầu là cold start
+        """
+        if frame_shape is None:
+            frame_shape = (self.inference_size * 9 // 16, self.inference_size)
+        frame = np.zeros((frame_shape[0], frame_shape[1], 3), dtype=np.uint8)
+        inference_frame = self._prepare_inference_frame(frame)[0]
+        # Batch đúng kích thước sẽ dùng khi xử lý video trước
+        frames = [inference_frame] * self.batch_size
+        durations = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            self.model.predict(frames if len(frames) > 1 else inference_frame,
+                               **self._inference_kwargs())
+            durations.append(time.perf_counter() - start)
+        return durations
+
+    def detect(self, frame):
+        """
+        Chạy detection + tracking trên một frame.
+
+        Returns:
+            Detections: Box đã scale về kích thước frame gốc
+        """
+        if self._tracker is not None:
+            return self.detect_batch([frame])[0]
+        
+        inference_frame, scale_x, scale_y, offset_x, offset_y = \
+            self._prepare_inference_frame(frame)
         
         # Chạy YOLOv11 đã được huấn luyện với tracking - luôn chạy trên mọi frame
-        # QUAN TRỌNG: Không dùng imgsz parameter để mô hình tự xử lý kích thước
+        # imgsz theo inference_size (model ONNX/OpenVINO: kích thước cố định lúc xuất)
         # Boxes trả về sẽ theo kích thước inference_frame, sau đó chúng ta scale về gốc
-        results = self.model.track(
-            inference_frame, 
-            persist=True, 
-            tracker="bytetrack.yaml",
-            classes=self.vehicle_classes, 
-            conf=0.25,
-            device=self.device,
-            half=self.use_half,  # Sử dụng FP16 nếu có GPU
-            verbose=False  # Tắt output để tăng tốc
-        )
+        with self.timers.stage('inference'):
+            results = self.model.track(
+                inference_frame, 
+                persist=True, 
+                tracker="bytetrack.yaml",
+                **self._inference_kwargs()
+            )
+        return Detections.from_results(results, scale_x, scale_y, offset_x, offset_y)
+
+    def detect_batch(self, frames):
+        """
+        Chạy detection một lần cho nhiều frame liên tiếp, sau đó cập nhật tracker
+        tuần tự từng frame (ID và kết quả đếm giống hệt chạy từng frame).
+        Chỉ dùng được khi batch_size > 1 hoặc model dùng chung.
+
+        Returns:
+            list: Detections của từng frame theo đúng thứ tự
+        """
+        if self._tracker is None:
+            raise RuntimeError("detect_batch cần batch_size > 1 hoặc model dùng chung")
         
-        # Cập nhật số lượng
-        self.update_counts(results, original_height, scale_x, scale_y)
+        prepared = [self._prepare_inference_frame(frame) for frame in frames]
+        inference_frames = [item[0] for item in prepared]
+        # Cùng tham số với detect() để kích thước letterbox không đổi
+        with self.timers.stage('inference'):
+            results = self.model.predict(inference_frames, **self._inference_kwargs())
         
-        # Vẽ kết quả
-        annotated_frame = self.draw_results(frame, results, scale_x, scale_y)
+        return [self.track_result(result, item) for result, item in zip(results, prepared)]
+
+    def track_result(self, result, prepared):
+        """
+        Đưa kết quả detection của một frame vào tracker riêng của counter này.
+
+        Args:
+            result: Một phần tử trong kết quả model.predict()
+            prepared: Giá trị _prepare_inference_frame() của frame đó
+
+        Returns:
+            Detections: Box đã đưa về tọa độ frame gốc
+        """
+        inference_frame, scale_x, scale_y, offset_x, offset_y = prepared
+        with self.timers.stage('track'):
+            tracks = self._tracker.update(result, inference_frame)
+        return Detections.from_tracks(tracks, scale_x, scale_y, offset_x, offset_y)
+
+    def is_inference_frame(self, offset=0):
+        """Frame thứ offset tính từ frame tiếp theo có chạy detector không (theo inference_stride)"""
+        return (self._frame_index + offset) % self.inference_stride == 0
+
+    def predict_detections(self, timestamp):
+        """
+        Dự đoán box của các track ở lần detect gần nhất tại thời điểm timestamp
+        (vận tốc không đổi), dùng cho frame không chạy detector.
+        """
+        if self._last_detected_ids is None:
+            return Detections.empty()
+        tracks = self.tracks
+        rows = tracks.lookup(self._last_detected_ids)
+        rows = rows[rows >= 0]
+        center_x, center_y = tracks.predict(rows, timestamp)
+        half_w = tracks.width[rows] / 2.0
+        half_h = tracks.height[rows] / 2.0
+        xyxy = np.column_stack([center_x - half_w, center_y - half_h,
+                                center_x + half_w, center_y + half_h])
+        return Detections(xyxy, tracks.ids[rows].copy(), tracks.cls[rows].copy(),
+                          tracks.confidence[rows].copy())
+
+    def hold_detections(self, timestamp):
+        """
+        Giữ các track của lần detect gần nhất đứng yên tại vị trí đo được,
+        dùng cho frame bị motion gate bỏ qua (cảnh không có chuyển động).
+        """
+        if self._last_detected_ids is None:
+            return Detections.empty()
+        tracks = self.tracks
+        rows = tracks.lookup(self._last_detected_ids)
+        rows = rows[rows >= 0]
+        tracks.hold(rows, timestamp)
+        half_w = tracks.width[rows] / 2.0
+        half_h = tracks.height[rows] / 2.0
+        center_x = tracks.measured_x[rows]
+        center_y = tracks.measured_y[rows]
+        xyxy = np.column_stack([center_x - half_w, center_y - half_h,
+                                center_x + half_w, center_y + half_h])
+        return Detections(xyxy, tracks.ids[rows].copy(), tracks.cls[rows].copy(),
+                          tracks.confidence[rows].copy())
+
+    def should_skip_detection(self, frame, timestamp):
+        """Motion gate: frame không có chuyển động quanh đường đếm thì không cần chạy detector"""
+        return (self.motion_gate is not None and
+                self.motion_gate.is_static(frame, self.line_position, timestamp))
+
+    def gate_stats(self):
+        """Thống kê motion gate (None nếu không bật)"""
+        return self.motion_gate.stats() if self.motion_gate is not None else None
+
+    def step(self, frame_height, timestamp, detections=None, hold=False, frame_width=None):
+        """
+        Cập nhật đếm cho frame tiếp theo.
+
+        Args:
+            detections: Kết quả detect() nếu frame này chạy detector,
+                None = frame bị bỏ qua theo stride (dùng vị trí dự đoán)
+            hold: Frame bị motion gate bỏ qua - các track giữ nguyên vị trí
+
+        Returns:
+            Detections: Box đã dùng để đếm (để vẽ)
+        """
+        predicted = detections is None
+        if self.recorder is not None:
+            flag = FLAG_HELD if hold else (FLAG_PREDICTED if predicted else FLAG_DETECTED)
+            self.recorder.append(timestamp, detections, flag, frame_height, frame_width)
+        if hold:
+            detections = self.hold_detections(timestamp)
+        elif predicted:
+            detections = self.predict_detections(timestamp)
+        else:
+            self._last_detected_ids = detections.ids[
+                np.isin(detections.classes, self.vehicle_classes)]
+        self._frame_index += 1
+        with self.timers.stage('count'):
+            self.update_counts(detections, frame_height, timestamp=timestamp, predicted=predicted,
+                               frame_width=frame_width)
+        return detections
+
+    def process_frame(self, frame, draw=True, timestamp=None):
+        """
+        Xử lý một frame: chạy detector mỗi inference_stride frame, các frame còn lại
+        dùng vị trí dự đoán nên vẫn đếm được phương tiện vượt đường đếm
+
+        Args:
+            frame: Frame BGR gốc
+            draw: Vẽ kết quả lên frame (tắt khi chạy headless để tiết kiệm CPU)
+            timestamp: Thời điểm của frame (giây, xem MediaClock); None = đồng hồ thật
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        detections, hold = None, False
+        if self.is_inference_frame():
+            # Motion gate: cảnh tĩnh thì giữ nguyên track thay vì gọi detector
+            hold = self.should_skip_detection(frame, timestamp)
+            if not hold:
+                detections = self.detect(frame)
         
-        return annotated_frame
+        # Cập nhật số lượng (kích thước theo video gốc nếu frame được giải mã thu nhỏ)
+        input_x, input_y = self.input_scale
+        detections = self.step(round(frame.shape[0] * input_y), timestamp, detections,
+                               hold=hold, frame_width=round(frame.shape[1] * input_x))
+        
+        if not draw:
+            return frame
+        
+        # Vẽ kết quả
+        return self.draw_results(frame, detections)
     
+    def replay(self, cache, progress_callback=None, progress_interval=10000, on_frame=None):
+        """
+        Đếm lại toàn bộ video từ cache detection, không chạy model.
+        Dùng cài đặt hiện tại của counter (line_position, vehicle_classes, layout...);
+        frame bỏ qua theo stride/motion gate được dự đoán lại như lúc chạy gốc.
+
+        Args:
+            cache: DetectionCache hoặc đường dẫn thư mục cache
+            progress_callback: Hàm nhận (frame_index, total_frames)
+            on_frame: Hàm nhận (frame_index, detections) sau khi đếm xong mỗi frame
+                (để ghi lại trạng thái overlay, xem playback.py)
+
+        Returns:
+            dict: Kết quả đếm {'count_up', 'count_down', 'total', 'classes', 'layout'}
+        """
+        if not isinstance(cache, DetectionCache):
+            cache = DetectionCache(cache)
+        self.reset_counts()
+        self._frame_index = 0
+        self._last_detected_ids = None
+        recorder, self.recorder = self.recorder, None
+        height, width = cache.frame_height, cache.frame_width
+        # Đọc trọn các cột theo frame một lần thay vì truy cập memory map từng frame
+        timestamps = np.asarray(cache.timestamps)
+        flags = np.asarray(cache.flags)
+        try:
+            for index in range(len(cache)):
+                flag = flags[index]
+                detections = None
+                if flag == FLAG_DETECTED:
+                    detections = Detections(*cache.frame_columns(index))
+                detections = self.step(height, float(timestamps[index]), detections,
+                                       hold=flag == FLAG_HELD, frame_width=width)
+                if on_frame is not None:
+                    on_frame(index, detections)
+                if progress_callback and (index + 1) % progress_interval == 0:
+                    progress_callback(index + 1, len(cache))
+        finally:
+            self.recorder = recorder
+        return {
+            'count_up': self.count_up,
+            'count_down': self.count_down,
+            'total': self.count_up + self.count_down,
+            'classes': self.get_class_counts(),
+            'layout': self.get_layout_counts(),
+        }
+
     def reset_counts(self):
         """Reset bộ đếm"""
         self.count_up = 0
         self.count_down = 0
         self.tracks.clear()
-        self.last_update.clear()
         self.class_counts = {
             cls: {'up': 0, 'down': 0}
             for cls in self.vehicle_classes
         }
+        if self.layout is not None:
+            self.layout.reset()
+        if self.aggregator is not None:
+            self.aggregator.reset()
+
+    def reset_tracker(self, start_frame=0):
+        """
+        Xóa trạng thái ByteTrack (dùng khi chuyển sang video mới để ID không bị nối tiếp)
+
+        Args:
+            start_frame: Chỉ số frame tiếp theo khi bắt đầu giữa video (giữ đúng
+                nhịp inference_stride và số frame trong sự kiện vượt đường đếm)
+        """
+        self._frame_index = start_frame
+        self._last_detected_ids = None
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+        if self._tracker is not None:
+            self._tracker.reset()
+        predictor = getattr(self.model, 'predictor', None)
+        for tracker in getattr(predictor, 'trackers', None) or []:
+            tracker.reset()
 
     def get_class_counts(self):
         """
@@ -288,3 +798,56 @@ class VehicleCounter:
                 'total': up + down
             }
         return summary
+
+    def set_layout(self, layout):
+        """
+        Gắn (hoặc gỡ với None) bộ đường/vùng đếm bổ sung.
+
+        Args:
+            layout: CountingLayout hoặc đường dẫn file JSON
+        """
+        if isinstance(layout, str):
+            layout = CountingLayout.load(layout, classes=self.vehicle_classes)
+        # Bitmask của các track đang có thuộc về layout cũ
+        self.tracks.lines_crossed[:] = 0
+        self.tracks.zones_inside[:] = 0
+        self.layout = layout
+        for sink in (self.aggregator, self.event_log):
+            if sink is not None:
+                sink.set_lines(self.line_names())
+
+    def detection_settings(self):
+        """
+        Các cài đặt quyết định kết quả detection (lưu trong meta của cache detection,
+        xem detection_cache.changed_settings). Đường đếm/layout không ảnh hưởng detection
+        trừ khi dùng ROI (vùng detect đi theo đường đếm).
+        """
+        return {
+            'model_path': self.model_path,
+            'backend': self.backend,
+            'int8': self.int8,
+            'inference_size': self.inference_size,
+            'vehicle_classes': [int(cls) for cls in self.vehicle_classes],
+            'roi': self.roi.spec() if self.roi is not None else None,
+            'motion_gate': self.motion_gate is not None,
+            'line_position': self.line_position,
+        }
+
+    def line_names(self):
+        """Tên các đường đếm: đường đếm chính rồi đến các đường của layout"""
+        names = [MAIN_LINE]
+        if self.layout is not None:
+            names += [line.name for line in self.layout.lines]
+        return names
+
+    def get_layout_counts(self):
+        """Số đếm của các đường/vùng bổ sung (xem CountingLayout.counts), None nếu không có"""
+        if self.layout is None:
+            return None
+        return self.layout.counts(self.class_names)
+
+
+if __name__ == '__main__':
+    # Chạy headless: python -m vehicle_counter batch <thư mục|glob>
+    from cli import main
+    main()
@@ -0,0 +1,193 @@
+"""
+Đọc video với giải mã ở độ phân giải thấp hơn nguồn.
+
+Với video 4K, cap.read() giải mã và chuyển màu đủ 3840x2160 rồi
+_prepare_inference_frame lại thu nhỏ xuống inference_size: phần lớn CPU
+nằm ở decode. FFmpegReader chạy ffmpeg trong tiến trình con, để ffmpeg
+thu nhỏ ngay sau khi giải mã (-vf scale) và trả về frame BGR thô qua pipe;
+frame được đọc thẳng vào các buffer cấp phát sẵn và dùng lại vòng tròn.
+
+FFmpegReader có cùng các hàm mà code đếm dùng của cv2.VideoCapture
+(isOpened, read, grab, get, set, release) nên thay thế trực tiếp được.
+grab() của cả hai không trả frame: với cv2 bỏ qua bước chuyển màu/copy
+(retrieve), với ffmpeg chỉ đọc bỏ dữ liệu trong pipe - dùng cho frame chỉ
+cần dự đoán vị trí theo inference_stride.
+
+Người đọc frame đặt VehicleCounter.input_scale = input_scale(cap) để box
+được đưa về tọa độ video gốc: số đếm, cache detection và phát lại không phụ
+thuộc việc có giải mã thu nhỏ hay không.
+"""
+import logging
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def ffmpeg_available(ffmpeg='ffmpeg'):
+    return shutil.which(ffmpeg) is not None
+
+
+def scaled_size(width, height, max_size):
+    """
+    Kích thước giải mã giữ tỷ lệ với cạnh dài tối đa max_size (làm tròn số chẵn).
+
+    Returns:
+        tuple: (width, height), hoặc None nếu nguồn đã đủ nhỏ
+    """
+    if not max_size or max(width, height) <= max_size:
+        return None
+    scale = max_size / max(width, height)
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+class FFmpegReader:
+    def __init__(self, path, size, fps, frame_count, source_size=None, pool_size=1,
+                 ffmpeg='ffmpeg'):
+        """
+        Args:
+            path: Video đầu vào
+            size: (width, height) sau khi thu nhỏ
+            fps, frame_count: Thông tin của video (lấy từ cv2.VideoCapture)
+            source_size: (width, height) của video gốc (None = bằng size)
+            pool_size: Số buffer dùng vòng tròn - frame trả về bởi read() bị ghi đè sau
+                pool_size lần đọc, nên phải lớn hơn số frame người gọi còn giữ cùng lúc
+            ffmpeg: Đường dẫn chương trình ffmpeg
+        """
+        self.path = path
+        self.width, self.height = size
+        self.source_size = tuple(source_size or size)
+        self.fps = fps
+        self.frame_count = frame_count
+        self.ffmpeg = ffmpeg
+        self._frame_bytes = self.width * self.height * 3
+        self._buffers = [np.empty((self.height, self.width, 3), dtype=np.uint8)
+                         for _ in range(max(1, pool_size))]
+        self._next_buffer = 0
+        # Buffer riêng cho grab(): không làm hỏng frame đang được giữ
+        self._scratch = np.empty(self._frame_bytes, dtype=np.uint8)
+        self._process = None
+        self.position = 0  # Chỉ số frame sẽ đọc tiếp theo
+        self._start(0)
+
+    def _start(self, frame_index):
+        self.release()
+        command = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin']
+        if frame_index > 0 and self.fps > 0:
+            # -ss trước -i: seek theo keyframe rồi giải mã bỏ tới đúng thời điểm
+            command += ['-ss', f'{frame_index / self.fps:.6f}']
+        command += ['-i', self.path, '-an', '-sn',
+                    '-vf', f'scale={self.width}:{self.height}:flags=area',
+                    '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, bufsize=0)
+        self.position = frame_index
+
+    def _read_into(self, view):
+        """Đọc đủ một frame vào view; False nếu hết video"""
+        filled = 0
+        stdout = self._process.stdout
+        while filled < self._frame_bytes:
+            n = stdout.readinto(view[filled:])
+            if not n:
+                return False
+            filled += n
+        self.position += 1
+        return True
+
+    def isOpened(self):
+        return self._process is not None
+
+    def read(self):
+        if self._process is None:
+            return False, None
+        frame = self._buffers[self._next_buffer]
+        if not self._read_into(memoryview(frame.reshape(-1))):
+            return False, None
+        self._next_buffer = (self._next_buffer + 1) % len(self._buffers)
+        return True, frame
+
+    def grab(self):
+        """Bỏ qua một frame (không copy vào buffer của người gọi)"""
+        return self._process is not None and self._read_into(memoryview(self._scratch))
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frame_count)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            # Thời điểm của frame vừa đọc, như cv2.VideoCapture
+            return (self.position - 1) * 1000.0 / self.fps if self.fps > 0 else 0.0
+        return 0.0
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self._start(int(value))
+        return True
+
+    def release(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        process.stdout.close()
+        if process.poll() is None:
+            process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def input_scale(cap):
+    """Tỷ lệ (x, y) từ frame đọc được về video gốc (1.0 với cv2.VideoCapture)"""
+    if not isinstance(cap, FFmpegReader):
+        return 1.0, 1.0
+    return cap.source_size[0] / cap.width, cap.source_size[1] / cap.height
+
+
+def source_frame_size(cap):
+    """(width, height) của video gốc"""
+    if isinstance(cap, FFmpegReader):
+        return cap.source_size
+    return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+
+def open_video(path, decode_size=None, pool_size=1, ffmpeg='ffmpeg'):
+    """
+    Mở video để đọc, giải mã thẳng ở kích thước nhỏ nếu có thể.
+
+    Args:
+        path: Video file (webcam/RTSP luôn dùng cv2.VideoCapture)
+        decode_size: Cạnh dài tối đa của frame giải mã (None = giữ nguyên độ phân giải)
+        pool_size: Xem FFmpegReader
+        ffmpeg: Đường dẫn chương trình ffmpeg
+
+    Returns:
+        FFmpegReader nếu cần thu nhỏ và có ffmpeg, ngược lại cv2.VideoCapture
+    """
+    cap = cv2.VideoCapture(path)
+    if not decode_size or not isinstance(path, str) or '://' in path or not cap.isOpened():
+        return cap
+    source_size = source_frame_size(cap)
+    size = scaled_size(source_size[0], source_size[1], decode_size)
+    if size is None:
+        return cap
+    if not ffmpeg_available(ffmpeg):
+        logger.warning("Không tìm thấy ffmpeg, giải mã ở độ phân giải gốc: %s", path)
+        return cap
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return FFmpegReader(path, size, fps, frame_count, source_size=source_size,
+                        pool_size=pool_size, ffmpeg=ffmpeg)
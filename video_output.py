@@ -0,0 +1,126 @@
+"""
+Ghi video đầu ra (có overlay) của bước xử lý trước.
+
+Mặc định bước xử lý trước chỉ ghi cache detection (phát lại vẽ overlay từ
+cache); video đầu ra chỉ cần khi muốn chia sẻ một file xem được ngay. Khi
+đó thường không cần đúng độ phân giải và đủ mọi frame như nguồn: OutputOptions
+cho phép thu nhỏ (size), chỉ ghi mỗi N frame (every) và mã hóa bằng ffmpeg
+libx264 preset nhanh (FFmpegWriter) - ffmpeg chạy ở tiến trình riêng nên
+việc mã hóa không chiếm CPU của luồng Python, file nhỏ hơn nhiều so với mp4v.
+
+Việc ghi chạy ở luồng encode riêng của PreprocessPipeline (queue có giới hạn).
+"""
+import logging
+import subprocess
+import tempfile
+
+import cv2
+
+from video_input import ffmpeg_available, scaled_size
+
+logger = logging.getLogger(__name__)
+
+ENCODERS = ('opencv', 'ffmpeg')
+PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium')
+
+
+class OutputOptions:
+    def __init__(self, size=None, every=1, encoder='ffmpeg', preset='veryfast', crf=28):
+        """
+        Args:
+            size: Cạnh dài tối đa của video đầu ra (None = bằng frame giải mã)
+            every: Chỉ ghi mỗi N frame (video đầu ra có FPS = FPS nguồn / N)
+            encoder: 'ffmpeg' (libx264, cần ffmpeg trong PATH; không có thì dùng opencv)
+                hoặc 'opencv' (cv2.VideoWriter mp4v)
+            preset, crf: Tham số libx264 (chỉ với ffmpeg)
+        """
+        if encoder not in ENCODERS:
+            raise ValueError(f"Encoder không hỗ trợ: {encoder} (chọn {ENCODERS})")
+        if preset not in PRESETS:
+            raise ValueError(f"Preset không hỗ trợ: {preset} (chọn {PRESETS})")
+        self.size = size
+        self.every = max(1, int(every))
+        self.encoder = encoder
+        self.preset = preset
+        self.crf = crf
+
+    def frame_size(self, width, height):
+        """
+        Kích thước (width, height) của video đầu ra từ kích thước frame giải mã, luôn
+        là số chẵn (libx264 yuv420p không nhận kích thước lẻ, vd. nguồn đã cắt ROI)
+        """
+        width, height = scaled_size(width, height, self.size) or (width, height)
+        return max(2, width // 2 * 2), max(2, height // 2 * 2)
+
+
+class FFmpegWriter:
+    def __init__(self, path, fps, size, preset='veryfast', crf=28, ffmpeg='ffmpeg'):
+        """
+        Args:
+            path: File đầu ra (.mp4)
+            fps: FPS của video đầu ra
+            size: (width, height) của frame sẽ ghi
+        """
+        if size[0] % 2 or size[1] % 2:
+            raise ValueError(f"libx264 cần kích thước chẵn: {size[0]}x{size[1]} "
+                             "(dùng OutputOptions.frame_size)")
+        self.size = size
+        command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{size[0]}x{size[1]}',
+                   '-r', f'{fps:.6f}', '-i', '-', '-an',
+                   '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+                   '-pix_fmt', 'yuv420p', '-movflags', '+faststart', path]
+        # stderr ghi ra file tạm: pipe không được đọc trong lúc ghi có thể đầy và chặn ffmpeg
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def isOpened(self):
+        return self._process is not None and self._process.poll() is None
+
+    def write(self, frame):
+        if frame.shape[1::-1] != tuple(self.size):
+            raise ValueError(f"Frame {frame.shape[1]}x{frame.shape[0]} khác kích thước "
+                             f"video đầu ra {self.size[0]}x{self.size[1]}")
+        try:
+            self._process.stdin.write(memoryview(frame.reshape(-1)))
+        except BrokenPipeError:
+            raise IOError(f"ffmpeg dừng khi ghi video: {self._error()}") from None
+
+    def _error(self):
+        self._process.wait()
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors='replace').strip()
+
+    def release(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
+        if process.returncode != 0:
+            self._stderr.seek(0)
+            logger.error("ffmpeg lỗi (mã %s): %s", process.returncode,
+                         self._stderr.read().decode(errors='replace').strip())
+        self._stderr.close()
+
+
+def open_writer(path, fps, size, options):
+    """
+    Mở bộ ghi video theo OutputOptions.
+
+    Args:
+        fps: FPS của nguồn (tự chia cho options.every)
+        size: (width, height) của frame sẽ ghi (đã thu nhỏ)
+
+    Returns:
+        FFmpegWriter hoặc cv2.VideoWriter (cùng các hàm write/release)
+    """
+    fps = (fps or 30.0) / options.every
+    if options.encoder == 'ffmpeg':
+        if ffmpeg_available():
+            return FFmpegWriter(path, fps, size, preset=options.preset, crf=options.crf)
+        logger.warning("Không tìm thấy ffmpeg, ghi video bằng OpenCV (mp4v): %s", path)
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)